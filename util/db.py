@@ -256,13 +256,13 @@ class DBSession(object):
 
     def execute(self, sSQL, commit=False, fetch=False, params=None):
         try:
-            sqlLog.debug( '%s' % sSQL)
+            sqlLog.debug( '%s', sSQL)
             # send data to defined callbacks
             for func in self.dbDef.lstExeCallbacks:
                 func(sSQL,params)
             # execute SQL
             if params:
-                sqlLog.debug( 'params:%s' % str(params))
+                sqlLog.debug( 'params:%s', params)
                 self.cur.execute( sSQL, params )
             else:
                 self.cur.execute( sSQL )
@@ -278,12 +278,12 @@ class DBSession(object):
         
     def fetchone(self):
         lst = self.cur.fetchone()
-        log.debug( 'fetchone() - %s' % lst )
+        log.debug( 'fetchone() - %s', lst )
         return lst
     
     def fetchall(self):
         lst = self.cur.fetchall()
-        log.debug( 'fetchall() - %s' % str(lst) )
+        log.debug( 'fetchall() - %s', lst )
         return lst
     
     def columns(self):
@@ -308,7 +308,7 @@ class DBSession(object):
             sql += " LIKE '%s'" % like
         self.execute( sql )
         lst = flatten(self.fetchall())
-        log.debug( 'showTables() - %s' % lst )
+        log.debug( 'showTables() - %s', lst )
         return lst
     
     def getDBServerTime(self):
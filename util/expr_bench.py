@@ -0,0 +1,300 @@
+""" expr_bench.py - benchmark and profiling harness for expression.py
+
+    Times each phase of expression processing (scan, parse, generate, evaluate, validate)
+    over a corpus of expressions. Each phase can also be run under cProfile or a sampling
+    profiler to find where the time goes.
+
+    Example:
+        python expr_bench.py -n 2000 --profile --phase evaluate
+        python expr_bench.py --check
+"""
+import sys, time, timeit, threading, cProfile, pstats, logging, math
+
+from tl_logger import TLLog
+from expression import Expression
+
+# realistic expressions - arithmetic, nested paranthesis, boolean limits and math functions
+CORPUS = [
+    '1+5+6*2',
+    '-45.67',
+    '100*sqrt(3.0)',
+    '(A+B)*(D+C)',
+    '((A+B)*(C-D))/(A*2.5e1)',
+    '(((A+B)/(C+D))*((A-B)/(C-D)))**2',
+    'abs(supply12V - 12.0) <= 12.0*0.05',
+    'abs(supply3V3 - 3.3)/3.3 < 0.03',
+    'StdDev <= 30e-12',
+    'Jitter*1e12 < 2.5',
+    '20*log10(Vout/Vin) >= 18.5',
+    'abs(20*log10(Vout/Vin) - gain) <= 0.5',
+    'floor((A+B)/3)',
+    'exp(-t/tau)*cos(2*3.14159265*freq*t)',
+    'sqrt(A**2 + B**2) < 50',
+    'atan(B/A)*180/3.14159265',
+    'abs(sin(x)**2 + cos(x)**2 - 1.0) < 1e-9',
+    '(Pout - Pin) - (PoutRef - PinRef) > -1.0',
+    'Icc*supply12V <= 2.5',
+    '-A*B + C/D - (A - -B)',
+    ]
+
+# parameter values for all variables used in CORPUS
+PARAMS = {
+    'A'         : 10.0,
+    'B'         : 20.0,
+    'C'         : 40.0,
+    'D'         : 30.0,
+    'supply12V' : 12.1,
+    'supply3V3' : 3.31,
+    'StdDev'    : 25e-12,
+    'Jitter'    : 1.8e-12,
+    'Vout'      : 2.5,
+    'Vin'       : 0.3,
+    'gain'      : 18.3,
+    't'         : 1e-6,
+    'tau'       : 2e-6,
+    'freq'      : 1e5,
+    'x'         : 0.5,
+    'Pout'      : 10.2,
+    'Pin'       : -5.0,
+    'PoutRef'   : 10.0,
+    'PinRef'    : -5.1,
+    'Icc'       : 0.15,
+    }
+
+PHASES = ['scan', 'parse', 'generate', 'evaluate', 'validate']
+
+class BenchParam(object):
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+class BenchTestObj(object):
+    """ tstObj holding the benchmark parameters """
+    def __init__(self, dct):
+        self._dct = dict( [(name, BenchParam(name, value)) for name,value in dct.items()] )
+
+    def getParameter(self, name):
+        return self._dct.get(name, None)
+
+class SamplingProfiler(threading.Thread):
+    """ sample the stack of a thread at a fixed interval and count the functions seen """
+    def __init__(self, threadId, interval=0.001):
+        threading.Thread.__init__(self, name='sampler')
+        self.daemon = True
+        self.threadId = threadId
+        self.interval = interval
+        self.samples = 0
+        self._dctSelf = {}
+        self._dctTotal = {}
+        self._evtStop = threading.Event()
+
+    def run(self):
+        while not self._evtStop.isSet():
+            frame = sys._current_frames().get( self.threadId )
+            if frame is not None:
+                self.samples += 1
+                key = self._key( frame )
+                self._dctSelf[key] = self._dctSelf.get(key, 0) + 1
+                seen = set()
+                while frame is not None:
+                    key = self._key( frame )
+                    if key not in seen:
+                        seen.add( key )
+                        self._dctTotal[key] = self._dctTotal.get(key, 0) + 1
+                    frame = frame.f_back
+            time.sleep( self.interval )
+
+    def _key(self, frame):
+        code = frame.f_code
+        return '%s:%d(%s)' % (code.co_filename.split('\\')[-1].split('/')[-1], code.co_firstlineno, code.co_name)
+
+    def stop(self):
+        self._evtStop.set()
+        self.join()
+
+    def report(self, count=15):
+        print '  %d samples' % self.samples
+        if self.samples == 0:
+            return
+        print '  %7s %7s  %s' % ('self%', 'total%', 'function')
+        lst = sorted( self._dctSelf.items(), key=lambda item: item[1], reverse=True )
+        for key,value in lst[:count]:
+            print '  %6.1f%% %6.1f%%  %s' % (100.0*value/self.samples, 100.0*self._dctTotal[key]/self.samples, key)
+
+class ExpressionBench(object):
+    """ build the setup for each phase and time it """
+    def __init__(self, lstExprs, dctParams):
+        self.lstExprs = lstExprs
+        self.tstObj = BenchTestObj( dctParams )
+        self._dctPhases = { 'scan'     : self.scan,
+                            'parse'    : self.parse,
+                            'generate' : self.generate,
+                            'evaluate' : self.evaluate,
+                            'validate' : self.validate,
+                            }
+
+    def _newExprs(self):
+        return [Expression( 'bench%d' % n, self.tstObj, expr=s ) for n,s in enumerate(self.lstExprs)]
+
+    def _generatedExprs(self):
+        lst = self._newExprs()
+        for expr in lst:
+            expr.generate()
+        return lst
+
+    def scan(self):
+        lst = self._newExprs()
+        def run():
+            for expr in lst:
+                expr.clear()
+                expr._scan()
+        return run
+
+    def parse(self):
+        lst = self._newExprs()
+        for expr in lst:
+            expr._scan()
+        def run():
+            for expr in lst:
+                expr.lstPostfix = []
+                expr._parse()
+        return run
+
+    def generate(self):
+        lst = self._newExprs()
+        def run():
+            for expr in lst:
+                expr.generate()
+        return run
+
+    def evaluate(self):
+        lst = self._generatedExprs()
+        def run():
+            for expr in lst:
+                expr.getValue()
+        return run
+
+    def validate(self):
+        lst = self._generatedExprs()
+        def run():
+            for expr in lst:
+                expr.validate()
+        return run
+
+    def getRunner(self, phase):
+        """ return a function that runs the phase once over all expressions """
+        return self._dctPhases[phase]()
+
+    def time(self, phase, number, repeat):
+        """ return best time per expression for phase """
+        run = self.getRunner( phase )
+        best = min( timeit.repeat( run, number=number, repeat=repeat ))
+        return best / (number * len(self.lstExprs))
+
+    def profile(self, phase, number, count=15):
+        run = self.getRunner( phase )
+        prof = cProfile.Profile()
+        prof.enable()
+        for _ in xrange(number):
+            run()
+        prof.disable()
+        stats = pstats.Stats( prof, stream=sys.stdout )
+        stats.strip_dirs().sort_stats( 'cumulative' ).print_stats( count )
+
+    def sample(self, phase, number, interval, count=15):
+        run = self.getRunner( phase )
+        sampler = SamplingProfiler( threading.currentThread().ident, interval )
+        sampler.start()
+        for _ in xrange(number):
+            run()
+        sampler.stop()
+        sampler.report( count )
+
+def checkCorpus(lstExprs, dctParams):
+    """ compare the value of each expression with python eval() and run each phase once,
+        return a list of failure messages
+    """
+    dctNames = dict( [(name, getattr( math, name )) for name in dir(math) if not name.startswith('_')] )
+    dctNames['abs'] = abs
+    dctNames.update( dctParams )
+    lstFail = []
+    bench = ExpressionBench( lstExprs, dctParams )
+    for expr in bench._generatedExprs():
+        try:
+            value = expr.getValue()
+        except Exception,err:
+            lstFail.append( '"%s" fail - %s' % (expr.expr, err) )
+            continue
+        expect = eval( expr.expr, dctNames )
+        if abs( value - expect ) > 1e-9 * max( 1.0, abs(expect) ):
+            lstFail.append( '"%s" is %r, expecting %r' % (expr.expr, value, expect) )
+    for phase in PHASES:
+        try:
+            bench.getRunner( phase )()
+        except Exception,err:
+            lstFail.append( 'phase %s fail - %s' % (phase, err) )
+    return lstFail
+
+def readCorpus(filename):
+    """ read expressions from a file, one per line, # starts a comment """
+    lst = []
+    fp = open( filename, 'r' )
+    try:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                lst.append( line )
+    finally:
+        fp.close()
+    return lst
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option( "-n",  "--number", dest="number", type="int", default=1000,
+                       help="Number of passes over the corpus per timing. Default is 1000" )
+    parser.add_option( "-r",  "--repeat", dest="repeat", type="int", default=3,
+                       help="Number of timings, best is reported. Default is 3" )
+    parser.add_option( "-p",  "--phase", dest="lstPhases", default=','.join(PHASES),
+                       help='Comma separated list of phases. Default is "%s"' % ','.join(PHASES) )
+    parser.add_option( "-c",  "--corpus", dest="corpus", default=None,
+                       help="File of expressions, one per line. Default is the built-in corpus" )
+    parser.add_option( "",  "--profile", action="store_true", dest="profile", default=False,
+                       help="Run each phase under cProfile" )
+    parser.add_option( "",  "--sample", action="store_true", dest="sample", default=False,
+                       help="Run each phase under the sampling profiler" )
+    parser.add_option( "",  "--interval", dest="interval", type="float", default=0.001,
+                       help="Sampling profiler interval in seconds. Default is 0.001" )
+    parser.add_option( "",  "--count", dest="count", type="int", default=15,
+                       help="Number of functions shown by the profilers. Default is 15" )
+    parser.add_option( "",  "--check", action="store_true", dest="check", default=False,
+                       help="Check the corpus values against python and each phase runs, then exit" )
+    (options, args) = parser.parse_args()
+
+    # keep expression logging at the default level so the numbers include its cost
+    TLLog.setConsoleHandlerLevel( logging.CRITICAL )
+
+    lstExprs = CORPUS
+    if options.corpus:
+        lstExprs = readCorpus( options.corpus )
+    lstPhases = options.lstPhases.split(',')
+    for phase in lstPhases:
+        if phase not in PHASES:
+            parser.error( 'phase "%s" not valid, expecting one of %s' % (phase, PHASES))
+
+    if options.check:
+        lstFail = checkCorpus( lstExprs, PARAMS )
+        for s in lstFail:
+            print s
+        print 'Expression benchmark check - %d expressions, %d failures' % (len(lstExprs), len(lstFail))
+        sys.exit( 1 if lstFail else 0 )
+
+    bench = ExpressionBench( lstExprs, PARAMS )
+    print 'Expression benchmark - %d expressions, number:%d repeat:%d' % (len(lstExprs), options.number, options.repeat)
+    for phase in lstPhases:
+        secs = bench.time( phase, options.number, options.repeat )
+        print '%-10s %10.2f us/expr' % (phase, secs*1e6)
+        if options.profile:
+            bench.profile( phase, options.number, options.count )
+        if options.sample:
+            bench.sample( phase, options.number, options.interval, options.count )
@@ -14,7 +14,8 @@
 
         Operators available in expressions:
           + - * /     : Basic arithematic operators
-          **          : Raise to a power (Ex. 2**4 = 16)
+          **          : Raise to a power (Ex. 2**4 = 16), left to right (Ex. 2**3**2 = 8**2)
+          + -         : Unary plus and minus are allowed at the start of any operand (Ex. 2*-3)
 
         Built-in functions available in expressions:
           abs(x)                  : absolute value of x
@@ -26,6 +27,20 @@
           log(x)                  : natural log of x
           log10(x)                : base 10 log of x
           floor(x)                : returns x to the largest integer not greater then x
+          min(x,y,...)            : smallest of two or more values
+          max(x,y,...)            : largest of two or more values
+          pow(x,y)                : returns x**y
+          hypot(x,y)              : returns sqrt(x*x + y*y)
+
+        Array functions, for variables with an array value (Ex. a frequency sweep). These need numpy.
+        Arithmetic, boolean operators and the functions above work element by element on arrays.
+          min(a) max(a)           : smallest and largest element
+          mean(a)                 : average of the elements
+          std(a)                  : standard deviation of the elements
+          rms(a)                  : root mean square of the elements
+          percentile(a,p)         : p-th percentile of the elements, p in 0..100
+          count_if(a <op> x)      : number of elements where the boolean expression is true
+                                    Ex. count_if(abs(resp - ref) > 3.0) <= 2
 
         Boolean operators are available to perform boolean expressions, Example (StdDev <= 30e-12). Only ONE boolean operator should be
         used in an expression. The result value of a boolean expression will be 1.0 for true and 0.0 for false.
@@ -39,63 +54,164 @@
 
  """
 
-import math,logging
+import math,operator,logging,re,marshal,multiprocessing,os,hashlib
 
-from ascii import *
 from tl_logger import TLLog
 log = TLLog.getLogger( 'expr' )
 
-# States for Scanning of expressions
-START = 'START'
-TOP = 'TOP'
-NAME = 'NAME'
-NUMBER = 'NUMBER'
-NUMBER_EXP = 'NUMBER_EXP'
-NUMBER_DEC = 'NUMBER_DEC'
-PARAN = 'PARAN'
+try:
+    import numpy
+except ImportError:
+    # array functions not available
+    numpy = None
+
+# version of the generated program layout, ExpressionCache files are also invalidated
+# when the source of this module changes, see _cacheVersion()
+__version__ = '1.0'
+
+# name followed by "(", a function call
+_reCall = re.compile( r'\s*\(' )
+
+# Scanner for infix tokens, whitespace between tokens is skipped
+_reToken = re.compile( r"""\s*(?:
+        (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?) |
+        (?P<name>[A-Za-z][A-Za-z0-9_]*) |
+        (?P<sep>[(),]) |
+        (?P<op>\*\*|->|==|!=|>=|<=|[-+*/<>]) )""", re.VERBOSE )
 
 class ExprException(Exception):
     pass
 
 class Operator(object):
-    """ Operator definition class, all public """
-    def __init__(self, sID, iPrec, bBO = False):
+    """ Operator definition class, all public 
+
+        func is called with the operands in expression order, nMin/nMax are the number
+        of operands allowed, nMax None for any number. Functions are operators called by name.
+        A function with varName set is only a function when followed by "(", otherwise the
+        name is a variable (for names like mean or max that are also used as parameters).
+    """
+    def __init__(self, sID, iPrec, bBO = False, bRA = False, func = None, nMin = 2, nMax = 2, bFunc = False, bVarName = False):
         self.ID = sID
         self.prec = iPrec
         self.booleanOp = bBO
+        self.rightAssoc = bRA
+        self.func = func
+        self.nMin = nMin
+        self.nMax = nMax
+        self.function = bFunc
+        self.varName = bVarName
+
+def _Func(sID, func, nMin=1, nMax=1, bVarName=False):
+    """ create a built-in function Operator """
+    return Operator( sID, 25, False, False, func, nMin, nMax, True, bVarName )
+
+def _asArray(sID, values):
+    if numpy is None:
+        raise ExprException( '%s() fail - numpy is not installed' % sID )
+    return numpy.asarray( values )
+
+def _Math(func, sNumpy):
+    """ math module function, numpy ufunc sNumpy is used when called with an array """
+    def mathFunc(x):
+        try:
+            return func(x)
+        except TypeError:
+            if numpy is None or not isinstance(x, numpy.ndarray):
+                raise
+            return getattr(numpy, sNumpy)(x)
+    return mathFunc
+
+def _Math2(func, sNumpy):
+    """ two parameter math module function, numpy ufunc sNumpy is used when called with arrays """
+    def mathFunc(x, y):
+        try:
+            return func(x, y)
+        except TypeError:
+            if numpy is None or not (isinstance(x, numpy.ndarray) or isinstance(y, numpy.ndarray)):
+                raise
+            return getattr(numpy, sNumpy)(x, y)
+    return mathFunc
+
+def _min(*args):
+    """ min of an array or of two or more values """
+    if len(args) == 1:
+        return _asArray( 'min', args[0] ).min()
+    if numpy is not None and [arg for arg in args if isinstance(arg, numpy.ndarray)]:
+        return reduce( numpy.minimum, args )
+    return min( args )
+
+def _max(*args):
+    """ max of an array or of two or more values """
+    if len(args) == 1:
+        return _asArray( 'max', args[0] ).max()
+    if numpy is not None and [arg for arg in args if isinstance(arg, numpy.ndarray)]:
+        return reduce( numpy.maximum, args )
+    return max( args )
+
+def _mean(values):
+    return _asArray( 'mean', values ).mean()
+
+def _std(values):
+    return _asArray( 'std', values ).std()
+
+def _rms(values):
+    a = _asArray( 'rms', values )
+    return numpy.sqrt( numpy.mean( a*a ))
+
+def _percentile(values, pct):
+    # _asArray first, it raises ExprException when numpy is not installed
+    a = _asArray( 'percentile', values )
+    return numpy.percentile( a, pct )
+
+def _countIf(values):
+    a = _asArray( 'count_if', values )
+    return numpy.count_nonzero( a )
 
 class Token(object):
     """ base class for all tokens """
-    _sValidChars  = '+-*/=!()<>'
+    _sValidChars  = '+-*/=!()<>,'
     _sUnaryOps    = '+-'
-    _dctOperators = { '+'     : Operator( "+", 10, False ), 
-                      '-'     : Operator( "-", 10, False ), 
-                      '*'     : Operator( "*", 20, False ), 
-                      '/'     : Operator( "/", 20, False ), 
-                      '**'    : Operator( "**", 22, False ), 
-                      'abs'   : Operator( "abs", 25, False ), 
-                      'acos'  : Operator( "acos", 25, False ), 
-                      'asin'  : Operator( "asin", 25, False ), 
-                      'atan'  : Operator( "atan", 25, False ), 
-                      'cos'   : Operator( "cos", 25, False ), 
-                      'cosh'  : Operator( "cosh", 25, False ), 
-                      'exp'   : Operator( "exp", 25, False ), 
-                      'log'   : Operator( "log", 25, False ), 
-                      'log10' : Operator( "log10", 25, False ), 
-                      'sin'   : Operator( "sin", 25, False ), 
-                      'sinh'  : Operator( "sinh", 25, False ), 
-                      'sqrt'  : Operator( "sqrt", 25, False ), 
-                      'tan'   : Operator( "tan", 25, False ), 
-                      'tanh'  : Operator( "tanh", 25, False ), 
-                      'floor' : Operator( "floor", 25, False ), 
+    _dctOperators = { '+'     : Operator( "+", 10, False, False, operator.add ), 
+                      '-'     : Operator( "-", 10, False, False, operator.sub ), 
+                      '*'     : Operator( "*", 20, False, False, operator.mul ), 
+                      '/'     : Operator( "/", 20, False, False, operator.div ), 
+                      '**'    : Operator( "**", 22, False, False, _Math2( math.pow, 'power' )), 
+                      'abs'   : _Func( "abs", _Math( math.fabs, 'fabs' )), 
+                      'acos'  : _Func( "acos", _Math( math.acos, 'arccos' )), 
+                      'asin'  : _Func( "asin", _Math( math.asin, 'arcsin' )), 
+                      'atan'  : _Func( "atan", _Math( math.atan, 'arctan' )), 
+                      'cos'   : _Func( "cos", _Math( math.cos, 'cos' )), 
+                      'cosh'  : _Func( "cosh", _Math( math.cosh, 'cosh' )), 
+                      'exp'   : _Func( "exp", _Math( math.exp, 'exp' )), 
+                      'log'   : _Func( "log", _Math( math.log, 'log' )), 
+                      'log10' : _Func( "log10", _Math( math.log10, 'log10' )), 
+                      'sin'   : _Func( "sin", _Math( math.sin, 'sin' )), 
+                      'sinh'  : _Func( "sinh", _Math( math.sinh, 'sinh' )), 
+                      'sqrt'  : _Func( "sqrt", _Math( math.sqrt, 'sqrt' )), 
+                      'tan'   : _Func( "tan", _Math( math.tan, 'tan' )), 
+                      'tanh'  : _Func( "tanh", _Math( math.tanh, 'tanh' )), 
+                      'floor' : _Func( "floor", _Math( math.floor, 'floor' )), 
+                      'min'   : _Func( "min", _min, 1, None, True ), 
+                      'max'   : _Func( "max", _max, 1, None, True ), 
+                      'pow'   : _Func( "pow", _Math2( math.pow, 'power' ), 2, 2, True ), 
+                      'hypot' : _Func( "hypot", _Math2( math.hypot, 'hypot' ), 2, 2, True ), 
+                      'mean'  : _Func( "mean", _mean, bVarName=True ), 
+                      'std'   : _Func( "std", _std, bVarName=True ), 
+                      'rms'   : _Func( "rms", _rms, bVarName=True ), 
+                      'percentile' : _Func( "percentile", _percentile, 2, 2, True ), 
+                      'count_if'   : _Func( "count_if", _countIf, bVarName=True ), 
                       '->'    : Operator( "->", 30, False ), 
-                      '=='    : Operator( "==", 5, True ), 
-                      '!='    : Operator( "!=", 5, True ), 
-                      '>='    : Operator( ">=", 5, True ), 
-                      '<='    : Operator( "<=", 5, True ), 
-                      '>'     : Operator( ">", 5, True ), 
-                      '<'     : Operator( "<", 5, True ), 
+                      '=='    : Operator( "==", 5, True, False, operator.eq ), 
+                      '!='    : Operator( "!=", 5, True, False, operator.ne ), 
+                      '>='    : Operator( ">=", 5, True, False, operator.ge ), 
+                      '<='    : Operator( "<=", 5, True, False, operator.le ), 
+                      '>'     : Operator( ">", 5, True, False, operator.gt ), 
+                      '<'     : Operator( "<", 5, True, False, operator.lt ), 
                       }
+    # + and - with one operand
+    _dctUnaryOperators = { '+' : Operator( "+", 10, False, False, operator.pos, 1, 1 ),
+                           '-' : Operator( "-", 10, False, False, operator.neg, 1, 1 ),
+                           }
 
     @staticmethod
     def IsValidChar(ch):
@@ -110,7 +226,15 @@ class Token(object):
         return sOP in Token._dctOperators
 
     @staticmethod
-    def GetOperator(sOP):
+    def IsVariableName(sName, bCall):
+        """ True if name is a variable, bCall is True when the name is followed by "(" """
+        op = Token._dctOperators.get( sName )
+        return op is None or (op.varName and not bCall)
+
+    @staticmethod
+    def GetOperator(sOP, paramCount=2):
+        if paramCount == 1 and sOP in Token._dctUnaryOperators:
+            return Token._dctUnaryOperators[sOP]
         if sOP in Token._dctOperators:
             return Token._dctOperators[sOP]
         raise ExprException( 'Operator \"%s\" not found' % sOP ) 
@@ -130,6 +254,10 @@ class Token(object):
     def getVars(self):
         return []
 
+    def toProgram(self):
+        """ return the tuple stored for this token in a generated program """
+        raise ExprException( 'toProgram() fail - %s token "%s" is not part of a program' % (self.getType(), self.token))
+
     def show(self, indent, bScanOrParse=False):
         log.info( '%s%-10s : %s' % (indent, self.getType(), self.token))
 
@@ -144,92 +272,63 @@ class OperandToken(Token):
         return True
 
 class OperatorToken(Token):
+    """ operator or function, the Operator definition and function are resolved when created """
     def __init__( self, token, paramCount=2 ):
         Token.__init__(self, token)
         self.paramCount = paramCount
+        self.op = Token.GetOperator( token, paramCount )
+        if self.op.func is None:
+            raise ExprException( 'Operator "%s" not supported' % token )
+        self.func = self.op.func
+        self.prec = self.op.prec
 
     def isOperator(self):
         return True
 
+    def isFunction(self):
+        return self.op.function
+
     def getType(self):
         return 'Operator'
 
+    def toProgram(self):
+        return ('O', self.token, self.paramCount)
+
     def isBoolean(self):
-        op = Token.GetOperator( self.token )
-        return op.booleanOp
+        return self.op.booleanOp
 
     def precedence(self):
-        op = Token.GetOperator( self.token )
-        return op.prec
+        return self.prec
+
+    def isRightAssoc(self):
+        return self.op.rightAssoc
+
+    def setParamCount(self, paramCount):
+        """ set the number of function parameters found by the parser """
+        op = self.op
+        if paramCount < op.nMin or (op.nMax is not None and paramCount > op.nMax):
+            if op.nMax is None:
+                sExpect = 'at least %d' % op.nMin
+            elif op.nMin == op.nMax:
+                sExpect = '%d' % op.nMin
+            else:
+                sExpect = '%d to %d' % (op.nMin, op.nMax)
+            raise ExprException( 'Parse error - function "%s" called with %d parameters, expecting %s' % (self.token, paramCount, sExpect))
+        self.paramCount = paramCount
 
     def getValue(self, lst):
+        """ apply the operator, lst holds the operands popped from the stack (last operand first) """
         if len(lst) != self.paramCount:
-            raise ExprException( 'OperatorToken getValue() fail - incorrect parameter count %d (expecting %d) for operator "%s"' % (len(lstParams),self.paramCount,self.token)) 
-
-        value = None
-        if self.paramCount == 1:
-            # unary operator
-            if self.token == '+':
-                value = lst[0]
-            elif self.token == '-':
-                value = -lst[0]
-            elif self.token == 'abs':
-                value = math.fabs(lst[0])
-            elif self.token == 'acos':
-                value = math.acos(lst[0])
-            elif self.token == 'asin':
-                value = math.asin(lst[0])
-            elif self.token == 'atan':
-                value = math.atan(lst[0])
-            elif self.token == 'cos':
-                value = math.cos(lst[0])
-            elif self.token == 'exp':
-                value = math.exp(lst[0])
-            elif self.token == 'log':
-                value = math.log(lst[0])
-            elif self.token == 'log10':
-                value = math.log10(lst[0])
-            elif self.token == 'sin':
-                value = math.sin(lst[0])
-            elif self.token == 'sqrt':
-                value = math.sqrt(lst[0])
-            elif self.token == 'tan':
-                value = math.tan(lst[0])
-            elif self.token == 'floor':
-                value = math.floor(lst[0])
-            else:
-                raise ExprException( 'OperatorToken getValue() fail - Token "%s" not supported for one parameter' % self.token) 
-
-        elif self.paramCount == 2:
-            # 2 parameters 
-            if self.token == '+':
-                value = lst[1] + lst[0]
-            elif self.token == '-':
-                value = lst[1] - lst[0]
-            elif self.token == '*':
-                value = lst[1] * lst[0]
-            elif self.token == '/':
-                value = lst[1] / lst[0]
-            elif self.token == '**':
-                value = math.pow( lst[1], lst[0])
-            elif self.token == '==':
-                value = lst[1] == lst[0]
-            elif self.token == '!=':
-                value = lst[1] != lst[0]
-            elif self.token == '>':
-                value = lst[1] > lst[0]
-            elif self.token == '>=':
-                value = lst[1] >= lst[0]
-            elif self.token == '<':
-                value = lst[1] < lst[0]
-            elif self.token == '<=':
-                value = lst[1] <= lst[0]
-            else:
-                raise ExprException( 'OperatorToken getValue() fail - Token "%s" not supported for 2 parameters' % self.token) 
-        else:
-            raise ExprException( 'OperatorToken getValue() fail - Token "%s" not supported for %d parameters' % (self.token, len(lst)))
-        # return the value
-        return value
+            raise ExprException( 'OperatorToken getValue() fail - incorrect parameter count %d (expecting %d) for operator "%s"' % (len(lst),self.paramCount,self.token)) 
+        return self.func( *lst[::-1] )
+
+class SeparatorToken(Token):
+    """ paranthesis or comma, only used in the infix token list """
+    def __init__(self, token):
+        Token.__init__(self, token)
+
+    def getType(self):
+        return 'Separator'
 
 class VariableToken(OperandToken):
     def __init__(self, token, tstObj):
@@ -239,6 +338,9 @@ class VariableToken(OperandToken):
     def getType(self):
         return 'Variable'
 
+    def toProgram(self):
+        return ('V', self.token)
+
     def getValue(self):
         param = self.tstObj.getParameter( self.token )
         if param is None:
@@ -274,6 +376,9 @@ class IntToken(ConstantToken):
     def getType(self):
         return 'Int'
 
+    def toProgram(self):
+        return ('I', self.token)
+
 class FloatToken(ConstantToken):
     def __init__(self, token):
         ConstantToken.__init__(self, token)
@@ -282,8 +387,281 @@ class FloatToken(ConstantToken):
     def getType(self):
         return 'Float'
 
+    def toProgram(self):
+        return ('F', self.token)
+
+# cache version of this module, see _cacheVersion()
+_sCacheVersion = None
+
+def _cacheVersion():
+    """ __version__ and a digest of the module source, so any change to the operators or
+        the parser invalidates cached programs. The operator table is used without the source.
+    """
+    global _sCacheVersion
+    if _sCacheVersion is None:
+        try:
+            fp = open( os.path.splitext( __file__ )[0] + '.py', 'rb' )
+            try:
+                data = fp.read()
+            finally:
+                fp.close()
+        except IOError:
+            data = repr( sorted( [(op.ID, op.prec, op.booleanOp, op.rightAssoc, op.nMin, op.nMax, op.function, op.varName)
+                                  for op in Token._dctOperators.values()] ))
+        _sCacheVersion = '%s-%s' % (__version__, hashlib.md5( data ).hexdigest())
+    return _sCacheVersion
+
+class ExpressionCache(object):
+    """ On-disk cache of generated expression programs keyed by expression text.
+
+        The file is read on the first lookup and is discarded when it was written by a
+        different version of this module, see _cacheVersion(). Call save() to write new
+        programs back. getProgram() keeps the ExpressionProgram built for each expression
+        so expressions generated again share it.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self._dctPrograms = None
+        self._dctBuilt = {}
+        self._dirty = False
+
+    def _load(self):
+        """ read the cache file """
+        self._dctPrograms = {}
+        try:
+            fp = open( self.filename, 'rb' )
+        except IOError:
+            log.debug( 'ExpressionCache - "%s" not found', self.filename )
+            return
+        try:
+            try:
+                version, dct = marshal.load( fp )
+            finally:
+                fp.close()
+        except Exception,err:
+            log.warn( 'ExpressionCache - "%s" ignored - %s' % (self.filename, err))
+            return
+        if version != _cacheVersion():
+            log.info( 'ExpressionCache - "%s" version %s ignored, expecting %s' % (self.filename, version, _cacheVersion()))
+            return
+        self._dctPrograms = dct
+        log.debug( 'ExpressionCache - loaded %d programs from "%s"', len(dct), self.filename)
+
+    def get(self, expr):
+        """ return the program for expr or None if not cached """
+        if self._dctPrograms is None:
+            self._load()
+        return self._dctPrograms.get( expr )
+
+    def getProgram(self, expr):
+        """ return the ExpressionProgram for expr or None if not cached """
+        program = self._dctBuilt.get( expr )
+        if program is None:
+            code = self.get( expr )
+            if code is None:
+                return None
+            program = self._dctBuilt[expr] = ExpressionProgram( expr, code )
+        return program
+
+    def put(self, expr, program):
+        """ add a generated program """
+        if self._dctPrograms is None:
+            self._load()
+        if self._dctPrograms.get( expr ) != program:
+            self._dctPrograms[expr] = program
+            self._dctBuilt.pop( expr, None )
+            self._dirty = True
+
+    def save(self):
+        """ write the cache file if any programs were added. A temporary file is renamed over
+            the cache file so a crash or another process never sees a partly written file.
+        """
+        if not self._dirty:
+            return
+        tmpName = '%s.%d.tmp' % (self.filename, os.getpid())
+        fp = open( tmpName, 'wb' )
+        try:
+            marshal.dump( (_cacheVersion(), self._dctPrograms), fp )
+        finally:
+            fp.close()
+        try:
+            os.rename( tmpName, self.filename )
+        except OSError:
+            # windows does not rename over an existing file
+            os.remove( self.filename )
+            os.rename( tmpName, self.filename )
+        self._dirty = False
+        log.debug( 'ExpressionCache - saved %d programs to "%s"', len(self._dctPrograms), self.filename)
+
+    def clear(self):
+        self._dctPrograms = {}
+        self._dctBuilt = {}
+        self._dirty = True
+
+    def __len__(self):
+        if self._dctPrograms is None:
+            self._load()
+        return len(self._dctPrograms)
+
+# ExpressionProgram instructions
+PUSH_CONST = 0
+PUSH_VAR   = 1
+APPLY      = 2
+
+class ExpressionProgram(object):
+    """ Immutable compiled expression.
+
+        Built from the plain tuples returned by Expression.getProgram(). Variables are
+        referenced by slot, the parameters for the slots are held by an EvalContext so
+        one program can be evaluated by many threads or DUTs at the same time.
+    """
+    def __init__(self, expr, code):
+        self.expr = expr
+        self.code = tuple(code)
+        lstVars = []
+        lstInstrs = []
+        booleanOp = False
+        for instr in self.code:
+            kind = instr[0]
+            booleanOp = False
+            if kind == 'V':
+                name = instr[1]
+                if name not in lstVars:
+                    lstVars.append( name )
+                lstInstrs.append( (PUSH_VAR, lstVars.index(name), 0) )
+            elif kind == 'O':
+                op = Token.GetOperator( instr[1], instr[2] )
+                if op.func is None:
+                    raise ExprException( 'Operator "%s" not supported' % instr[1] )
+                lstInstrs.append( (APPLY, op.func, instr[2]) )
+                booleanOp = op.booleanOp
+            elif kind == 'I':
+                lstInstrs.append( (PUSH_CONST, int(instr[1]), 0) )
+            elif kind == 'F':
+                lstInstrs.append( (PUSH_CONST, float(instr[1]), 0) )
+            else:
+                raise ExprException( 'ExpressionProgram fail - unknown program entry %s' % (instr,))
+        if not lstInstrs:
+            raise ExprException( 'ExpressionProgram fail - expression "%s" is empty' % expr )
+        self.lstVars = tuple(lstVars)
+        self._instrs = tuple(lstInstrs)
+        self.booleanOp = booleanOp
+
+    def isBoolean(self):
+        return self.booleanOp
+
+    def newContext(self, tstObj):
+        """ return a new EvalContext for evaluating this program with the parameters of tstObj """
+        return EvalContext( self, tstObj )
+
+    def evaluate(self, ctx):
+        """ evaluate the program with the parameters bound in ctx """
+        if self.lstVars:
+            params = ctx.lstParams
+            version = getattr( ctx.tstObj, 'paramVersion', None )
+            # bind on first use or when the parameter set has changed
+            if params is None or version != ctx.paramVersion or (version is None and not ctx.isCurrent()):
+                if not ctx.bind():
+                    raise ExprException( 'Variable "%s" getValue() fail' % ctx.lstMissing[0] )
+                params = ctx.lstParams
+
+        stk = []
+        push = stk.append
+        for kind,arg,n in self._instrs:
+            if kind == PUSH_VAR:
+                push( params[arg].value )
+            elif kind == PUSH_CONST:
+                push( arg )
+            elif n == 1:
+                stk[-1] = arg( stk[-1] )
+            elif n == 2:
+                right = stk.pop()
+                stk[-1] = arg( stk[-1], right )
+            else:
+                args = stk[-n:]
+                del stk[-n:]
+                push( arg( *args ))
+        return stk[-1]
+
+    def __str__(self):
+        return 'ExpressionProgram "%s" vars:%s' % (self.expr, self.lstVars)
+
+class EvalContext(object):
+    """ Per-caller state for evaluating an ExpressionProgram.
+
+        Holds the tstObj parameters bound to the program variable slots. Parameters are bound
+        on the first evaluation and again when the paramVersion attribute of tstObj changes.
+        A tstObj without paramVersion has its parameters looked up on every evaluation and
+        they are bound again when one is not the object bound, see isCurrent().
+        A context must only be used by one thread at a time.
+    """
+    def __init__(self, program, tstObj):
+        self.program = program
+        self.tstObj = tstObj
+        self.lstParams = None
+        self.lstMissing = []
+        self.paramVersion = None
+
+    def bind(self):
+        """ resolve the program variables to their parameters, return True if all were found """
+        tstObj = self.tstObj
+        lstVars = self.program.lstVars
+        if lstVars and tstObj is None:
+            raise ExprException( 'Expression "%s" has variables and tstObj has not been set' % self.program.expr )
+        self.paramVersion = getattr( tstObj, 'paramVersion', None )
+        lstParams = [tstObj.getParameter( name ) for name in lstVars]
+        self.lstMissing = [name for name,param in zip(lstVars, lstParams) if param is None]
+        if self.lstMissing:
+            # retry on next evaluation
+            self.lstParams = None
+            return False
+        self.lstParams = lstParams
+        return True
+
+    def isCurrent(self):
+        """ True if every bound parameter is still the parameter tstObj returns for its name """
+        getParameter = self.tstObj.getParameter
+        for name,param in zip( self.program.lstVars, self.lstParams ):
+            if getParameter( name ) is not param:
+                return False
+        return True
+
+    def unbind(self):
+        """ release bound parameters, next evaluation will bind again """
+        self.lstParams = None
+
+    def evaluate(self):
+        return self.program.evaluate( self )
+
 class Expression(OperandToken):
-    """ Expression processing class """
+    """ Expression processing class 
+
+        generate() builds the postfix tokens and an immutable ExpressionProgram in self.program.
+        The Expression evaluates the program with its own EvalContext for tstObj, other threads
+        should share self.program and create their own context with program.newContext().
+
+        Variables are bound to their tstObj parameters on the first evaluation. If tstObj
+        has a paramVersion attribute, later evaluations do no name lookups, it is checked
+        once per evaluation and the variables are re-bound when it changes. Without
+        paramVersion each parameter is looked up and the variables re-bound when a
+        parameter object was replaced.
+
+        generate() looks up the program in the ExpressionCache set with setCache(), if any,
+        and only scans and parses expressions that are not already cached. Cached programs
+        are used directly, no tokens are created, so lstPostfix is empty.
+    """
+    # shared ExpressionCache, None to always generate
+    _cache = None
+
+    @staticmethod
+    def setCache(cache):
+        """ set the ExpressionCache used by generate(), None to disable """
+        Expression._cache = cache
+
+    @staticmethod
+    def getCache():
+        return Expression._cache
+
     def __init__(self, name, tstObj, pData=None, expr=None):
         OperandToken.__init__(self, None)
         self.name = name
@@ -317,50 +695,98 @@ class Expression(OperandToken):
         self.lstPostfix = []
         self.hasVariables = False
         self.value = None
+        self.program = None
+        self._ctx = None
+
+    def _getContext(self):
+        """ return the EvalContext for tstObj, a new one if tstObj was changed """
+        ctx = self._ctx
+        if ctx is None or ctx.tstObj is not self.tstObj:
+            if self.program is None:
+                raise ExprException( "Expression fail -- generate() has not been performed" )
+            ctx = self._ctx = self.program.newContext( self.tstObj )
+        return ctx
+
+    def bind(self):
+        """ bind all variables to their parameters, return True if all were found """
+        return self._getContext().bind()
+
+    def unbind(self):
+        """ release bound parameters, next evaluation will bind again """
+        if self._ctx is not None:
+            self._ctx.unbind()
 
     def generate(self):
         """ generate the postfix tokens """ 
-        log.debug( 'Expression generate() - Expr "%s"' % self.expr)
+        log.debug( 'Expression generate() - Expr "%s"', self.expr)
         self.clear()
+        cache = Expression._cache
+        if cache is not None:
+            program = cache.getProgram( self.expr )
+            if program is not None:
+                self.program = program
+                self.hasVariables = bool( program.lstVars )
+                return
         # scan the infix expression for infix tokens 
         self._scan()
         # log infix tokens
-        log.debug( 'Scan Tokens: %d total' % len(self.lstTokens))
+        log.debug( 'Scan Tokens: %d total', len(self.lstTokens))
         if log.isEnabledFor( logging.DEBUG):
             for tok in self.lstTokens:
                 tok.show( ' ', False)
         # generate the postfix tokens from the infix tokens
         self._parse()
         # log infix tokens
-        log.debug( 'Postfix Tokens: %d total' % len(self.lstPostfix))
+        log.debug( 'Postfix Tokens: %d total', len(self.lstPostfix))
         if log.isEnabledFor( logging.DEBUG):
             for tok in self.lstPostfix:
                 tok.show( ' ', True)
+        self.program = ExpressionProgram( self.expr, [tok.toProgram() for tok in self.lstPostfix] )
+        if cache is not None:
+            cache.put( self.expr, self.getProgram() )
+
+    def getProgram(self):
+        """ return the generated program as a tuple of plain tuples """
+        if self.program is None:
+            raise ExprException( "getProgram() fail -- generate() has not been performed" )
+        return self.program.code
+
+    def loadProgram(self, program):
+        """ use a program returned by getProgram(), no postfix tokens are created """
+        self.clear()
+        self.program = ExpressionProgram( self.expr, program )
+        self.hasVariables = bool( self.program.lstVars )
 
     def validate(self):
         log.info( 'Expression validate() - Expr "%s"' % self.expr)
         # Verify all variables exist
-        for tok in self.lstPostfix:
-            if not tok.isOK():
-                return False
-        return True
+        return self.isOK()
 
     def getVariables(self):
         pass
 
     def isOK(self):
-        for tok in self.lstPostfix:
-            if not tok.isOK():
-                return False
+        if not self.hasVariables:
+            return True
+        ctx = self._getContext()
+        if ctx.lstParams is None and not ctx.bind():
+            for name in ctx.lstMissing:
+                log.error( 'Variable "%s" not found' % name )
+            return False
         return True
 
     def getVars(self):
+        if not self.lstPostfix and self.program is not None:
+            # loaded from a program
+            return [instr[1] for instr in self.program.code if instr[0] == 'V']
         lst = []
         for tok in self.lstPostfix:
             lst.extend( tok.getVars() )
         return lst
 
     def isBoolean(self):
+        if not self.lstPostfix and self.program is not None:
+            return self.program.isBoolean()
         if len(self.lstPostfix) == 0:
             raise ExprException( "IsBoolean() fail -- Generate() has not been performed" )
 
@@ -382,206 +808,112 @@ class Expression(OperandToken):
     
     def updateValue(self):
         # verify expression has been generated
-        if len(self.lstPostfix) == 0:
+        if self.program is None:
             raise ExprException( "Expression getValue() fail -- generate() has not been performed" )
 
         # Verify tstObj exists if expression has variables
         if self.hasVariables and self.tstObj is None:
             raise ExprException( "Expression getValue() fail -- expression has variables and tstObj has not been set" );
 
-        # Evaluate expression
-        #   for_each token in postfix expression:
-        #      if token is operand:
-        #         GetValue and push on stack
-        #      if token is operator:
-        #         Pop needed values from stack based on how many operator uses
-        #         Apply operator using popped values
-        #         push result back on stack
-        #   when complete return value on stack (should be one)
-
-        stk = []
-        for tok in self.lstPostfix:
-            if tok.isOperand():
-                value = tok.getValue()
-                stk.append( value )
-            else:
-                # Operator
-                lstParams = []
-                for i in xrange( tok.paramCount):
-                    lstParams.append( stk.pop() )
-                value = tok.getValue( lstParams )
-                stk.append( value )
-        # should be one value left on stack
-        # return it
-        self.value = stk.pop()
+        self.value = self.program.evaluate( self._getContext() )
         return self.value
 
     def _scan(self):
-        log.debug( 'Expression scan()' )
-        state = START
-        log.debug( 'expr:%s' % self.expr)
-        # remove all whitespace from expression
-        # TODO: operators with a space (eg > =) will be packed togather and now legal
-        expr = self.expr.translate(None,' ') + '\n'   # Must end with white space
-
+        """ tokenize the infix expression in a single pass """
+        log.debug( 'Expression scan() - expr "%s"', self.expr )
+        # spaces are removed as before, so "> =" is ">=" and "1 2" is 12
+        expr = self.expr.replace( ' ', '' )
+        end = len(expr.rstrip())
         index = 0
-        paranCount = 0
-        while True:
-            if index == len(expr):
-                break
-
-            ch = expr[index]
-            index += 1
-
-            if state == START:
-                if isspace(ch):
-                    break
-                if Token.IsUnaryOperator( ch ):
-                    self.addOperatorToken( ch, 1 )
-                else:
-                    index -= 1
-                state = TOP
-
-            elif state == TOP:
-                if isspace(ch):
-                    break
-
-                s = ch
-                if isalpha(ch):
-                    state = NAME
-                elif isdigit(ch):
-                    state = NUMBER;
-                elif ch == '(':
-                    paranCount += 1
-                    sParan = ''
-                    state = PARAN
-                elif ch == '.':
-                    # Starts with a period, this is a number starting with a decimal point
-                    # start the value string with "0."
-                    s = '0.'
-                    state = NUMBER_DEC;
-                elif Token.IsValidChar( ch ):
-                    if (ch == '-' and expr[index] == '>') or (ch == '>' and expr[index] == '=') or (ch == '<' and expr[index] == '=') or (ch == '*' and expr[index] == '*'):
-                        s += expr[index]
-                        index += 1
-                    elif ch == '=' or ch == '!':
-                        if expr[index] == '=': 
-                            s += expr[index]
-                            index += 1
-                        else:
-                            self.parseError( ch, "TOP" )
-                    self.addOperatorToken( s )
-                    s = ''
-                else:
-                    self.parseError( ch, "TOP" )
-
-            elif state == NAME:
-                if isalnum(ch) or ch == '_':
-                    s += ch
-                else:
-                    self.addVariableToken( s )
-                    s = ''
-                    state = TOP
-                    index -= 1
-
-            elif state == NUMBER:
-                if isdigit(ch):
-                    s += ch
-                elif ch == '.':
-                    s += ch
-                    state = NUMBER_DEC
-                elif ch in 'eE':
-                    s += ch
-                    if expr[index] == '-':
-                        s += '-'
-                        index += 1
-                    state = NUMBER_EXP
-                elif isspace(ch) or Token.IsValidChar( ch ):
-                    self.addNumberToken( s )
-                    s = ''
-                    state = TOP
-                    index -= 1
-                else:
-                    self.parseError( ch, "NUMBER" )
-
-            elif state == NUMBER_DEC:
-                if isdigit(ch):
-                    s += ch
-                elif ch in 'eE':
-                    s += ch
-                    if expr[index] == '-':
-                        s += '-'
-                        index += 1
-                    state = NUMBER_EXP
-                elif isspace(ch) or Token.IsValidChar( ch ):
-                    self.addNumberToken( s )
-                    s = ''
-                    state = TOP
-                    index -= 1
-                else:
-                    self.parseError( ch, "NUMBER_DEC" )
-
-            elif state == NUMBER_EXP:
-                if isdigit(ch):
-                    s += ch
-                elif isspace(ch) or Token.IsValidChar( ch ):
-                    self.addNumberToken( s )
-                    s = ''
-                    state = TOP
-                    index -= 1
-                else:
-                    self.parseError( ch, "NUMBER_EXP" )
-
-            elif state == PARAN:
-                if isspace( ch ):
-                    pass
-                else:
-                    if ch == ')':
-                        paranCount -= 1
-                        if paranCount == 0:
-                            self.addExpressionToken( sParan )
-                            state = TOP
-                    if ch == '(':
-                        paranCount += 1
-                    sParan += ch
+        prev = None
+        while index < end:
+            m = _reToken.match( expr, index )
+            if m is None:
+                index = len(expr) - len(expr[index:].lstrip())
+                self.parseError( expr[index], index )
+            index = m.end()
+            kind = m.lastgroup
+            s = m.group( kind )
+            if kind == 'name':
+                self.addVariableToken( s, _reCall.match( expr, index ) is not None )
+            elif kind == 'number':
+                self.addNumberToken( s )
+            elif kind == 'sep':
+                self.lstTokens.append( SeparatorToken( s ))
+            elif Token.IsUnaryOperator( s ) and (prev is None or prev.isOperator() or prev.token in ('(', ',')):
+                # + or - at the start of an operand is unary
+                self.addOperatorToken( s, 1 )
             else:
-                raise ExprException( 'ScanState %d not found' % state )
+                self.addOperatorToken( s )
+            prev = self.lstTokens[-1]
 
     def _parse(self):
-        """ parse the infix tokens into a postfix expression """
-        log.debug( 'Expression parse() - expr "%s"' % self.expr )
-        index = 0
-        stkTokens = []
-
-        while True:
-            if index == len(self.lstTokens):
+        """ parse the infix tokens into a postfix expression using precedence climbing """
+        log.debug( 'Expression parse() - expr "%s"', self.expr )
+        self._index = 0
+        self._parseExpr( 0 )
+        if self._index != len(self.lstTokens):
+            raise ExprException( 'Parse error - unexpected token "%s"' % self.lstTokens[self._index].token )
+
+    def _parseExpr(self, minPrec):
+        """ parse an operand followed by all binary operators with precedence >= minPrec """
+        self._parseOperand()
+        lstTokens = self.lstTokens
+        while self._index < len(lstTokens):
+            tok = lstTokens[self._index]
+            if not tok.isOperator() or tok.paramCount != 2:
                 break
+            prec = tok.prec
+            if prec < minPrec:
+                break
+            self._index += 1
+            # right associative operators bind the right operand at the same precedence
+            if tok.op.rightAssoc:
+                self._parseExpr( prec )
+            else:
+                self._parseExpr( prec + 1 )
+            self.lstPostfix.append( tok )
+
+    def _parseOperand(self):
+        """ parse an operand, parenthesised expression or unary operator/function """
+        if self._index == len(self.lstTokens):
+            raise ExprException( 'Parse error - expression "%s" ends with an operator' % self.expr )
+        tok = self.lstTokens[self._index]
+        self._index += 1
+        if tok.isOperand():
+            self.lstPostfix.append( tok )
+        elif tok.token == '(':
+            self._parseExpr( 0 )
+            if self._index == len(self.lstTokens) or self.lstTokens[self._index].token != ')':
+                raise ExprException( 'Parse error - missing ")" in expression "%s"' % self.expr )
+            self._index += 1
+        elif tok.isOperator() and tok.paramCount == 1:
+            if tok.op.function and self._index < len(self.lstTokens) and self.lstTokens[self._index].token == '(':
+                self._index += 1
+                tok.setParamCount( self._parseArgs() )
+            else:
+                # unary operators and functions without paranthesis apply to everything with a higher precedence
+                self._parseExpr( tok.prec + 1 )
+                if tok.op.function:
+                    tok.setParamCount( 1 )
+            self.lstPostfix.append( tok )
+        else:
+            raise ExprException( 'Parse error - unexpected token "%s"' % tok.token )
 
-            tok = self.lstTokens[index]
-            index += 1
-
-            if tok.isOperand():
-                # operand is always put into postfix list
-                self.lstPostfix.append( tok )
-                continue
-
-            # Operators
-            #   if stack is empty then push into stack
-            #   pop all operators with precedence greater then current operator and place int postfix vector
-            #   push operator on stack
-            while stkTokens:
-                # get the top of stack without removing it
-                top = stkTokens[-1]
-                if tok.precedence() > top.precedence():
-                    break
-                # Add stack top to list postfix operators and remove from stack
-                self.lstPostfix.append( stkTokens.pop() )
-            # add token to stack
-            stkTokens.append( tok )
-
-        # now pop all remaining items operators from stack
-        while stkTokens:
-            self.lstPostfix.append( stkTokens.pop() )
+    def _parseArgs(self):
+        """ parse comma separated function parameters up to the closing paranthesis, return the count """
+        count = 0
+        while True:
+            self._parseExpr( 0 )
+            count += 1
+            if self._index == len(self.lstTokens):
+                raise ExprException( 'Parse error - missing ")" in expression "%s"' % self.expr )
+            tok = self.lstTokens[self._index]
+            self._index += 1
+            if tok.token == ')':
+                return count
+            if tok.token != ',':
+                raise ExprException( 'Parse error - unexpected token "%s"' % tok.token )
 
     def show(self, indent='', bScanOrParse=False):
         log.info( '%s%-10s : %s' % (indent, self.getType(), self.token ))
@@ -592,8 +924,9 @@ class Expression(OperandToken):
             for tok in self.lstTokens:
                 tok.show( indent + '  ', bScanOrParse)
 
-    def addVariableToken(self, token):
-        if Token.IsOperator( token ):
+    def addVariableToken(self, token, bCall=True):
+        """ add a function or variable token, bCall is True when the name is followed by "(" """
+        if not Token.IsVariableName( token, bCall ):
             self.lstTokens.append( OperatorToken( token, 1))
         else:
             self.lstTokens.append( VariableToken( token, self.tstObj))
@@ -606,17 +939,111 @@ class Expression(OperandToken):
                 return 
         self.lstTokens.append( IntToken( token ))
 
-    def addExpressionToken(self, token):
-        expr = Expression( token, self.tstObj, self.pData)
-        expr.setExpression( token )
-        expr.generate()
-        self.lstTokens.append( expr )
-
     def addOperatorToken(self, token, paramCount=2):
         self.lstTokens.append( OperatorToken( token, paramCount))
 
-    def parseError(self, ch, parseState):
-        raise ExprException( "Parse error on '%c' 0x%X. State:%s" % (ch, ord(ch), parseState))
+    def parseError(self, ch, index):
+        raise ExprException( "Parse error on '%c' 0x%X. Index:%d" % (ch, ord(ch), index))
+
+# Fields of the rows returned by evaluateBatch(), in order
+BATCH_FIELDS = ('dut', 'name', 'value', 'error')
+
+class _BatchParam(object):
+    """ parameter used by the batch evaluator """
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+class _BatchTestObj(object):
+    """ tstObj used by the batch evaluator, parameter values are updated in place for each DUT 
+        so bound expressions only re-bind when the set of parameter names changes
+    """
+    def __init__(self):
+        self._dctParams = {}
+        self.paramVersion = 0
+
+    def setValues(self, dctValues):
+        dctParams = self._dctParams
+        if len(dctParams) == len(dctValues):
+            for name,value in dctValues.iteritems():
+                param = dctParams.get( name )
+                if param is None:
+                    break
+                param.value = value
+            else:
+                return
+        # parameter names changed
+        self._dctParams = dict( [(name, _BatchParam(name, value)) for name,value in dctValues.iteritems()] )
+        self.paramVersion += 1
+
+    def getParameter(self, name):
+        return self._dctParams.get( name )
+
+class _BatchWorker(object):
+    """ evaluates a fixed list of programs for chunks of DUTs """
+    def __init__(self, lstPrograms):
+        self.tstObj = _BatchTestObj()
+        self.lstContexts = []
+        for name,expr,code in lstPrograms:
+            program = ExpressionProgram( expr, code )
+            self.lstContexts.append( (name, program.newContext( self.tstObj )) )
+
+    def evaluate(self, lstDuts):
+        rows = []
+        for dut,dctValues in lstDuts:
+            self.tstObj.setValues( dctValues )
+            for name,ctx in self.lstContexts:
+                try:
+                    rows.append( (dut, name, ctx.evaluate(), None) )
+                except Exception,err:
+                    rows.append( (dut, name, None, '%s: %s' % (err.__class__.__name__, err)) )
+        return rows
+
+# worker created by the pool initializer in each process
+_batchWorker = None
+
+def _batchInit(lstPrograms):
+    global _batchWorker
+    _batchWorker = _BatchWorker( lstPrograms )
+
+def _batchEvaluate(lstDuts):
+    return _batchWorker.evaluate( lstDuts )
+
+def evaluateBatch(lstExprs, lstDuts, processes=None, chunkSize=64):
+    """ evaluate expressions for many DUTs in a process pool
+
+        lstExprs  -- Expression objects, generated if needed. Only the programs are sent to the workers, once per process
+        lstDuts   -- list of (dut, dctValues) tuples, dctValues maps each variable name to its value for that DUT
+        processes -- number of worker processes, None for one per CPU, 1 to evaluate in this process
+        chunkSize -- number of DUTs sent to a worker in one task
+
+        Returns a list of (dut, name, value, error) rows, see BATCH_FIELDS, in DUT then expression order.
+        value is None and error holds the exception when an expression fails for a DUT.
+    """
+    lstPrograms = []
+    for expr in lstExprs:
+        if expr.program is None:
+            expr.generate()
+        lstPrograms.append( (expr.name, expr.expr, expr.getProgram()) )
+    lstDuts = list(lstDuts)
+    log.info( 'evaluateBatch() - %d expressions %d DUTs processes:%s chunkSize:%d' % (len(lstPrograms), len(lstDuts), processes, chunkSize))
+
+    if processes == 1:
+        return _BatchWorker( lstPrograms ).evaluate( lstDuts )
+
+    lstChunks = [lstDuts[i:i+chunkSize] for i in xrange(0, len(lstDuts), chunkSize)]
+    pool = multiprocessing.Pool( processes, _batchInit, (lstPrograms,) )
+    try:
+        rows = []
+        for chunkRows in pool.imap( _batchEvaluate, lstChunks ):
+            rows.extend( chunkRows )
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return rows
 
 if __name__ == '__main__':
     class TestParam(object):
@@ -660,3 +1087,173 @@ if __name__ == '__main__':
         value = expr.getValue()
         print 'Value: %s' % (value )
         index += 1
+
+    # self test, raises on the first failure
+    def check(bOK, sMsg):
+        if not bOK:
+            raise AssertionError( 'Expression self test fail - %s' % sMsg )
+
+    def evalExpr(sExpr, tstObj=testObj):
+        expr = Expression( 'check', tstObj, expr=sExpr )
+        expr.generate()
+        return expr.getValue()
+
+    for sExpr,value in [ ('1+5+6*2', 18), ('2**3**2', 64.0), ('1 2 + 1', 13), ('3 > = 3', True), ('-A*B + C/D', -200+40/30),
+                         ('(A+B)*(D+C)', 2100), ('abs(supply12V - 12.0) <= 12.0*0.05', True) ]:
+        check( evalExpr( sExpr ) == value, '"%s" expecting %s' % (sExpr, value))
+
+    # function names added for arrays are still variables unless called
+    tstNames = TestObj( { 'mean' : TestParam('mean', 4.0), 'max' : TestParam('max', 10.0) } )
+    check( evalExpr( 'mean', tstNames ) == 4.0, 'mean as a variable' )
+    check( evalExpr( 'max - mean*2', tstNames ) == 2.0, 'max and mean as variables' )
+    check( evalExpr( 'max(mean, 3) + min (1, 2)', tstNames ) == 5.0, 'max and min as functions' )
+    check( evalExpr( 'sqrt (16.0)' ) == 4.0, 'space before paranthesis' )
+
+    # ExpressionCache - programs are shared, saved atomically and reloaded without parsing
+    import tempfile, shutil
+    dirTmp = tempfile.mkdtemp()
+    try:
+        cacheFile = os.path.join( dirTmp, 'expr.cache' )
+        cache = ExpressionCache( cacheFile )
+        Expression.setCache( cache )
+        check( evalExpr( '(A+B)*(D+C)' ) == 2100, 'cache miss value' )
+        check( cache.getProgram( '(A+B)*(D+C)' ) is cache.getProgram( '(A+B)*(D+C)' ), 'cached program not shared' )
+        cache.save()
+        check( os.listdir( dirTmp ) == ['expr.cache'], 'temporary cache file left - %s' % os.listdir( dirTmp ))
+        cache = ExpressionCache( cacheFile )
+        Expression.setCache( cache )
+        check( len(cache) == 1, 'cache not reloaded' )
+        expr = Expression( 'check', testObj, expr='(A+B)*(D+C)' )
+        expr.generate()
+        check( not expr.lstPostfix and expr.getValue() == 2100, 'cache hit value' )
+        check( expr.getVars() == ['A','B','D','C'] and not expr.isBoolean(), 'cache hit vars' )
+        # a file written by another version of the module is ignored
+        fp = open( cacheFile, 'wb' )
+        marshal.dump( ('0.0', {'A' : (('I','1'),)}), fp )
+        fp.close()
+        cache = ExpressionCache( cacheFile )
+        check( cache.get( 'A' ) is None, 'old version cache file used' )
+    finally:
+        Expression.setCache( None )
+        shutil.rmtree( dirTmp )
+    # variables are bound to their parameters once, again when paramVersion changes or after unbind()
+    class CountingObj(TestObj):
+        def __init__(self, dct):
+            TestObj.__init__(self, dct)
+            self.lookups = 0
+            self.paramVersion = 0
+        def getParameter(self, name):
+            self.lookups += 1
+            return TestObj.getParameter(self, name)
+    tstCount = CountingObj( { 'A' : TestParam('A', 2.0), 'B' : TestParam('B', 3.0) } )
+    expr = Expression( 'bind', tstCount, expr='A*B + A' )
+    expr.generate()
+    for i in xrange(100):
+        expr.getValue()
+    check( expr.getValue() == 8.0 and tstCount.lookups == 2, 'variables looked up %d times' % tstCount.lookups )
+    tstCount._dct['A'].value = 4.0
+    check( expr.getValue() == 16.0 and tstCount.lookups == 2, 'bound parameter value not used' )
+    tstCount._dct['A'] = TestParam('A', 1.0)
+    tstCount.paramVersion += 1
+    check( expr.getValue() == 4.0 and tstCount.lookups == 4, 'paramVersion change not bound again' )
+    expr.unbind()
+    check( expr.getValue() == 4.0 and tstCount.lookups == 6, 'unbind() not bound again' )
+    del tstCount._dct['B']
+    tstCount.paramVersion += 1
+    try:
+        expr.getValue()
+        check( False, 'missing variable not raised' )
+    except ExprException:
+        pass
+    check( not expr.validate(), 'validate() with a missing variable' )
+    # without paramVersion a replaced parameter object is bound again
+    tstPlain = TestObj( { 'A' : TestParam('A', 2.0), 'B' : TestParam('B', 3.0) } )
+    check( not hasattr( tstPlain, 'paramVersion' ), 'TestObj has paramVersion' )
+    expr = Expression( 'bindPlain', tstPlain, expr='A*B' )
+    expr.generate()
+    check( expr.getValue() == 6.0, 'plain tstObj value' )
+    tstPlain._dct['A'] = TestParam('A', 5.0)
+    check( expr.getValue() == 15.0, 'replaced parameter not bound again' )
+
+    # tokenizer and parser - precedence, unary operators, whitespace and parse errors
+    for sExpr,value in [ ('2*-3', -6), ('- 2**2', -4.0), ('(1+2)*3', 9), ('1+2*3-4/2', 5), ('  1.5e1 +.5 ', 15.5),
+                         ('2*3 >= 6', True), ('-(A - -B)', -30), ('abs(-A) + sqrt(C*10)', 30.0) ]:
+        check( evalExpr( sExpr ) == value, '"%s" expecting %s' % (sExpr, value))
+    for sExpr in [ '(1+2', '1+', '1 $ 2', 'abs(1,2)', '1 (2)', '()' ]:
+        try:
+            evalExpr( sExpr )
+            check( False, '"%s" parsed' % sExpr )
+        except ExprException:
+            pass
+
+    # evaluateBatch - same rows in this process and in a pool, errors are reported per DUT
+    lstBatch = [Expression( 'sum', None, expr='A+B' ), Expression( 'limit', None, expr='A*2 <= B' )]
+    lstDuts = [('dut%d' % n, { 'A' : float(n), 'B' : 10.0 }) for n in xrange(200)]
+    lstDuts.append( ('dutBad', { 'A' : 1.0 }) )
+    rows = evaluateBatch( lstBatch, lstDuts, processes=1 )
+    check( rows == evaluateBatch( lstBatch, lstDuts, processes=2, chunkSize=16 ), 'pool rows differ' )
+    check( len(rows) == 402 and rows[:2] == [('dut0', 'sum', 10.0, None), ('dut0', 'limit', True, None)], 'batch rows %s' % rows[:2] )
+    check( rows[11] == ('dut5', 'limit', True, None) and rows[13] == ('dut6', 'limit', False, None), 'batch limit rows' )
+    check( rows[-1][:3] == ('dutBad', 'limit', None) and 'B' in rows[-1][3], 'batch error row %s' % (rows[-1],) )
+
+    # operator table - every operator and math function against python
+    for sOp,value in [ ('+', 6.5), ('-', 3.5), ('*', 7.5), ('/', 5.0/1.5), ('**', 5.0**1.5),
+                       ('==', False), ('!=', True), ('>=', True), ('<=', False), ('>', True), ('<', False) ]:
+        check( evalExpr( '5.0 %s 1.5' % sOp ) == value, 'operator %s' % sOp )
+    for sFunc in ['acos', 'asin', 'atan', 'cos', 'cosh', 'exp', 'log', 'log10', 'sin', 'sinh', 'sqrt', 'tan', 'tanh', 'floor']:
+        check( evalExpr( '%s(0.5)' % sFunc ) == getattr( math, sFunc )( 0.5 ), 'function %s' % sFunc )
+    for sExpr,value in [ ('abs(-0.5)', 0.5), ('min(3, 1, 2)', 1), ('max(3, 1, 2)', 3), ('pow(2, 10)', 1024.0), ('hypot(3, 4)', 5.0) ]:
+        check( evalExpr( sExpr ) == value, '"%s" expecting %s' % (sExpr, value))
+    for sExpr in [ 'min()', 'pow(1)', 'hypot(1,2,3)', 'sqrt()' ]:
+        try:
+            evalExpr( sExpr )
+            check( False, '"%s" parameter count not checked' % sExpr )
+        except ExprException:
+            pass
+
+    # one ExpressionProgram evaluated by many threads, each with its own EvalContext and parameters
+    import threading
+    expr = Expression( 'shared', testObj, expr='A*B - C' )
+    expr.generate()
+    program = expr.program
+    lstFail = []
+    def evalThread(n):
+        tstThread = TestObj( { 'A' : TestParam('A', n), 'B' : TestParam('B', 2), 'C' : TestParam('C', 1) } )
+        ctx = program.newContext( tstThread )
+        for i in xrange(2000):
+            if ctx.evaluate() != n*2 - 1:
+                lstFail.append( n )
+                return
+    lstThreads = [threading.Thread( target=evalThread, args=(n,) ) for n in xrange(8)]
+    for thrd in lstThreads:
+        thrd.start()
+    for thrd in lstThreads:
+        thrd.join()
+    check( not lstFail and expr.getValue() == 160, 'shared program values, threads failed %s' % lstFail )
+    check( program.lstVars == ('A','B','C') and not program.isBoolean(), 'program %s' % program )
+
+    # array functions, element by element operators on array variables
+    if numpy is not None:
+        tstArray = TestObj( { 'resp' : TestParam('resp', numpy.array( [1.0, 2.0, 3.0, 10.0] )),
+                              'ref'  : TestParam('ref', numpy.array( [1.0, 1.0, 1.0, 1.0] )) } )
+        for sExpr,value in [ ('mean(resp)', 4.0), ('max(resp)', 10.0), ('min(resp - ref)', 0.0),
+                             ('rms(ref*2)', 2.0), ('std(ref)', 0.0), ('percentile(resp, 50)', 2.5),
+                             ('count_if(abs(resp - ref) > 1.5)', 2), ('count_if(abs(resp - ref) > 3.0) <= 2', True),
+                             ('max(sqrt(resp*resp))', 10.0) ]:
+            check( evalExpr( sExpr, tstArray ) == value, '"%s" expecting %s' % (sExpr, value))
+
+    # without numpy the array functions raise ExprException
+    numpySaved, numpy = numpy, None
+    try:
+        tstList = TestObj( { 'resp' : TestParam('resp', [1.0, 2.0]) } )
+        for sExpr in [ 'mean(resp)', 'max(resp)', 'std(resp)', 'rms(resp)', 'percentile(resp, 50)', 'count_if(resp)' ]:
+            try:
+                evalExpr( sExpr, tstList )
+                check( False, '"%s" without numpy not raised' % sExpr )
+            except ExprException:
+                pass
+    finally:
+        numpy = numpySaved
+
+    print 'Expression self test passed'
+
@@ -120,7 +120,7 @@ class GSV(GPS):
             satAzi = self.lst[i+2]
             satSNR = self.lst[i+3]
             sat = Satellite(satPRN,satEle,satAzi,satSNR)
-            log.debug('GSV sat:%s' % sat)
+            log.debug('GSV sat:%s', sat)
             self.lstSats.append( sat )
 
     def __str__(self):
@@ -157,9 +157,9 @@ class GPGSV(GSV):
             if self.curGSV == self.totGSV:
                 GPGSV.lstSatellites = [sat for sat in GPGSV._lstTempSats]
                 GPGSV._lstTempSats = []
-        log.debug( 'totGSV:%s curGSV:%s' % (self.totGSV,self.curGSV))
-        log.debug( 'lstSatellites:%d' % len(GPGSV.lstSatellites))
-        log.debug( '_lstTempSats:%d' % len(GPGSV._lstTempSats))
+        log.debug( 'totGSV:%s curGSV:%s', self.totGSV, self.curGSV)
+        log.debug( 'lstSatellites:%d', len(GPGSV.lstSatellites))
+        log.debug( '_lstTempSats:%d', len(GPGSV._lstTempSats))
 
     def __str__(self):
         return '%5s - %s' % ('GPGSV', ','.join(self.lst))
@@ -195,9 +195,9 @@ class GLGSV(GSV):
             if self.curGSV == self.totGSV:
                 GLGSV.lstGLONASSSats = [sat for sat in GLGSV._lstTempGLONASSSats]
                 GLGSV._lstTempGLONASSSats = []
-        log.debug( 'totGSV:%s curGSV:%s' % (self.totGSV,self.curGSV))
-        log.debug( 'lstGLONASSSats:%d' % len(GLGSV.lstGLONASSSats))
-        log.debug( '_lstTempGLONASSSats:%d' % len(GLGSV._lstTempGLONASSSats))
+        log.debug( 'totGSV:%s curGSV:%s', self.totGSV, self.curGSV)
+        log.debug( 'lstGLONASSSats:%d', len(GLGSV.lstGLONASSSats))
+        log.debug( '_lstTempGLONASSSats:%d', len(GLGSV._lstTempGLONASSSats))
 
     def __str__(self):
         return '%5s - %s' % ('GLGSV', ','.join(self.lst))
@@ -244,7 +244,7 @@ class GSA(GPS):
                 self.lstSatIDs.append(prn)
             except:
                 pass
-        log.debug('GSA - lstSatIDs:%s' % self.lstSatIDs)
+        log.debug('GSA - lstSatIDs:%s', self.lstSatIDs)
         self.PDOP = self.lst[15]
         self.HDOP = self.lst[16]
         self.VDOP = self.lst[17]
@@ -747,7 +747,7 @@ class FileConn(object):
         recv = self._fp.readline()
         if recv == '':
             raise Exception('No more lines in file %s' % self.filename)
-        log.debug('recv:%s' % recv)
+        log.debug('recv:%s', recv)
         return recv
 
     def send(self, binData):
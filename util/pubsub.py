@@ -1,29 +1,627 @@
 """ pubsub.py -- simple Publish/Subscribe implementation """
+import threading, time, collections, itertools, weakref, sys, traceback
+
 from tl_logger import TLLog
 log = TLLog.getLogger( 'pubsub' )
 
+# overflow policies for async subscribers when the queue is full
+ASYNC_BLOCK    = 'block'      # publisher waits for the subscriber
+ASYNC_DROP     = 'drop'       # new event is dropped and counted
+ASYNC_COALESCE = 'coalesce'   # event replaces the queued event with the same key in its place in the queue, else the oldest is dropped
+
+class _SubscriberStats(object):
+    """ callback time of one subscriber. For an AsyncSubscriber calls are the time to queue
+        the event and worker calls the time of the callback on its worker thread
+    """
+    def __init__(self, name, bAsync):
+        self.name = name
+        self.bAsync = bAsync
+        self.calls = 0
+        self.secsTotal = 0.0
+        self.secsMax = 0.0
+        self.slowCalls = 0
+        self.flagged = False
+        self.movedToAsync = False
+        self.workerCalls = 0
+        self.workerTotal = 0.0
+        self.workerMax = 0.0
+
+    def getStats(self):
+        return { 'name'         : self.name,
+                 'async'        : self.bAsync,
+                 'calls'        : self.calls,
+                 'total'        : self.secsTotal,
+                 'avg'          : self.secsTotal / self.calls if self.calls else None,
+                 'max'          : self.secsMax,
+                 'slowCalls'    : self.slowCalls,
+                 'flagged'      : self.flagged,
+                 'movedToAsync' : self.movedToAsync,
+                 'workerCalls'  : self.workerCalls,
+                 'workerAvg'    : self.workerTotal / self.workerCalls if self.workerCalls else None,
+                 'workerMax'    : self.workerMax,
+                 }
+
+class PublishStats(object):
+    """ per subscriber callback time and per event type fan-out time, see PubSub.statsStart().
+        A subscriber is flagged slow when a call takes more than slowSecs.
+    """
+    def __init__(self, slowSecs=0.01):
+        self.slowSecs = slowSecs
+        self._dctSubs = {}          # _callbackKey() -> _SubscriberStats
+        self._dctEvents = {}        # evtType -> [count, total, max, subscribers]
+        self._lock = threading.Lock()
+
+    def _sub(self, cbFunc):
+        key = _callbackKey( cbFunc )
+        stats = self._dctSubs.get( key )
+        if stats is None:
+            bAsync = isinstance( cbFunc, AsyncSubscriber )
+            stats = _SubscriberStats( cbFunc.name if bAsync else _callbackName( cbFunc ), bAsync )
+            stats = self._dctSubs.setdefault( key, stats )
+        return stats
+
+    def addCall(self, cbFunc, secs, count=1):
+        """ record a call, return True the first time the subscriber is flagged slow """
+        with self._lock:
+            stats = self._sub( cbFunc )
+            stats.calls += count
+            stats.secsTotal += secs
+            secs = secs / count
+            if secs > stats.secsMax:
+                stats.secsMax = secs
+            if secs > self.slowSecs:
+                stats.slowCalls += 1
+                if not stats.flagged:
+                    stats.flagged = True
+                    return True
+        return False
+
+    def addWorkerCall(self, sub, secs):
+        with self._lock:
+            stats = self._sub( sub )
+            stats.workerCalls += 1
+            stats.workerTotal += secs
+            if secs > stats.workerMax:
+                stats.workerMax = secs
+
+    def addFanout(self, evtType, secs, nSubs):
+        with self._lock:
+            lst = self._dctEvents.get( evtType )
+            if lst is None:
+                lst = self._dctEvents[evtType] = [0, 0.0, 0.0, 0]
+            lst[0] += 1
+            lst[1] += secs
+            if secs > lst[2]:
+                lst[2] = secs
+            lst[3] = nSubs
+
+    def retain(self, setKeys):
+        """ drop the stats of subscribers whose _callbackKey() is not in setKeys """
+        with self._lock:
+            for key in self._dctSubs.keys():
+                if key not in setKeys:
+                    del self._dctSubs[key]
+
+    def setMoved(self, cbFunc):
+        with self._lock:
+            self._sub( cbFunc ).movedToAsync = True
+
+    def getStats(self):
+        """ return { 'subscribers' : [ dict per subscriber, most total time first ],
+                     'events'      : { evtType : { count, avg, max, subscribers }}}, times in seconds
+        """
+        with self._lock:
+            lstSubs = [stats.getStats() for stats in self._dctSubs.values()]
+            dctEvents = dict( [(evtType, { 'count'       : lst[0],
+                                           'avg'         : lst[1] / lst[0],
+                                           'max'         : lst[2],
+                                           'subscribers' : lst[3] })
+                               for evtType,lst in self._dctEvents.items()] )
+        lstSubs.sort( key=lambda dct: dct['total'] + (dct['workerAvg'] or 0.0) * dct['workerCalls'], reverse=True )
+        return { 'subscribers' : lstSubs, 'events' : dctEvents }
+
+    def getSlow(self):
+        """ return the names of the subscribers flagged slow """
+        with self._lock:
+            return [stats.name for stats in self._dctSubs.values() if stats.flagged]
+
+def _callbackKey(cbFunc):
+    """ stats key of a callback, each obj.method access is a new bound method object """
+    if isinstance( cbFunc, AsyncSubscriber ):
+        return ('async', _callbackKey( cbFunc.cbFunc ))
+    if isinstance( cbFunc, WeakCallback ):
+        return ('weak', id(cbFunc))
+    im_self = getattr( cbFunc, 'im_self', None )
+    if im_self is not None:
+        return (id(im_self), id(cbFunc.im_func))
+    return id(cbFunc)
+
+def _callbackName(cbFunc):
+    """ readable name of a callback, eg TestPubSub.cb_1 """
+    if isinstance( cbFunc, WeakCallback ):
+        return cbFunc.name
+    im_self = getattr( cbFunc, 'im_self', None )
+    if im_self is not None:
+        return '%s.%s' % (im_self.__class__.__name__, cbFunc.__name__)
+    return getattr( cbFunc, '__name__', None ) or repr(cbFunc)
+
+class AsyncSubscriber(object):
+    """ deliver events to a callback on its own worker thread.
+
+        Events are queued by the publisher and the callback is called in publish order, one
+        event at a time. At most maxSize events are queued, overflow sets what happens when the
+        queue is full. With ASYNC_COALESCE events are keyed by keyFunc (default the event type)
+        and a queued event is replaced in place by a newer event with the same key. The newer
+        event keeps the place of the one it replaced, so it is delivered before events of other
+        keys published after the replaced event, delivery is in publish order per key only.
+
+        Compares equal to its callback so unsubscribe( eventType, cbFunc ) works, see
+        PubSub.asyncCallback().
+    """
+    REPORT_SECS = 1.0
+
+    def __init__(self, cbFunc, maxSize=1000, overflow=ASYNC_DROP, keyFunc=None, name=None):
+        if overflow not in (ASYNC_BLOCK, ASYNC_DROP, ASYNC_COALESCE):
+            raise ValueError( 'AsyncSubscriber - overflow "%s" not valid' % overflow )
+        self.cbFunc = cbFunc
+        self.maxSize = maxSize
+        self.overflow = overflow
+        self.keyFunc = keyFunc or (lambda event: event.evtType)
+        self.name = name or _callbackName( cbFunc )
+        self.stats = None             # PublishStats of the PubSub when stats are on
+        self.dropped = 0
+        self.delivered = 0
+        self._queue = collections.deque()
+        self._dctKeyed = {}           # ASYNC_COALESCE: key -> [event], the list is queued
+        self._cond = threading.Condition()
+        self._busy = False
+        self._running = True
+        self._dropReported = 0
+        self._tReport = 0.0
+        self._thread = threading.Thread( target=self._run, name='pubsub-%s' % self.name )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __call__(self, event):
+        self.put( event )
+
+    def __eq__(self, other):
+        return self is other or self.cbFunc == other
+
+    def __ne__(self, other):
+        return not self.__eq__( other )
+
+    def __hash__(self):
+        return hash( self.cbFunc )
+
+    def put(self, event):
+        """ queue an event, called by the publisher """
+        with self._cond:
+            self._put( event )
+            self._cond.notifyAll()
+
+    def putMany(self, lstEvents):
+        """ queue a list of events with one lock and one wake up of the worker """
+        with self._cond:
+            for event in lstEvents:
+                self._put( event )
+            self._cond.notifyAll()
+
+    def _put(self, event):
+        """ queue an event, the lock is held """
+        if not self._running:
+            return
+        if self.overflow == ASYNC_COALESCE:
+            key = self.keyFunc( event )
+            slot = self._dctKeyed.get( key )
+            if slot is not None:
+                slot[0] = event
+                return
+            if len(self._queue) >= self.maxSize:
+                old = self._queue.popleft()
+                self._dctKeyed.pop( old[1], None )
+                self.dropped += 1
+            slot = [event, key]
+            self._dctKeyed[key] = slot
+            self._queue.append( slot )
+        else:
+            while len(self._queue) >= self.maxSize:
+                if self.overflow == ASYNC_DROP:
+                    self.dropped += 1
+                    return
+                # the worker notifies when an event is taken
+                self._cond.wait()
+                if not self._running:
+                    return
+            self._queue.append( event )
+
+    def _get(self):
+        """ wait for the next event, None when stopped and the queue is empty """
+        with self._cond:
+            self._busy = False
+            self._cond.notifyAll()
+            while not self._queue:
+                if not self._running:
+                    return None
+                self._cond.wait()
+            item = self._queue.popleft()
+            if self.overflow == ASYNC_COALESCE:
+                del self._dctKeyed[ item[1] ]
+                item = item[0]
+            self._busy = True
+            # wake a blocked publisher
+            self._cond.notifyAll()
+            return (item,)
+
+    def _run(self):
+        while True:
+            item = self._get()
+            if item is None:
+                break
+            self._deliver( item[0] )
+        self._reportDropped( force=True )
+
+    def _deliver(self, event):
+        stats = self.stats
+        if stats is not None:
+            t0 = time.time()
+        try:
+            self.cbFunc( event )
+        except Exception,err:
+            log.error( 'AsyncSubscriber %s - %s : %s\n%s', self.name, err.__class__.__name__, err, traceback.format_exc() )
+        if stats is not None:
+            stats.addWorkerCall( self, time.time() - t0 )
+        self.delivered += 1
+        self._reportDropped()
+
+    def _reportDropped(self, force=False):
+        """ log events dropped since the last report, at most once a second """
+        if self.dropped == self._dropReported:
+            return
+        now = time.time()
+        if force or now - self._tReport >= self.REPORT_SECS:
+            log.warn( 'AsyncSubscriber %s - %d events dropped, %s', self.name, self.dropped - self._dropReported, self.overflow )
+            self._dropReported = self.dropped
+            self._tReport = now
+
+    def pending(self):
+        """ number of events queued or being delivered """
+        with self._cond:
+            return len(self._queue) + (1 if self._busy else 0)
+
+    def flush(self, timeout=None):
+        """ wait until all queued events are delivered, return False on timeout """
+        tEnd = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._queue or self._busy:
+                if tEnd is not None:
+                    remaining = tEnd - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait( remaining )
+                else:
+                    self._cond.wait()
+        return True
+
+    def stop(self, wait=True):
+        """ stop the worker, events already queued are delivered first """
+        with self._cond:
+            self._running = False
+            self._cond.notifyAll()
+        if wait and self._thread is not threading.currentThread():
+            self._thread.join()
+
+class ConflatingSubscriber(AsyncSubscriber):
+    """ deliver only the latest event of each key every window seconds on a worker thread.
+
+        Events are keyed by keyFunc (default the event type). The first event after an idle
+        period starts a window, at the end of the window the latest event of each key is
+        delivered in the order the keys first arrived. A burst of any number of events costs
+        the callback one call per key. At most maxKeys keys are held, the oldest is dropped.
+    """
+    def __init__(self, cbFunc, window=0.1, keyFunc=None, maxKeys=10000, name=None):
+        self.window = window
+        AsyncSubscriber.__init__(self, cbFunc, maxKeys, ASYNC_COALESCE, keyFunc, name)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notifyAll()
+                while not self._queue and self._running:
+                    self._cond.wait()
+                if not self._queue:
+                    break
+                self._busy = True
+            # collect events for the window
+            time.sleep( self.window )
+            with self._cond:
+                lst = [slot[0] for slot in self._queue]
+                self._queue.clear()
+                self._dctKeyed.clear()
+                self._cond.notifyAll()
+            for event in lst:
+                self._deliver( event )
+        self._reportDropped( force=True )
+
+class WeakCallback(object):
+    """ callback that does not keep its object alive, see PubSub.weakCallback().
+
+        For a bound method obj.cb only obj is referenced weakly, for a function the function.
+        When the object is deleted the callback does nothing and onDead( self ) is called so
+        the subscription can be removed. Compares equal to the callback it wraps, so
+        unsubscribe( eventType, obj.cb ) works.
+    """
+    def __init__(self, cbFunc, onDead=None):
+        self._onDead = onDead
+        self.name = _callbackName( cbFunc )
+        self.__name__ = getattr( cbFunc, '__name__', self.name )
+        self._hash = hash( cbFunc )
+        im_self = getattr( cbFunc, 'im_self', None )
+        if im_self is not None:
+            self._ref = weakref.ref( im_self, self._dead )
+            self._func = cbFunc.im_func
+        else:
+            self._ref = weakref.ref( cbFunc, self._dead )
+            self._func = None
+
+    def _dead(self, ref):
+        if self._onDead is not None:
+            self._onDead( self )
+
+    def isDead(self):
+        return self._ref() is None
+
+    def __call__(self, event):
+        obj = self._ref()
+        if obj is None:
+            return
+        if self._func is None:
+            obj( event )
+        else:
+            self._func( obj, event )
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        obj = self._ref()
+        if obj is None:
+            return False
+        if isinstance( other, WeakCallback ):
+            return obj is other._ref() and self._func is other._func
+        if self._func is None:
+            return obj is other
+        return getattr( other, 'im_self', None ) is obj and getattr( other, 'im_func', None ) is self._func
+
+    def __ne__(self, other):
+        return not self.__eq__( other )
+
+    def __hash__(self):
+        return self._hash
+
+def _isDead(cbFunc):
+    """ True for a WeakCallback, or an AsyncSubscriber of one, whose object was deleted """
+    if isinstance( cbFunc, AsyncSubscriber ):
+        cbFunc = cbFunc.cbFunc
+    return isinstance( cbFunc, WeakCallback ) and cbFunc.isDead()
+
+# hierarchical topics are dot separated, eg "gps.sat.snr". In a subscription "*" matches one
+# level and "#" as the last level matches any number of levels, eg "dut.*.result" or "gps.#"
+TOPIC_SEP      = '.'
+TOPIC_ANY      = '*'
+TOPIC_REST     = '#'
+
+def isWildcard(eventType):
+    """ True if eventType is a wildcard topic subscription """
+    if not isinstance( eventType, basestring ):
+        return False
+    lst = eventType.split( TOPIC_SEP )
+    return TOPIC_ANY in lst or TOPIC_REST in lst
+
+class _TrieNode(object):
+    __slots__ = ('dctChildren', 'tupSubs')
+
+    def __init__(self, node=None):
+        if node is None:
+            self.dctChildren = {}
+            self.tupSubs = ()
+        else:
+            self.dctChildren = dict(node.dctChildren)
+            self.tupSubs = node.tupSubs
+
+class TopicTrie(object):
+    """ wildcard subscriptions stored by topic level, match() walks only the branches that can match.
+
+        The trie is never changed, add() and remove() return a new trie that copies the nodes
+        on the path of the pattern and shares all others, so publishers can read it unlocked.
+    """
+    def __init__(self, root=None, count=0):
+        self._root = root or _TrieNode()
+        self.count = count
+
+    def _levels(self, pattern):
+        lst = pattern.split( TOPIC_SEP )
+        if TOPIC_REST in lst[:-1]:
+            raise ValueError( 'TopicTrie - "%s" %s must be the last level' % (pattern, TOPIC_REST))
+        return lst
+
+    def _copyPath(self, pattern, bCreate):
+        """ copy the nodes of pattern, return the new root and the list of (parent, level), or None if missing """
+        root = node = _TrieNode( self._root )
+        lstPath = []
+        for level in self._levels( pattern ):
+            child = node.dctChildren.get( level )
+            if child is None:
+                if not bCreate:
+                    return None, None
+                child = _TrieNode()
+            else:
+                child = _TrieNode( child )
+            node.dctChildren[level] = child
+            lstPath.append( (node, level) )
+            node = child
+        return root, lstPath
+
+    def add(self, pattern, cbFunc):
+        """ return a new trie with the subscription added, None if already subscribed """
+        root, lstPath = self._copyPath( pattern, True )
+        parent, level = lstPath[-1]
+        node = parent.dctChildren[level]
+        if cbFunc in node.tupSubs:
+            return None
+        node.tupSubs = node.tupSubs + (cbFunc,)
+        return TopicTrie( root, self.count + 1 )
+
+    def remove(self, pattern, cbFunc):
+        """ return a new trie with the subscription removed, None if not subscribed. Empty branches are removed """
+        root, lstPath = self._copyPath( pattern, False )
+        if root is None:
+            return None
+        parent, level = lstPath[-1]
+        node = parent.dctChildren[level]
+        if cbFunc not in node.tupSubs:
+            return None
+        lst = list(node.tupSubs)
+        lst.remove( cbFunc )
+        node.tupSubs = tuple(lst)
+        for parent,level in reversed(lstPath):
+            child = parent.dctChildren[level]
+            if child.tupSubs or child.dctChildren:
+                break
+            del parent.dctChildren[level]
+        return TopicTrie( root, self.count - 1 )
+
+    def get(self, pattern):
+        """ return the callbacks subscribed to pattern """
+        node = self._root
+        for level in self._levels( pattern ):
+            node = node.dctChildren.get( level )
+            if node is None:
+                return ()
+        return node.tupSubs
+
+    def match(self, topic):
+        """ return the callbacks of all subscriptions matching topic """
+        lst = []
+        self._match( self._root, topic.split( TOPIC_SEP ), 0, lst )
+        return lst
+
+    def _match(self, node, lstLevels, index, lst):
+        rest = node.dctChildren.get( TOPIC_REST )
+        if rest is not None:
+            lst.extend( rest.tupSubs )
+        if index == len(lstLevels):
+            lst.extend( node.tupSubs )
+            return
+        child = node.dctChildren.get( lstLevels[index] )
+        if child is not None:
+            self._match( child, lstLevels, index+1, lst )
+        child = node.dctChildren.get( TOPIC_ANY )
+        if child is not None:
+            self._match( child, lstLevels, index+1, lst )
+
+    def contains(self, cbFunc):
+        lstNodes = [self._root]
+        while lstNodes:
+            node = lstNodes.pop()
+            if cbFunc in node.tupSubs:
+                return True
+            lstNodes.extend( node.dctChildren.values() )
+        return False
+
+    def getPatterns(self):
+        """ return { pattern : [callbacks] } """
+        dct = {}
+        lstNodes = [(self._root, [])]
+        while lstNodes:
+            node, lstLevels = lstNodes.pop()
+            if node.tupSubs:
+                dct[ TOPIC_SEP.join(lstLevels) ] = list(node.tupSubs)
+            for level,child in node.dctChildren.items():
+                lstNodes.append( (child, lstLevels + [level]) )
+        return dct
+
+class _SubTables(object):
+    """ snapshot of the subscriptions read by publish(), never changed once published except
+        for the match cache, which only caches what the snapshot already contains
+    """
+    __slots__ = ('dctSubEvents', 'tupAllEvents', 'trie', 'dctMatchCache')
+    MATCH_CACHE_SIZE = 10000
+
+    def __init__(self, dctSubEvents, tupAllEvents, trie):
+        self.dctSubEvents = dctSubEvents      # eventType -> tuple of callbacks
+        self.tupAllEvents = tupAllEvents
+        self.trie = trie
+        self.dctMatchCache = {}
+
+    def getCallbacks(self, evtType):
+        """ callbacks of the exact and wildcard subscriptions for evtType """
+        if not self.trie.count:
+            return self.dctSubEvents.get(evtType, ())
+        tup = self.dctMatchCache.get(evtType)
+        if tup is None:
+            lst = list( self.dctSubEvents.get(evtType, ()) )
+            if isinstance( evtType, basestring ):
+                for cbFunc in self.trie.match( evtType ):
+                    # a callback is called once even when more than one subscription matches
+                    if cbFunc not in lst:
+                        lst.append( cbFunc )
+            tup = tuple(lst)
+            if len(self.dctMatchCache) >= self.MATCH_CACHE_SIZE:
+                self.dctMatchCache.clear()
+            self.dctMatchCache[evtType] = tup
+        return tup
+
+    def contains(self, cbFunc):
+        if cbFunc in self.tupAllEvents or self.trie.contains( cbFunc ):
+            return True
+        for tup in self.dctSubEvents.values():
+            if cbFunc in tup:
+                return True
+        return False
+
 class PubSub(object):
     """ Simple Publish/Subscribe implementation 
+
+        Event types can be hierarchical topics, eg "gps.sat.snr", and subscriptions can use
+        wildcards, eg "dut.*.result" or "gps.#", see TopicTrie. The callbacks for each
+        published event type are cached.
+
+        The subscription tables are copy on write. publish() reads the current snapshot
+        without a lock, subscription changes copy the tables under a lock and replace the
+        snapshot in one assignment. A publish running during a change uses the old snapshot.
     """
     def __init__(self, name='pubsub'):
         self.name = name
-        self._dctSubEvents = {}
-        self._lstAllEvents = []
+        self._tables = _SubTables( {}, (), TopicTrie() )
+        self._dctAsync = {}
+        self._lockWrite = threading.Lock()
+        self._tupListeners = ()
+        self._stats = None
+        self._statsOptions = None
+        self._bPrune = False
         
     def subscribe(self, eventType, cbFunc):
-        """ subscribe to an event """
-        log.debug('subscribe() %s - eventType:%s cbFunc:%s' % (self.name,eventType,cbFunc))
-        if eventType in self._dctSubEvents:
-            lst = self._dctSubEvents[eventType]
-            # check if callback already exists 
-            if cbFunc in lst:
-                log.warn('subscribe() - eventType:%s - callback already defined' % eventType)
-            else:    
-                lst.append( cbFunc )
-        else:
-            # no callbacks for this event -- add new entry to dict
-            lst = [cbFunc]
-            self._dctSubEvents[eventType] = lst
+        """ subscribe to an event or a wildcard topic """
+        log.debug('subscribe() %s - eventType:%s cbFunc:%s', self.name, eventType, cbFunc)
+        with self._lockWrite:
+            tbl = self._tables
+            if isWildcard( eventType ):
+                trie = tbl.trie.add( eventType, cbFunc )
+                if trie is None:
+                    log.warn('subscribe() - eventType:%s - callback already defined', eventType)
+                    return
+                self._tables = _SubTables( tbl.dctSubEvents, tbl.tupAllEvents, trie )
+            else:
+                tup = tbl.dctSubEvents.get( eventType, () )
+                # check if callback already exists 
+                if cbFunc in tup:
+                    log.warn('subscribe() - eventType:%s - callback already defined', eventType)
+                    return
+                dct = dict( tbl.dctSubEvents )
+                dct[eventType] = tup + (cbFunc,)
+                self._tables = _SubTables( dct, tbl.tupAllEvents, tbl.trie )
+        self._notify( eventType )
             
     def subscribeList(self, lstEvents, cbFunc):
         """ subscribe to a list of events """
@@ -32,23 +630,254 @@ class PubSub(object):
             
     def subscribeAll(self, cbFunc):
         """ subscribe to all events """
-        self._lstAllEvents.append(cbFunc)
+        with self._lockWrite:
+            tbl = self._tables
+            self._tables = _SubTables( tbl.dctSubEvents, tbl.tupAllEvents + (cbFunc,), tbl.trie )
+        self._notify( None )
             
     def unsubscribeAll(self, cbFunc):
         """ unsubscribe to all events """
-        self._lstAllEvents.remove(cbFunc)
+        with self._lockWrite:
+            tbl = self._tables
+            lst = list( tbl.tupAllEvents )
+            lst.remove(cbFunc)
+            self._tables = _SubTables( tbl.dctSubEvents, tuple(lst), tbl.trie )
+            self._releaseAsync(cbFunc)
+            self._retainStats()
+        self._notify( None )
+
+    def asyncCallback(self, cbFunc, maxSize=1000, overflow=ASYNC_DROP, keyFunc=None):
+        """ return an AsyncSubscriber for cbFunc to pass to subscribe(), subscribeList() or subscribeAll().
+            Each callback has one worker, so events of all its subscriptions are delivered in order.
+        """
+        with self._lockWrite:
+            return self._asyncCallback( cbFunc, maxSize, overflow, keyFunc )
+
+    def _asyncCallback(self, cbFunc, maxSize, overflow, keyFunc):
+        """ asyncCallback() with the write lock held """
+        sub = self._dctAsync.get( cbFunc )
+        if sub is None:
+            sub = AsyncSubscriber( cbFunc, maxSize, overflow, keyFunc )
+            sub.stats = self._stats
+            self._dctAsync[cbFunc] = sub
+        elif isinstance( sub, ConflatingSubscriber ):
+            raise ValueError( 'asyncCallback() - %s already has a conflating subscription' % sub.name )
+        return sub
+
+    def subscribeAsync(self, eventType, cbFunc, maxSize=1000, overflow=ASYNC_DROP, keyFunc=None):
+        """ subscribe to an event, cbFunc is called on its own worker thread """
+        self.subscribe( eventType, self.asyncCallback( cbFunc, maxSize, overflow, keyFunc ))
+
+    def conflatingCallback(self, cbFunc, window=0.1, keyFunc=None, maxKeys=10000):
+        """ return a ConflatingSubscriber for cbFunc to pass to subscribe(), subscribeList() or subscribeAll() """
+        with self._lockWrite:
+            sub = self._dctAsync.get( cbFunc )
+            if sub is None:
+                sub = ConflatingSubscriber( cbFunc, window, keyFunc, maxKeys )
+                sub.stats = self._stats
+                self._dctAsync[cbFunc] = sub
+            elif not isinstance( sub, ConflatingSubscriber ):
+                raise ValueError( 'conflatingCallback() - %s already has an async subscription' % sub.name )
+            return sub
+
+    def subscribeConflated(self, eventType, cbFunc, window=0.1, keyFunc=None, maxKeys=10000):
+        """ subscribe to an event, cbFunc gets the latest event of each key every window seconds """
+        self.subscribe( eventType, self.conflatingCallback( cbFunc, window, keyFunc, maxKeys ))
+
+    def _releaseAsync(self, cbFunc):
+        """ stop the async worker of cbFunc when it has no subscriptions left, the write lock is held """
+        sub = self._dctAsync.get( cbFunc )
+        if sub is None:
+            return
+        if self._tables.contains( sub ):
+            return
+        del self._dctAsync[cbFunc]
+        sub.stop( wait=False )
+
+    def _retainStats(self):
+        """ drop the stats of callbacks no longer subscribed, the write lock is held.
+            Stats are keyed by object ids, an id reused by a new subscriber must not get old counts.
+        """
+        stats = self._stats
+        if stats is None:
+            return
+        tbl = self._tables
+        lstSubs = list( tbl.tupAllEvents )
+        for tup in tbl.dctSubEvents.values():
+            lstSubs.extend( tup )
+        for lst in tbl.trie.getPatterns().values():
+            lstSubs.extend( lst )
+        setKeys = set()
+        for cbFunc in lstSubs:
+            setKeys.add( _callbackKey( cbFunc ))
+            if isinstance( cbFunc, AsyncSubscriber ):
+                # stats of the callback before it was moved to async
+                setKeys.add( _callbackKey( cbFunc.cbFunc ))
+        stats.retain( setKeys )
+
+    def flush(self, timeout=None):
+        """ wait until all async subscribers have delivered their queued events, return False on timeout """
+        ok = True
+        for sub in self._dctAsync.values():
+            ok = sub.flush( timeout ) and ok
+        return ok
+
+    def close(self):
+        """ stop all async workers after delivering their queued events """
+        with self._lockWrite:
+            lstSubs = self._dctAsync.values()
+            self._dctAsync = {}
+        for sub in lstSubs:
+            sub.stop()
             
     def unsubscribe(self, eventType, cbFunc):
-        """ unsubscribe to an event """
-        log.debug('unsubscribe() %s - eventType:%s cbFunc:%s' % (self.name,eventType,cbFunc))
-        if eventType in self._dctSubEvents:
-            lst = self._dctSubEvents[eventType]
-            if cbFunc in lst:
+        """ unsubscribe to an event or a wildcard topic """
+        log.debug('unsubscribe() %s - eventType:%s cbFunc:%s', self.name, eventType, cbFunc)
+        with self._lockWrite:
+            tbl = self._tables
+            if isWildcard( eventType ):
+                trie = tbl.trie.remove( eventType, cbFunc )
+                if trie is None:
+                    log.warn('unsubscribe() - eventType:%s - callback was not subscribed', eventType)
+                    return
+                self._tables = _SubTables( tbl.dctSubEvents, tbl.tupAllEvents, trie )
+            elif eventType in tbl.dctSubEvents:
+                lst = list( tbl.dctSubEvents[eventType] )
+                if cbFunc not in lst:
+                    log.warn('unsubscribe() - eventType:%s - callback was not subscribed', eventType)
+                    return
                 lst.remove(cbFunc)
+                dct = dict( tbl.dctSubEvents )
+                if lst:
+                    dct[eventType] = tuple(lst)
+                else:
+                    del dct[eventType]
+                self._tables = _SubTables( dct, tbl.tupAllEvents, tbl.trie )
             else:
-                log.warn('unsubscribe() - eventType:%s - callback was not subscribed' % eventType)
-        else:
-            log.warn('unsubscribe() - eventType:%s - has not subscriptions' % eventType)
+                log.warn('unsubscribe() - eventType:%s - has not subscriptions', eventType)
+                return
+            self._releaseAsync(cbFunc)
+            self._retainStats()
+        self._notify( eventType )
+
+    def weakCallback(self, cbFunc):
+        """ return a WeakCallback for cbFunc to pass to subscribe(), subscribeList(), subscribeAll()
+            or asyncCallback(). The subscriptions are removed after the object of the method is deleted.
+        """
+        return WeakCallback( cbFunc, self._weakDead )
+
+    def subscribeWeak(self, eventType, cbFunc):
+        """ subscribe to an event without keeping the object of cbFunc alive """
+        self.subscribe( eventType, self.weakCallback( cbFunc ))
+
+    def _weakDead(self, cbFunc):
+        """ object of a weak callback deleted, may be called during garbage collection on any thread """
+        self._bPrune = True
+
+    def prune(self):
+        """ remove the subscriptions of weak callbacks whose object was deleted, return the number removed """
+        lstChanged = []
+        lstDead = []
+        with self._lockWrite:
+            self._bPrune = False
+            tbl = self._tables
+            dct = {}
+            for evtType,tup in tbl.dctSubEvents.items():
+                lst = [cb for cb in tup if not _isDead( cb )]
+                if len(lst) != len(tup):
+                    lstChanged.append( evtType )
+                    lstDead.extend( [cb for cb in tup if _isDead( cb )] )
+                if lst:
+                    dct[evtType] = tuple(lst)
+            tupAll = tuple( [cb for cb in tbl.tupAllEvents if not _isDead( cb )] )
+            if len(tupAll) != len(tbl.tupAllEvents):
+                lstChanged.append( None )
+                lstDead.extend( [cb for cb in tbl.tupAllEvents if _isDead( cb )] )
+            trie = tbl.trie
+            for pattern,lst in tbl.trie.getPatterns().items():
+                for cb in lst:
+                    if _isDead( cb ):
+                        trie = trie.remove( pattern, cb )
+                        lstChanged.append( pattern )
+                        lstDead.append( cb )
+            if not lstDead:
+                return 0
+            self._tables = _SubTables( dct, tupAll, trie )
+            for cb in lstDead:
+                if isinstance( cb, AsyncSubscriber ):
+                    self._releaseAsync( cb.cbFunc )
+            self._retainStats()
+        log.debug('prune() %s - %d subscriptions removed', self.name, len(lstDead))
+        for eventType in set(lstChanged):
+            self._notify( eventType )
+        return len(lstDead)
+
+    def memoryReport(self):
+        """ return { eventType : { subscribers, weak, dead, objects, bytes }}, eventType None for subscribeAll().
+            objects is the number of different objects kept alive by (not weak) method subscriptions and
+            bytes their size with their __dict__, not including what they reference.
+        """
+        dct = {}
+        for eventType in self.getEventTypes():
+            tup = self.getSubscribers( eventType )
+            dctObjs = {}
+            nWeak = nDead = 0
+            for cbFunc in tup:
+                if isinstance( cbFunc, AsyncSubscriber ):
+                    cbFunc = cbFunc.cbFunc
+                if isinstance( cbFunc, WeakCallback ):
+                    nWeak += 1
+                    nDead += cbFunc.isDead()
+                    continue
+                obj = getattr( cbFunc, 'im_self', None )
+                if obj is not None:
+                    dctObjs[ id(obj) ] = obj
+            nBytes = 0
+            for obj in dctObjs.values():
+                nBytes += sys.getsizeof( obj )
+                if hasattr( obj, '__dict__' ):
+                    nBytes += sys.getsizeof( obj.__dict__ )
+            dct[eventType] = { 'subscribers' : len(tup),
+                               'weak'        : nWeak,
+                               'dead'        : nDead,
+                               'objects'     : len(dctObjs),
+                               'bytes'       : nBytes,
+                               }
+        return dct
+
+    def addListener(self, func):
+        """ call func( eventType ) after the subscriptions of eventType change """
+        with self._lockWrite:
+            self._tupListeners = self._tupListeners + (func,)
+
+    def removeListener(self, func):
+        with self._lockWrite:
+            self._tupListeners = tuple( [f for f in self._tupListeners if f != func] )
+
+    def _notify(self, eventType):
+        """ call the listeners, the write lock is not held """
+        for func in self._tupListeners:
+            try:
+                func( eventType )
+            except Exception,err:
+                log.error( 'PubSub %s listener - %s : %s\n%s', self.name, err.__class__.__name__, err, traceback.format_exc() )
+
+    def getSubscribers(self, eventType):
+        """ return the callbacks subscribed to eventType or wildcard topic, None for subscribeAll() """
+        tbl = self._tables
+        if eventType is None:
+            return tbl.tupAllEvents
+        if isWildcard( eventType ):
+            return tbl.trie.get( eventType )
+        return tbl.dctSubEvents.get( eventType, () )
+
+    def getEventTypes(self):
+        """ return the event types and wildcard topics subscribed, None if there are subscribeAll() callbacks """
+        tbl = self._tables
+        lst = tbl.dctSubEvents.keys() + tbl.trie.getPatterns().keys()
+        if tbl.tupAllEvents:
+            lst.append( None )
+        return lst
 
     def unsubscribeList(self, lstEvents, cbFunc):
         """ unsubscribe to an event """
@@ -56,21 +885,132 @@ class PubSub(object):
             self.unsubscribe(event, cbFunc)
 
     def publish(self, event):
-        """ publist an event, call all subscribers """
-        log.debug('publish() %s - event:%s' % (self.name,event))
+        """ publist an event, call all subscribers. Async subscribers only queue the event """
+        log.debug('publish() %s - event:%s', self.name, event)
+        if self._bPrune:
+            self.prune()
+        if self._stats is not None:
+            self._publishTimed( event )
+            return
+        tbl = self._tables
         # send to all event subscribers
-        for cbFunc in self._lstAllEvents:
+        for cbFunc in tbl.tupAllEvents:
             cbFunc(event)
             
         # Use event type to send to callbacks
+        for cbFunc in tbl.getCallbacks( event.evtType ):
+            cbFunc(event)
+
+    def publishMany(self, lstEvents):
+        """ publish a list of events. Each subscriber gets the events in list order, async
+            subscribers queue all of their events at once. Unlike calling publish() for each
+            event, a subscriber may get all of its events before the next subscriber gets any.
+        """
+        log.debug('publishMany() %s - %d events', self.name, len(lstEvents))
+        if self._bPrune:
+            self.prune()
+        tbl = self._tables
+        lstOrder = []
+        dctEvents = {}
+        for event in lstEvents:
+            for cbFunc in itertools.chain( tbl.tupAllEvents, tbl.getCallbacks( event.evtType )):
+                # key by id, async subscribers compare equal to their callback
+                lstCb = dctEvents.get( id(cbFunc) )
+                if lstCb is None:
+                    lstCb = dctEvents[ id(cbFunc) ] = []
+                    lstOrder.append( cbFunc )
+                lstCb.append( event )
+        stats = self._stats
+        for cbFunc in lstOrder:
+            lstCb = dctEvents[ id(cbFunc) ]
+            if stats is not None:
+                t0 = time.time()
+            if isinstance( cbFunc, AsyncSubscriber ):
+                cbFunc.putMany( lstCb )
+            else:
+                for event in lstCb:
+                    cbFunc(event)
+            if stats is not None and stats.addCall( cbFunc, time.time() - t0, len(lstCb) ):
+                self._slowSubscriber( cbFunc )
+
+    def _publishTimed(self, event):
+        """ publish() with the time of each callback and of the fan-out recorded """
+        stats = self._stats
+        tbl = self._tables
         evtType = event.evtType
-        if evtType in self._dctSubEvents:
-            lst = self._dctSubEvents[evtType]
-            for cbFunc in lst:
-                cbFunc(event)
+        lstSlow = None
+        tStart = time.time()
+        nSubs = 0
+        for cbFunc in itertools.chain( tbl.tupAllEvents, tbl.getCallbacks( evtType )):
+            t0 = time.time()
+            cbFunc(event)
+            nSubs += 1
+            if stats.addCall( cbFunc, time.time() - t0 ):
+                lstSlow = (lstSlow or []) + [cbFunc]
+        stats.addFanout( evtType, time.time() - tStart, nSubs )
+        if lstSlow:
+            for cbFunc in lstSlow:
+                self._slowSubscriber( cbFunc )
+
+    def _slowSubscriber(self, cbFunc):
+        """ a subscriber was flagged slow, move it to async delivery if set by statsStart() """
+        dctOptions = self._statsOptions
+        if dctOptions is None or not dctOptions['autoAsync'] or isinstance( cbFunc, AsyncSubscriber ):
+            log.warn( 'PubSub %s - subscriber %s is slow, over %.1f ms', self.name, _callbackName( cbFunc ), self._stats.slowSecs*1e3 )
+            return
+        log.warn( 'PubSub %s - subscriber %s is slow, over %.1f ms - moved to async delivery',
+                  self.name, _callbackName( cbFunc ), self._stats.slowSecs*1e3 )
+        self.moveToAsync( cbFunc, dctOptions['maxSize'], dctOptions['overflow'] )
+
+    def moveToAsync(self, cbFunc, maxSize=1000, overflow=ASYNC_DROP, keyFunc=None):
+        """ replace all subscriptions of cbFunc with an AsyncSubscriber, return the AsyncSubscriber """
+        with self._lockWrite:
+            sub = self._asyncCallback( cbFunc, maxSize, overflow, keyFunc )
+            tbl = self._tables
+            dct = dict( [(evtType, tuple( [sub if cb == cbFunc else cb for cb in tup] ))
+                         for evtType,tup in tbl.dctSubEvents.items()] )
+            tupAll = tuple( [sub if cb == cbFunc else cb for cb in tbl.tupAllEvents] )
+            trie = tbl.trie
+            for pattern,lst in tbl.trie.getPatterns().items():
+                if cbFunc in lst:
+                    trie = trie.remove( pattern, cbFunc ).add( pattern, sub )
+            self._tables = _SubTables( dct, tupAll, trie )
+        if self._stats is not None:
+            self._stats.setMoved( cbFunc )
+        return sub
+
+    def statsStart(self, slowSecs=0.01, autoAsync=False, maxSize=1000, overflow=ASYNC_DROP):
+        """ start timing subscribers, returns the PublishStats. Subscribers with a call longer than
+            slowSecs are logged and with autoAsync moved to async delivery with maxSize and overflow.
+        """
+        stats = PublishStats( slowSecs )
+        with self._lockWrite:
+            self._statsOptions = { 'autoAsync' : autoAsync, 'maxSize' : maxSize, 'overflow' : overflow }
+            self._stats = stats
+            for sub in self._dctAsync.values():
+                sub.stats = stats
+        return stats
+
+    def statsStop(self):
+        """ stop timing subscribers, returns the PublishStats or None """
+        with self._lockWrite:
+            stats = self._stats
+            self._stats = None
+            self._statsOptions = None
+            for sub in self._dctAsync.values():
+                sub.stats = None
+        return stats
+
+    def getStats(self):
+        """ return the PublishStats.getStats() dict, {} when stats are off """
+        stats = self._stats
+        if stats is None:
+            return {}
+        return stats.getStats()
         
     def __str__(self):
-        return '%s _dctSubEvents:%s' % (self.name,self._dctSubEvents)
+        tbl = self._tables
+        return '%s _dctSubEvents:%s wildcards:%s' % (self.name,tbl.dctSubEvents,tbl.trie.getPatterns())
 
 if __name__ == '__main__':
 
@@ -84,11 +1024,19 @@ if __name__ == '__main__':
         def cb_3(self,event):
             print 'cb_3 - evt:%s' % event
 
+    class TestEvent(object):
+        def __init__(self, evtType, **kwargs):
+            self.evtType = evtType
+            self.__dict__.update( kwargs )
+
+        def __str__(self):
+            return self.evtType
+
     EVT_1 = 'One'
     EVT_2 = 'Two'
     EVT_3 = 'Three'
     EVT_4 = 'Four'
-    lstEvents = [EVT_1,EVT_2,EVT_3, EVT_4]
+    lstEvents = [TestEvent(evt) for evt in (EVT_1,EVT_2,EVT_3, EVT_4)]
 
     pbsb = PubSub()
     obj = TestPubSub()
@@ -127,6 +1075,289 @@ if __name__ == '__main__':
     for event in lstEvents:
         pbsb.publish(event)
     print
-        
-    
-    
\ No newline at end of file
+
+    # self test, raises on the first failure
+    import logging
+    # subscriber and listener failures below are expected
+    TLLog.setConsoleHandlerLevel( logging.CRITICAL )
+    def check(bOK, sMsg):
+        if not bOK:
+            raise AssertionError( 'PubSub self test fail - %s' % sMsg )
+
+    class Recorder(object):
+        """ subscriber that keeps the events, optionally waits for evtGo first """
+        def __init__(self, evtGo=None):
+            self.lst = []
+            self.evtGo = evtGo
+            self.threads = set()
+
+        def cb(self, event):
+            if self.evtGo is not None:
+                self.evtGo.wait()
+            self.threads.add( threading.currentThread().name )
+            self.lst.append( event )
+
+        def values(self):
+            return [event.n for event in self.lst]
+
+    # async subscribers - delivered in order on a worker thread, queue full policies
+    pbsb = PubSub( 'test' )
+    rec = Recorder()
+    pbsb.subscribeAsync( 'async', rec.cb )
+    for n in xrange(100):
+        pbsb.publish( TestEvent( 'async', n=n ))
+    check( pbsb.flush( 5.0 ) and rec.values() == range(100), 'async events %s' % rec.values()[:10] )
+    check( rec.threads == set( ['pubsub-Recorder.cb'] ), 'async thread %s' % rec.threads )
+    for overflow,lstExpect in [ (ASYNC_DROP, [0, 1, 2, 3]),
+                                (ASYNC_COALESCE, [0, 1, 2, 9]),
+                                (ASYNC_BLOCK, range(10)) ]:
+        evtGo = threading.Event()
+        rec = Recorder( evtGo )
+        sub = pbsb.asyncCallback( rec.cb, maxSize=3, overflow=overflow, keyFunc=lambda event: event.n if event.n < 3 else 'last' )
+        pbsb.subscribe( 'full', sub )
+        pbsb.publish( TestEvent( 'full', n=0 ))
+        while not sub.pending() or sub._queue:
+            time.sleep( 0.001 )
+        if overflow == ASYNC_BLOCK:
+            threading.Timer( 0.1, evtGo.set ).start()
+        for n in xrange(1, 10):
+            pbsb.publish( TestEvent( 'full', n=n ))
+        evtGo.set()
+        check( pbsb.flush( 5.0 ) and rec.values() == lstExpect, '%s events %s' % (overflow, rec.values()) )
+        check( sub.dropped == (6 if overflow == ASYNC_DROP else 0) and sub.delivered == len(lstExpect), '%s dropped:%d delivered:%d' % (overflow, sub.dropped, sub.delivered) )
+        pbsb.unsubscribe( 'full', rec.cb )
+        sub._thread.join( 5.0 )
+        check( not sub._thread.isAlive() and rec.cb not in pbsb._dctAsync, '%s worker not stopped by unsubscribe' % overflow )
+    pbsb.close()
+
+    # wildcard topics - "*" matches one level, "#" any number of levels, one call per callback
+    pbsb = PubSub( 'test' )
+    dctRec = dict( [(pattern, Recorder()) for pattern in ('dut.*.result', 'dut.#', '#', 'dut.1.result', '*.1.*')] )
+    for pattern,rec in dctRec.items():
+        pbsb.subscribe( pattern, rec.cb )
+    recTwice = Recorder()
+    pbsb.subscribe( 'dut.1.result', recTwice.cb )
+    pbsb.subscribe( 'dut.*.result', recTwice.cb )
+    pbsb.subscribe( 'dut.#', recTwice.cb )
+    lstTopics = ['dut.1.result', 'dut.2.result', 'dut.1.log', 'dut', 'dut.1.result.x', 'gps.1.snr', 'gps']
+    for n,topic in enumerate( lstTopics ):
+        pbsb.publish( TestEvent( topic, n=n ))
+    for pattern,lstExpect in [ ('dut.*.result', [0, 1]),
+                               ('dut.#', [0, 1, 2, 3, 4]),
+                               ('#', range(len(lstTopics))),
+                               ('dut.1.result', [0]),
+                               ('*.1.*', [0, 2, 5]) ]:
+        check( dctRec[pattern].values() == lstExpect, 'pattern %s got %s' % (pattern, dctRec[pattern].values()) )
+    check( recTwice.values() == [0, 1, 2, 3, 4], 'callback matched twice got %s' % recTwice.values() )
+    check( pbsb.getSubscribers( 'dut.*.result' ) == (dctRec['dut.*.result'].cb, recTwice.cb), 'getSubscribers pattern' )
+    check( set( pbsb.getEventTypes() ) == set( dctRec.keys() ), 'getEventTypes %s' % pbsb.getEventTypes() )
+    # unsubscribing a pattern drops it from the cached matches
+    pbsb.unsubscribe( 'dut.#', recTwice.cb )
+    pbsb.unsubscribe( 'dut.*.result', recTwice.cb )
+    pbsb.unsubscribe( '#', dctRec['#'].cb )
+    pbsb.publish( TestEvent( 'dut.2.result', n=10 ))
+    pbsb.publish( TestEvent( 'dut.1.result', n=11 ))
+    check( recTwice.values()[5:] == [11], 'after unsubscribe got %s' % recTwice.values()[5:] )
+    check( dctRec['#'].values() == range(len(lstTopics)), 'unsubscribed "#" still called' )
+    check( pbsb.getSubscribers( 'dut.#' ) == (dctRec['dut.#'].cb,), 'getSubscribers after unsubscribe' )
+    try:
+        pbsb.subscribe( 'dut.#.result', recTwice.cb )
+        check( False, '"#" not last accepted' )
+    except ValueError:
+        pass
+    pbsb.close()
+    # publishMany - list order per subscriber, async subscribers queue the whole list
+    pbsb = PubSub( 'test' )
+    recA, recB, recAll = Recorder(), Recorder(), Recorder()
+    pbsb.subscribeList( ['a', 'b'], recA.cb )
+    pbsb.subscribe( 'b', recB.cb )
+    pbsb.subscribeAll( recAll.cb )
+    evtGo = threading.Event()
+    recAsync = Recorder( evtGo )
+    sub = pbsb.asyncCallback( recAsync.cb )
+    pbsb.subscribe( 'a', sub )
+    lstEvents = [TestEvent( 'ab'[n % 3 == 0], n=n ) for n in xrange(30)]
+    pbsb.publishMany( lstEvents )
+    check( recA.values() == range(30) and recAll.values() == range(30), 'publishMany order %s' % recA.values() )
+    check( recB.values() == range(0, 30, 3), 'publishMany type b %s' % recB.values() )
+    check( sub.pending() == 20, 'publishMany async pending %d' % sub.pending() )
+    evtGo.set()
+    check( pbsb.flush( 5.0 ) and recAsync.values() == [n for n in xrange(30) if n % 3], 'publishMany async %s' % recAsync.values() )
+    pbsb.close()
+
+    # conflated subscribers - a burst costs one call per key, latest event, first arrival order
+    pbsb = PubSub( 'test' )
+    rec = Recorder()
+    sub = pbsb.conflatingCallback( rec.cb, window=0.2 )
+    pbsb.subscribe( 'gps.#', sub )
+    lstEvents = [TestEvent( 'gps.%s' % ('snr', 'pos')[n % 2], n=n ) for n in xrange(1000)]
+    for event in lstEvents[:500]:
+        pbsb.publish( event )
+    pbsb.publishMany( lstEvents[500:] )
+    check( pbsb.flush( 5.0 ) and rec.values() == [998, 999], 'conflated burst %s' % rec.values() )
+    pbsb.publish( TestEvent( 'gps.pos', n=1000 ))
+    check( pbsb.flush( 5.0 ) and rec.values() == [998, 999, 1000], 'conflated after idle %s' % rec.values() )
+    check( sub.delivered == 3 and sub.dropped == 0, 'conflated delivered:%d dropped:%d' % (sub.delivered, sub.dropped) )
+    pbsb.close()
+
+    # copy on write - changes during publish take effect on the next publish, listeners notified
+    pbsb = PubSub( 'test' )
+    lstNotified = []
+    def listener(eventType):
+        lstNotified.append( eventType )
+    def listenerFail(eventType):
+        raise RuntimeError( 'listener fail' )
+    pbsb.addListener( listenerFail )
+    pbsb.addListener( listener )
+    recLate = Recorder()
+    lstCalls = []
+    def cbChange(event):
+        lstCalls.append( 'change' )
+        pbsb.unsubscribe( 'cow', cbChange )
+        pbsb.unsubscribe( 'cow', cbNext )
+        pbsb.subscribe( 'cow', recLate.cb )
+    def cbNext(event):
+        lstCalls.append( 'next' )
+    pbsb.subscribe( 'cow', cbChange )
+    pbsb.subscribe( 'cow', cbNext )
+    pbsb.publish( TestEvent( 'cow', n=0 ))
+    check( lstCalls == ['change', 'next'] and recLate.values() == [], 'publish during change %s %s' % (lstCalls, recLate.values()) )
+    pbsb.publish( TestEvent( 'cow', n=1 ))
+    check( lstCalls == ['change', 'next'] and recLate.values() == [1], 'publish after change %s %s' % (lstCalls, recLate.values()) )
+    check( lstNotified == ['cow'] * 5, 'listener notified %s' % lstNotified )
+    pbsb.removeListener( listener )
+    pbsb.subscribe( 'cow.#', cbNext )
+    check( len(lstNotified) == 5, 'removed listener notified' )
+    # publishers on threads while subscriptions change, the steady subscriber gets every event
+    rec = Recorder()
+    pbsb.subscribe( 'load', rec.cb )
+    lstErrors = []
+    evtStop = threading.Event()
+    def publisher(n0):
+        try:
+            for n in xrange(n0, n0 + 2000):
+                pbsb.publish( TestEvent( 'load', n=n ))
+        except Exception,err:
+            lstErrors.append( err )
+    def changer():
+        try:
+            lstRec = [Recorder() for n in xrange(10)]
+            while not evtStop.isSet():
+                for recChurn in lstRec:
+                    pbsb.subscribe( 'load', recChurn.cb )
+                    pbsb.subscribe( '*', recChurn.cb )
+                for recChurn in lstRec:
+                    pbsb.unsubscribe( 'load', recChurn.cb )
+                    pbsb.unsubscribe( '*', recChurn.cb )
+        except Exception,err:
+            lstErrors.append( err )
+    thdChange = threading.Thread( target=changer )
+    thdChange.start()
+    lstThreads = [threading.Thread( target=publisher, args=(n*2000,) ) for n in xrange(4)]
+    for thd in lstThreads:
+        thd.start()
+    for thd in lstThreads:
+        thd.join()
+    evtStop.set()
+    thdChange.join()
+    check( not lstErrors, 'threads %s' % lstErrors )
+    check( sorted( rec.values() ) == range(8000), 'steady subscriber got %d of 8000' % len(rec.lst) )
+    check( pbsb.getSubscribers( 'load' ) == (rec.cb,) and pbsb.getSubscribers( '*' ) == (), 'subscriptions left after churn' )
+    pbsb.close()
+    # publish stats - slow subscribers flagged, with autoAsync moved to a worker
+    class Timed(Recorder):
+        def __init__(self, secs):
+            Recorder.__init__(self)
+            self.secs = secs
+
+        def cb(self, event):
+            time.sleep( self.secs )
+            Recorder.cb( self, event )
+
+    pbsb = PubSub( 'test' )
+    check( pbsb.getStats() == {} and pbsb.statsStop() is None, 'stats before statsStart()' )
+    fast, slow = Timed( 0.0 ), Timed( 0.05 )
+    pbsb.subscribe( 'stat', fast.cb )
+    pbsb.subscribe( 'stat', slow.cb )
+    pbsb.statsStart( slowSecs=0.02 )
+    for n in xrange(3):
+        pbsb.publish( TestEvent( 'stat', n=n ))
+    dctStats = pbsb.getStats()
+    # most total time first
+    lstSubs = dctStats['subscribers']
+    check( len(lstSubs) == 2 and lstSubs[0]['slowCalls'] == 3 and not lstSubs[1]['flagged'] and lstSubs[1]['calls'] == 3,
+           'subscriber stats %s' % lstSubs )
+    check( lstSubs[0]['max'] >= 0.05 and lstSubs[0]['avg'] >= 0.05 and not lstSubs[0]['movedToAsync'], 'slow subscriber times %s' % lstSubs[0] )
+    dctEvent = dctStats['events']['stat']
+    check( dctEvent['count'] == 3 and dctEvent['subscribers'] == 2 and dctEvent['max'] >= 0.05, 'event stats %s' % dctEvent )
+    check( slow.values() == range(3) and pbsb.getSubscribers( 'stat' ) == (fast.cb, slow.cb), 'slow subscriber not moved' )
+    stats = pbsb.statsStop()
+    check( stats.getSlow() == ['Timed.cb'] and pbsb.getStats() == {}, 'statsStop()' )
+    pbsb.statsStart( slowSecs=0.02, autoAsync=True )
+    t0 = time.time()
+    for n in xrange(3, 8):
+        pbsb.publish( TestEvent( 'stat', n=n ))
+    secs = time.time() - t0
+    check( secs < 0.2, 'publish not faster after moved to async %.3f secs' % secs )
+    sub = pbsb.getSubscribers( 'stat' )[1]
+    check( isinstance( sub, AsyncSubscriber ) and sub.cbFunc == slow.cb, 'slow subscriber moved to %r' % sub )
+    check( pbsb.flush( 5.0 ) and slow.values() == range(8) and fast.values() == range(8), 'events after move %s' % slow.values() )
+    lstSubs = pbsb.getStats()['subscribers']
+    dctSlow = [dct for dct in lstSubs if not dct['async'] and dct['flagged']][0]
+    dctAsync = [dct for dct in lstSubs if dct['async']][0]
+    check( dctSlow['movedToAsync'] and dctSlow['calls'] == 1, 'moved subscriber stats %s' % dctSlow )
+    check( dctAsync['calls'] == 4 and dctAsync['workerCalls'] == 4 and dctAsync['workerAvg'] >= 0.05, 'async subscriber stats %s' % dctAsync )
+    # stats of unsubscribed callbacks are dropped, a new object with a reused id starts from zero
+    for n in xrange(100):
+        recChurn = Timed( 0.0 )
+        pbsb.subscribe( 'churn', recChurn.cb )
+        pbsb.publish( TestEvent( 'churn', n=n ))
+        pbsb.unsubscribe( 'churn', recChurn.cb )
+    check( pbsb.flush( 5.0 ) and len(pbsb._stats._dctSubs) == 3, 'stats kept for unsubscribed callbacks %d' % len(pbsb._stats._dctSubs) )
+    recSlow = Timed( 0.05 )
+    pbsb.subscribeAll( recSlow.cb )
+    pbsb.publish( TestEvent( 'other', n=0 ))
+    pbsb.unsubscribeAll( recSlow.cb )
+    del recSlow
+    recFast = Timed( 0.0 )
+    pbsb.subscribeAll( recFast.cb )
+    pbsb.publish( TestEvent( 'other', n=1 ))
+    lstSubs = [dct for dct in pbsb.getStats()['subscribers'] if dct['name'] == 'Timed.cb' and not dct['async'] and not dct['movedToAsync']]
+    check( len(lstSubs) == 2 and sorted( [dct['calls'] for dct in lstSubs] ) == [1, 5] and not [dct for dct in lstSubs if dct['calls'] == 1 and dct['flagged']],
+           'stats of a new subscriber %s' % lstSubs )
+    pbsb.statsStop()
+    pbsb.close()
+    # weak subscriptions - do not keep the object alive, removed on the next publish after it is deleted
+    pbsb = PubSub( 'test' )
+    lstNotified = []
+    pbsb.addListener( lstNotified.append )
+    rec, recWeak, recAsync = Recorder(), Recorder(), Recorder()
+    pbsb.subscribe( 'weak', rec.cb )
+    pbsb.subscribeWeak( 'weak', recWeak.cb )
+    pbsb.subscribeWeak( 'weak.#', recWeak.cb )
+    sub = pbsb.asyncCallback( pbsb.weakCallback( recAsync.cb ))
+    pbsb.subscribe( 'weak', sub )
+    pbsb.publish( TestEvent( 'weak', n=0 ))
+    check( pbsb.flush( 5.0 ) and rec.values() == recWeak.values() == recAsync.values() == [0], 'weak subscribers called' )
+    dctReport = pbsb.memoryReport()['weak']
+    check( dctReport['subscribers'] == 3 and dctReport['weak'] == 2 and dctReport['dead'] == 0 and dctReport['objects'] == 1
+           and dctReport['bytes'] > 0, 'memoryReport %s' % dctReport )
+    ref, refAsync = weakref.ref( recWeak ), weakref.ref( recAsync )
+    del recWeak, recAsync
+    check( ref() is None and refAsync() is None, 'weak subscription kept the object alive' )
+    check( pbsb.memoryReport()['weak']['dead'] == 2, 'memoryReport dead %s' % pbsb.memoryReport()['weak'] )
+    del lstNotified[:]
+    pbsb.publish( TestEvent( 'weak', n=1 ))
+    check( pbsb.getSubscribers( 'weak' ) == (rec.cb,) and pbsb.getSubscribers( 'weak.#' ) == (), 'dead subscriptions not pruned' )
+    check( sorted( lstNotified ) == ['weak', 'weak.#'], 'prune notified %s' % lstNotified )
+    sub._thread.join( 5.0 )
+    check( not pbsb._dctAsync and not sub._thread.isAlive(), 'async worker of a dead subscription not stopped' )
+    check( pbsb.prune() == 0 and rec.values() == [0, 1], 'prune after publish' )
+    # unsubscribe with the bound method of a weak subscription
+    recWeak = Recorder()
+    pbsb.subscribeWeak( 'weak', recWeak.cb )
+    pbsb.unsubscribe( 'weak', recWeak.cb )
+    pbsb.publish( TestEvent( 'weak', n=2 ))
+    check( recWeak.values() == [] and pbsb.getSubscribers( 'weak' ) == (rec.cb,), 'unsubscribe weak by bound method' )
+    pbsb.close()
+    print 'PubSub self test passed'
@@ -0,0 +1,535 @@
+""" pubsub_ipc.py -- bridge PubSub instances of different processes over local sockets
+
+    One process listens (eg the supervisor) and the others connect (eg one per DUT). Each
+    side tells its peers which event types and wildcard topics its subscribers want, and an
+    event published in one process is only sent to peers that want it. Events received from
+    a peer are published to the local PubSub as RemoteEvent, and forwarded on to other peers
+    that want them, so DUT processes can also reach each other through the supervisor.
+
+    Frames are a 5 byte header (type, length) and a marshal payload. Events are sent as the
+    event type and the public attributes of the event, which must be types marshal supports
+    (numbers, strings, None, bool, list, tuple, dict). Frames queued for a peer are written
+    together by its writer thread, events are dropped (and the count logged) when MAX_QUEUE
+    frames are waiting. A local subscriber that fails on a received event is logged and the
+    connection stays up.
+
+    The address is a socket file path for a Unix domain socket, or a TCP port as a number,
+    "port" or "host:port" for a TCP connection (host defaults to 127.0.0.1, the loopback).
+    Unix domain sockets are not available on Windows, use a TCP port there.
+"""
+import os, socket, struct, marshal, threading, collections, time, traceback
+
+from tl_logger import TLLog
+log = TLLog.getLogger( 'pubsub_ipc' )
+
+# frame types
+FRAME_HELLO       = 'H'     # name of the peer
+FRAME_SUBSCRIBE   = 'S'     # the peer wants an event type or wildcard topic, None for all events
+FRAME_UNSUBSCRIBE = 'U'
+FRAME_EVENT       = 'E'     # (evtType, attributes)
+
+_frameHeader = struct.Struct( '<cI' )
+
+MARSHAL_VERSION = 2
+
+class IpcError(Exception):
+    pass
+
+class RemoteEvent(object):
+    """ event received from another process, ipcPeer is the name of the peer it came from """
+    def __init__(self, evtType, dctAttrs, ipcPeer=None, source=None):
+        self.__dict__.update( dctAttrs )
+        self.evtType = evtType
+        self.ipcPeer = ipcPeer
+        self._ipcSource = source
+
+    def __str__(self):
+        return 'RemoteEvent %s from %s' % (self.evtType, self.ipcPeer)
+
+def encodeEvent(event):
+    """ return the payload of an event frame """
+    dctAttrs = dict( [(key, value) for key,value in getattr( event, '__dict__', {} ).items()
+                      if not key.startswith('_') and key not in ('evtType', 'ipcPeer')] )
+    return marshal.dumps( (event.evtType, dctAttrs), MARSHAL_VERSION )
+
+def decodeEvent(payload, ipcPeer=None, source=None):
+    evtType, dctAttrs = marshal.loads( payload )
+    return RemoteEvent( evtType, dctAttrs, ipcPeer, source )
+
+def _frame(frameType, payload):
+    return _frameHeader.pack( frameType, len(payload) ) + payload
+
+IPC_HOST = '127.0.0.1'
+
+def parseAddress(address):
+    """ return (family, address) for a socket path, a TCP port or "host:port", see the module doc """
+    if isinstance( address, (int,long) ):
+        return socket.AF_INET, (IPC_HOST, address)
+    if isinstance( address, tuple ):
+        return socket.AF_INET, address
+    host, sep, port = address.rpartition( ':' )
+    if port.isdigit() and os.path.sep not in host:
+        return socket.AF_INET, (host or IPC_HOST, int(port))
+    if not hasattr( socket, 'AF_UNIX' ):
+        raise IpcError( 'pubsub_ipc - "%s" Unix domain sockets are not supported on this platform (%s), use a TCP port' % (address, os.name))
+    return socket.AF_UNIX, address
+
+def _socket(family):
+    sock = socket.socket( family, socket.SOCK_STREAM )
+    if family == socket.AF_INET:
+        # frames are small, do not wait to fill a packet
+        sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+    return sock
+
+class _Forwarder(object):
+    """ local subscriber that sends events to a peer, events that came from the peer are not sent back """
+    def __init__(self, peer):
+        self.peer = peer
+        self.__name__ = 'ipc-%s' % peer.name
+
+    def __call__(self, event):
+        if getattr( event, '_ipcSource', None ) is self.peer:
+            return
+        self.peer.sendEvent( event )
+
+class IpcPeer(object):
+    """ one connection to another process, with a reader and a writer thread """
+    MAX_QUEUE = 10000
+    DROP_REPORT_SECS = 1.0      # minimum seconds between logs of dropped events
+
+    def __init__(self, bridge, sock, name):
+        self.bridge = bridge
+        self.sock = sock
+        self.name = name
+        self.forwarder = _Forwarder( self )
+        self.dropped = 0
+        self._droppedReported = 0
+        self._tDropReport = 0.0
+        self.sent = 0
+        self.received = 0
+        self._setSent = set()           # topics sent to the peer as wanted
+        self._setRemote = set()         # topics the peer wants, forwarder subscribed locally
+        self._lockSubs = threading.Lock()
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._busy = False
+        self._threadRead = threading.Thread( target=self._runRead, name='ipc-read-%s' % name )
+        self._threadWrite = threading.Thread( target=self._runWrite, name='ipc-write-%s' % name )
+        self._threadRead.daemon = True
+        self._threadWrite.daemon = True
+
+    def start(self):
+        self._put( _frame( FRAME_HELLO, marshal.dumps( self.bridge.name, MARSHAL_VERSION )), True )
+        self._threadWrite.start()
+        self._threadRead.start()
+        for eventType in self.bridge.pubsub.getEventTypes():
+            self.update( eventType )
+
+    def _put(self, data, bControl=False):
+        with self._cond:
+            if not self._running:
+                return
+            if not bControl and len(self._queue) >= self.MAX_QUEUE:
+                self.dropped += 1
+                now = time.time()
+                if now - self._tDropReport < self.DROP_REPORT_SECS:
+                    return
+                self._tDropReport = now
+                count = self.dropped - self._droppedReported
+                self._droppedReported = self.dropped
+            else:
+                self._queue.append( data )
+                self._cond.notify()
+                return
+        log.warn( 'IpcPeer %s - %d events dropped, %d frames queued', self.name, count, self.MAX_QUEUE )
+
+    def sendEvent(self, event):
+        try:
+            payload = encodeEvent( event )
+        except ValueError,err:
+            log.error( 'IpcPeer %s - event %s not sent, attributes not supported - %s', self.name, event.evtType, err )
+            return
+        self._put( _frame( FRAME_EVENT, payload ))
+
+    def wanted(self, eventType):
+        """ True if a local subscriber other than this peer's forwarder wants eventType """
+        for cbFunc in self.bridge.pubsub.getSubscribers( eventType ):
+            if cbFunc is not self.forwarder:
+                return True
+        return False
+
+    def update(self, eventType):
+        """ tell the peer when the local interest in eventType changed """
+        with self._lockSubs:
+            bWanted = self.wanted( eventType )
+            if bWanted and eventType not in self._setSent:
+                self._setSent.add( eventType )
+                self._put( _frame( FRAME_SUBSCRIBE, marshal.dumps( eventType, MARSHAL_VERSION )), True )
+            elif not bWanted and eventType in self._setSent:
+                self._setSent.discard( eventType )
+                self._put( _frame( FRAME_UNSUBSCRIBE, marshal.dumps( eventType, MARSHAL_VERSION )), True )
+
+    def _runWrite(self):
+        try:
+            while True:
+                with self._cond:
+                    while not self._queue and self._running:
+                        self._cond.wait()
+                    if not self._queue:
+                        break
+                    # write everything queued in one call
+                    lst = list(self._queue)
+                    self._queue.clear()
+                    self._busy = True
+                self.sock.sendall( ''.join(lst) )
+                self.sent += len(lst)
+                with self._cond:
+                    self._busy = False
+                    self._cond.notifyAll()
+        except socket.error,err:
+            log.info( 'IpcPeer %s - write closed - %s', self.name, err )
+        except Exception,err:
+            log.error( 'IpcPeer %s write - %s : %s\n%s', self.name, err.__class__.__name__, err, traceback.format_exc() )
+        self.close()
+
+    def _runRead(self):
+        buf = ''
+        try:
+            while True:
+                data = self.sock.recv( 65536 )
+                if not data:
+                    break
+                buf += data
+                pos = 0
+                while len(buf) - pos >= _frameHeader.size:
+                    frameType, length = _frameHeader.unpack_from( buf, pos )
+                    end = pos + _frameHeader.size + length
+                    if end > len(buf):
+                        break
+                    self._handle( frameType, buf[pos + _frameHeader.size:end] )
+                    pos = end
+                buf = buf[pos:]
+        except socket.error,err:
+            log.info( 'IpcPeer %s - read closed - %s', self.name, err )
+        except Exception,err:
+            log.error( 'IpcPeer %s read - %s : %s\n%s', self.name, err.__class__.__name__, err, traceback.format_exc() )
+        self.close()
+
+    def _handle(self, frameType, payload):
+        pubsub = self.bridge.pubsub
+        if frameType == FRAME_EVENT:
+            self.received += 1
+            event = decodeEvent( payload, self.name, self )
+            try:
+                pubsub.publish( event )
+            except Exception,err:
+                # a local subscriber failed, keep the connection
+                log.error( 'IpcPeer %s publish %s - %s : %s\n%s', self.name, event.evtType, err.__class__.__name__, err, traceback.format_exc() )
+        elif frameType == FRAME_SUBSCRIBE:
+            eventType = marshal.loads( payload )
+            log.debug( 'IpcPeer %s - subscribe %s', self.name, eventType )
+            if eventType in self._setRemote:
+                return
+            self._setRemote.add( eventType )
+            if eventType is None:
+                pubsub.subscribeAll( self.forwarder )
+            else:
+                pubsub.subscribe( eventType, self.forwarder )
+        elif frameType == FRAME_UNSUBSCRIBE:
+            eventType = marshal.loads( payload )
+            log.debug( 'IpcPeer %s - unsubscribe %s', self.name, eventType )
+            self._unsubscribe( eventType )
+        elif frameType == FRAME_HELLO:
+            name = marshal.loads( payload )
+            log.info( 'IpcPeer %s - hello from %s', self.name, name )
+            self.bridge._renamePeer( self, name )
+        else:
+            raise IpcError( 'IpcPeer %s - frame type %r not valid' % (self.name, frameType))
+
+    def _unsubscribe(self, eventType):
+        if eventType not in self._setRemote:
+            return
+        self._setRemote.discard( eventType )
+        if eventType is None:
+            self.bridge.pubsub.unsubscribeAll( self.forwarder )
+        else:
+            self.bridge.pubsub.unsubscribe( eventType, self.forwarder )
+
+    def flush(self, timeout=None):
+        """ wait until the queued frames are written, return False on timeout """
+        tEnd = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while (self._queue or self._busy) and self._running:
+                if tEnd is None:
+                    self._cond.wait()
+                else:
+                    remaining = tEnd - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait( remaining )
+        return True
+
+    def close(self):
+        """ close the connection and remove the subscriptions of the peer """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notifyAll()
+        log.info( 'IpcPeer %s - closing, sent:%d received:%d dropped:%d', self.name, self.sent, self.received, self.dropped )
+        for eventType in list(self._setRemote):
+            self._unsubscribe( eventType )
+        try:
+            self.sock.shutdown( socket.SHUT_RDWR )
+        except socket.error:
+            pass
+        self.sock.close()
+        self.bridge._removePeer( self )
+
+    def isAlive(self):
+        return self._threadRead.isAlive() or self._threadWrite.isAlive()
+
+    def join(self, timeout=None):
+        """ wait for the reader and writer threads to end after close() """
+        for thrd in (self._threadRead, self._threadWrite):
+            if thrd is not threading.currentThread() and thrd.ident is not None:
+                thrd.join( timeout )
+
+class IpcBridge(object):
+    """ connect a PubSub to the PubSub of other processes, see the module doc.
+        Call listen( address ) in one process and connect( address ) in the others.
+    """
+    def __init__(self, pubsub, name=None):
+        self.pubsub = pubsub
+        self.name = name or 'pid%d' % os.getpid()
+        self.path = None
+        self._sockListen = None
+        self._threadAccept = None
+        self._lstPeers = []
+        self._lstRunning = []       # peers with threads running, also after the connection closed
+        self._lock = threading.Lock()
+        pubsub.addListener( self._subscriptionChanged )
+
+    def listen(self, address):
+        """ accept connections on a socket file path, a stale file is removed, or a TCP port.
+            Returns the address listened on, the port is chosen by the system for port 0.
+        """
+        family, address = parseAddress( address )
+        if family != socket.AF_INET and os.path.exists( address ):
+            os.remove( address )
+        sock = socket.socket( family, socket.SOCK_STREAM )
+        try:
+            sock.bind( address )
+            sock.listen( 16 )
+        except socket.error,err:
+            sock.close()
+            raise IpcError( 'IpcBridge %s - listen on "%s" fail - %s' % (self.name, address, err))
+        if family != socket.AF_INET:
+            self.path = address
+        else:
+            address = sock.getsockname()
+        self._sockListen = sock
+        self._threadAccept = threading.Thread( target=self._runAccept, name='ipc-accept' )
+        self._threadAccept.daemon = True
+        self._threadAccept.start()
+        log.info( 'IpcBridge %s - listening on %s', self.name, address )
+        return address
+
+    def connect(self, address):
+        """ connect to the process listening on address, returns the IpcPeer """
+        family, address = parseAddress( address )
+        sock = _socket( family )
+        try:
+            sock.connect( address )
+        except socket.error,err:
+            sock.close()
+            raise IpcError( 'IpcBridge %s - connect to "%s" fail - %s' % (self.name, address, err))
+        log.info( 'IpcBridge %s - connected to %s', self.name, address )
+        return self._addPeer( sock, str(address) if family == socket.AF_INET else address )
+
+    def _runAccept(self):
+        while True:
+            try:
+                sock, addr = self._sockListen.accept()
+            except socket.error,err:
+                log.info( 'IpcBridge %s - listen closed - %s', self.name, err )
+                break
+            if sock.family == socket.AF_INET:
+                sock.setsockopt( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+            self._addPeer( sock, 'peer%d' % len(self._lstPeers) )
+
+    def _addPeer(self, sock, name):
+        peer = IpcPeer( self, sock, name )
+        with self._lock:
+            self._lstPeers = self._lstPeers + [peer]
+            self._lstRunning = [p for p in self._lstRunning if p.isAlive()] + [peer]
+        peer.start()
+        return peer
+
+    def _renamePeer(self, peer, name):
+        peer.name = name
+        peer.forwarder.__name__ = 'ipc-%s' % name
+
+    def _removePeer(self, peer):
+        with self._lock:
+            self._lstPeers = [p for p in self._lstPeers if p is not peer]
+
+    def _subscriptionChanged(self, eventType):
+        for peer in self._lstPeers:
+            peer.update( eventType )
+
+    def getPeers(self):
+        return list(self._lstPeers)
+
+    def flush(self, timeout=None):
+        """ wait until the frames queued for all peers are written """
+        ok = True
+        for peer in self._lstPeers:
+            ok = peer.flush( timeout ) and ok
+        return ok
+
+    def close(self):
+        self.pubsub.removeListener( self._subscriptionChanged )
+        if self._sockListen:
+            self._sockListen.close()
+            self._sockListen = None
+            if self.path and os.path.exists( self.path ):
+                os.remove( self.path )
+        for peer in self._lstPeers:
+            peer.close()
+        # peers closed by the other side may still be removing their subscriptions
+        for peer in self._lstRunning:
+            peer.join( 5.0 )
+        self._lstRunning = []
+
+def selfTest():
+    """ bridge two PubSub instances of this process, raises on the first failure """
+    import tempfile, shutil, logging
+    from pubsub import PubSub
+    # the failing subscriber is logged as an error
+    TLLog.setConsoleHandlerLevel( logging.CRITICAL )
+
+    def check(bOK, sMsg):
+        if not bOK:
+            raise AssertionError( 'pubsub_ipc self test fail - %s' % sMsg )
+
+    def waitFor(func, timeout=5.0):
+        tEnd = time.time() + timeout
+        while not func() and time.time() < tEnd:
+            time.sleep( 0.01 )
+        return func()
+
+    class Event(object):
+        def __init__(self, evtType, **kwargs):
+            self.evtType = evtType
+            self.__dict__.update( kwargs )
+
+    dirTest = tempfile.mkdtemp()
+    pbsbServer = PubSub( 'server' )
+    pbsbClient = PubSub( 'client' )
+    bridgeServer = IpcBridge( pbsbServer, 'server' )
+    bridgeClient = IpcBridge( pbsbClient, 'client' )
+    try:
+        path = os.path.join( dirTest, 'ipc.sock' )
+        bridgeServer.listen( path )
+        bridgeClient.connect( path )
+        lstReceived = []
+        def onResult(event):
+            lstReceived.append( (event.index, event.value, event.ipcPeer) )
+        def onResultFail(event):
+            raise ValueError( 'subscriber fail' )
+        pbsbClient.subscribe( 'dut.*.result', onResult )
+        pbsbClient.subscribe( 'dut.*.result', onResultFail )
+        check( waitFor( lambda: pbsbServer.getSubscribers( 'dut.*.result' )), 'subscription not forwarded' )
+        # a failing subscriber does not close the connection
+        for n in xrange(3):
+            pbsbServer.publish( Event( 'dut.%d.result' % n, index=n, value=n*0.5 ))
+            pbsbServer.publish( Event( 'dut.%d.status' % n, index=n ))
+        check( waitFor( lambda: len(lstReceived) == 3 ), 'events received %s' % lstReceived )
+        check( lstReceived == [(0, 0.0, 'server'), (1, 0.5, 'server'), (2, 1.0, 'server')], 'events received %s' % lstReceived )
+        check( len(bridgeServer.getPeers()) == 1 and len(bridgeClient.getPeers()) == 1, 'connection closed' )
+        # events are dropped and counted when the queue is full
+        peer = bridgeServer.getPeers()[0]
+        peer.MAX_QUEUE = 2
+        with peer._cond:
+            # the writer waits for the condition lock, the queue fills
+            for n in xrange(10):
+                peer.sendEvent( Event( 'dut.0.result', index=n, value=0.0 ))
+        check( peer.dropped >= 8 and peer._droppedReported >= 1, 'dropped events not reported' )
+        # unsubscribing is forwarded
+        pbsbClient.unsubscribe( 'dut.*.result', onResult )
+        pbsbClient.unsubscribe( 'dut.*.result', onResultFail )
+        check( waitFor( lambda: not pbsbServer.getSubscribers( 'dut.*.result' )), 'unsubscribe not forwarded' )
+    finally:
+        bridgeClient.close()
+        bridgeServer.close()
+        shutil.rmtree( dirTest )
+
+    # TCP on the loopback, the transport on Windows
+    check( parseAddress( '5000' ) == (socket.AF_INET, (IPC_HOST, 5000)) and
+           parseAddress( 'host:5000' ) == (socket.AF_INET, ('host', 5000)), 'TCP address not parsed' )
+    pbsbServer = PubSub( 'server' )
+    pbsbClient = PubSub( 'client' )
+    bridgeServer = IpcBridge( pbsbServer, 'server' )
+    bridgeClient = IpcBridge( pbsbClient, 'client' )
+    try:
+        host, port = bridgeServer.listen( 0 )
+        bridgeClient.connect( '%s:%d' % (host, port) )
+        lstReceived = []
+        pbsbServer.subscribe( 'dut.#', lambda event: lstReceived.append( (event.evtType, event.value, event.ipcPeer) ))
+        check( waitFor( lambda: pbsbClient.getSubscribers( 'dut.#' )), 'TCP subscription not forwarded' )
+        for n in xrange(100):
+            pbsbClient.publish( Event( 'dut.%d.result' % n, value=n ))
+        check( waitFor( lambda: len(lstReceived) == 100 ), 'TCP events received %d' % len(lstReceived) )
+        check( lstReceived == [('dut.%d.result' % n, n, 'client') for n in xrange(100)], 'TCP events %s' % lstReceived[:3] )
+    finally:
+        bridgeClient.close()
+        bridgeServer.close()
+    print 'pubsub_ipc self test passed'
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    from pubsub import PubSub
+    parser = OptionParser( usage='%prog [options] server|client socket_path|port\n       %prog selftest' )
+    parser.add_option( "-n",  "--number", dest="number", type="int", default=10000,
+                       help="Number of events the client publishes. Default is 10000" )
+    (options, args) = parser.parse_args()
+    if args == ['selftest']:
+        selfTest()
+        raise SystemExit( 0 )
+    if len(args) != 2 or args[0] not in ('server', 'client'):
+        parser.error( 'expecting server or client and the socket path or TCP port, or selftest' )
+    mode, address = args
+
+    class Event(object):
+        def __init__(self, evtType, **kwargs):
+            self.evtType = evtType
+            self.__dict__.update( kwargs )
+
+    pbsb = PubSub( mode )
+    bridge = IpcBridge( pbsb, mode )
+    if mode == 'server':
+        lstCount = [0]
+        def onResult(event):
+            lstCount[0] += 1
+            if lstCount[0] % 1000 == 0:
+                print 'server received %d - last %s %s' % (lstCount[0], event.evtType, event.__dict__)
+        pbsb.subscribe( 'dut.*.result', onResult )
+        bridge.listen( address )
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            bridge.close()
+    else:
+        bridge.connect( address )
+        time.sleep(0.5)
+        t0 = time.time()
+        for n in xrange(options.number):
+            pbsb.publish( Event( 'dut.%d.result' % (n % 4), index=n, value=n*0.5, ok=True ))
+            # not subscribed by the server, never sent
+            pbsb.publish( Event( 'dut.%d.status' % (n % 4), index=n ))
+        bridge.flush()
+        print 'client published %d events in %.3f secs' % (options.number, time.time() - t0)
+        bridge.close()
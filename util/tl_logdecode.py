@@ -0,0 +1,115 @@
+""" tl_logdecode.py - decode a binary log written by BinaryLogHandler to text
+
+    The text matches a log written with TLLog.FORMAT. A record whose arguments do not
+    match its format string is written with the format string and the arguments.
+
+    Example:
+        python tl_logdecode.py test.blog -o test.log
+        python tl_logdecode.py --selftest
+"""
+import sys, os, logging, tempfile, shutil, StringIO
+
+from tl_logger import TLLog, BinaryLogHandler, BinaryLogReader
+
+def decode(filename, fp, fmt=None, level=logging.NOTSET, lstNames=None):
+    """ write the records of binary log filename to fp, return the number of records written """
+    if fmt is None:
+        fmt = logging.Formatter( TLLog.FORMAT, TLLog.DATEFMT )
+    count = 0
+    for record in BinaryLogReader( filename ).records():
+        if record.levelno < level:
+            continue
+        if lstNames and record.name not in lstNames:
+            continue
+        try:
+            line = fmt.format( record )
+        except Exception,err:
+            record.msg = 'format fail - %r %r - %s' % (record.msg, record.args, err)
+            record.args = None
+            line = fmt.format( record )
+        if isinstance( line, unicode ):
+            line = line.encode('utf-8')
+        fp.write( line + '\n' )
+        count += 1
+    return count
+
+def selfTest():
+    """ write records to a text and a binary log and check the decoded binary log matches, raises on failure """
+    dirTest = tempfile.mkdtemp()
+    try:
+        textLog = os.path.join( dirTest, 'test.log' )
+        binLog = os.path.join( dirTest, 'test.blog' )
+        hdlText = logging.FileHandler( textLog, mode='w' )
+        hdlText.setFormatter( logging.Formatter( TLLog.FORMAT, TLLog.DATEFMT ))
+        hdlBin = BinaryLogHandler( binLog, mode='wb' )
+        log = logging.getLogger( 'decodeTest' )
+        log.propagate = False
+        log.setLevel( logging.DEBUG )
+        for hdl in (hdlText, hdlBin):
+            log.addHandler( hdl )
+        log.debug( 'no arguments' )
+        log.info( 'int:%d bool:%d %s long:%d float:%.3f none:%s', -7, True, False, 2**70, 1.25, None )
+        log.warning( u'unicode:%s str:%s', u'\xb5A', 'text' )
+        # str bytes that are not utf-8, in the message and in an argument
+        log.warning( 'raw \xff data' )
+        log.warning( 'char:%c', '\xc3' )
+        try:
+            1/0
+        except ZeroDivisionError:
+            log.exception( 'exception %s', 'ZeroDivisionError' )
+        log.removeHandler( hdlText )
+        hdlText.close()
+        # arguments that do not match the format only go to the binary log
+        log.error( 'count:%d', 'not a number' )
+        log.info( 'after the bad record' )
+        log.removeHandler( hdlBin )
+        hdlBin.close()
+
+        fp = StringIO.StringIO()
+        count = decode( binLog, fp )
+        lstDecoded = fp.getvalue().splitlines( True )
+        fpText = open( textLog, 'r' )
+        try:
+            lstText = fpText.readlines()
+        finally:
+            fpText.close()
+        if count != 8:
+            raise AssertionError( 'tl_logdecode self test fail - %d records decoded, expecting 8' % count )
+        if lstDecoded[:len(lstText)] != lstText:
+            raise AssertionError( 'tl_logdecode self test fail - decoded log does not match the text log' )
+        lstTail = lstDecoded[len(lstText):]
+        if len(lstTail) != 2 or 'format fail' not in lstTail[0] or 'after the bad record' not in lstTail[1]:
+            raise AssertionError( 'tl_logdecode self test fail - bad record not decoded - %r' % lstTail )
+    finally:
+        shutil.rmtree( dirTest )
+    print 'tl_logdecode self test passed'
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser( usage='%prog [options] binary_log [binary_log ...]' )
+    parser.add_option( "-o",  "--output", dest="output", default=None,
+                       help="Output text file. Default is stdout" )
+    parser.add_option( "-l",  "--level", dest="level", default='NOTSET',
+                       help="Minimum level written, DEBUG, INFO, WARNING, ERROR or CRITICAL. Default is all" )
+    parser.add_option( "-n",  "--name", dest="lstNames", default=None,
+                       help="Comma separated list of logger names written. Default is all" )
+    parser.add_option( "",  "--selftest", action="store_true", dest="selftest", default=False,
+                       help="Run the self test and exit" )
+    (options, args) = parser.parse_args()
+    if options.selftest:
+        selfTest()
+        sys.exit(0)
+    if not args:
+        parser.error( 'no binary log file given' )
+    level = logging.getLevelName( options.level.upper() )
+    if not isinstance( level, int ):
+        parser.error( 'level "%s" not valid' % options.level )
+    lstNames = options.lstNames.split(',') if options.lstNames else None
+
+    fp = open( options.output, 'w' ) if options.output else sys.stdout
+    try:
+        for filename in args:
+            decode( filename, fp, level=level, lstNames=lstNames )
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
@@ -1,56 +1,1123 @@
 """ tl_logger.py - custom logging using the python logging module """
-import logging,sys
+import logging,sys,threading,Queue,time,struct,os,gzip,shutil,itertools,re
 
 LOG_DISABLE_LEVEL = logging.INFO
 LOG_ENABLE_LEVEL  = logging.DEBUG
 
+# overflow policies for async logging when the queue is full
+ASYNC_BLOCK = 'block'   # producer waits for the writer thread
+ASYNC_DROP  = 'drop'    # record is dropped and counted
+
+class RateLimiter(object):
+    """ limit the debug and info messages of a logger, see LogModule.setRateLimit().
+
+        maxPerSec      -- messages allowed per second, bursts of up to burst messages are allowed
+        sampleN        -- only 1 in sampleN messages is logged
+        reportInterval -- seconds between reports of the number of suppressed messages
+        onReport       -- called on a timer thread when a report is due and no message was logged
+                          since, so a logger that floods and goes quiet still reports
+    """
+    def __init__(self, maxPerSec=None, burst=None, sampleN=None, reportInterval=10.0, onReport=None):
+        self.maxPerSec = maxPerSec
+        self.burst = float( burst or maxPerSec or 1 )
+        self.sampleN = sampleN
+        self.reportInterval = reportInterval
+        self.suppressed = 0
+        self.totalSuppressed = 0
+        self._tokens = self.burst
+        self._count = 0
+        self._tLast = self._tReport = time.time()
+        self._lock = threading.Lock()
+        self.onReport = onReport
+        self._timer = None
+
+    def allow(self):
+        """ return True if the message is logged, may also return a report of suppressed messages """
+        with self._lock:
+            ok = True
+            if self.sampleN:
+                self._count += 1
+                ok = self._count % self.sampleN == 1 or self.sampleN == 1
+            if ok and self.maxPerSec:
+                now = time.time()
+                self._tokens = min( self.burst, self._tokens + (now - self._tLast) * self.maxPerSec )
+                self._tLast = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                else:
+                    ok = False
+            if not ok:
+                self.suppressed += 1
+                self.totalSuppressed += 1
+                if self._timer is None and self.onReport is not None:
+                    self._startTimer()
+            return ok
+
+    def _startTimer(self):
+        """ report when the interval ends, lock held """
+        delay = max( 0.0, self._tReport + self.reportInterval - time.time() )
+        self._timer = threading.Timer( delay, self._timerReport )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _timerReport(self):
+        with self._lock:
+            self._timer = None
+        self.onReport()
+
+    def cancel(self):
+        """ stop the report timer """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def takeReport(self, force=False):
+        """ return the suppressed count and seconds since the last report when a report is due, else None """
+        if not self.suppressed:
+            return None
+        now = time.time()
+        if not force and now - self._tReport < self.reportInterval:
+            return None
+        with self._lock:
+            count, self.suppressed = self.suppressed, 0
+            secs, self._tReport = now - self._tReport, now
+        return count, secs
+
 class LogModule(object):
+    """ wrapper for a python logger.
+
+        Log methods take printf style arguments that are only formatted when the message is
+        written, eg log.debug( 'recv:%s', data ). The effective level is cached so disabled
+        calls return after one compare. Use isDebug() to guard debug code that is expensive
+        to run even with lazy arguments.
+
+        TLLog.getLogger() returns one LogModule per name, change levels with setLevel(),
+        enable() or disable() so the cached level is updated. Call refreshLevel() after
+        changing the python logger directly.
+
+        When the flight recorder is started for this logger, disabled debug calls are kept
+        in its ring buffer instead of being discarded, see FlightRecorder.
+
+        setRateLimit() limits debug and info messages of high frequency loggers, the number
+        of suppressed messages is logged every reportInterval seconds, by the next message
+        logged or by a timer when the logger is quiet.
+    """
+    _recorder = None
+    _limiter = None
+
     def __init__(self, name):
-        self._log = logging.getLogger( name )
+        # _log is replaced by a _TimedLogger proxy while stats are on, _rawLog is always the python logger
+        self._log = self._rawLog = logging.getLogger( name )
         self.name = name
+        self.refreshLevel()
         
     def getLog(self):
-        return self._log
+        """ return the python logger, change handlers on it not on the stats proxy """
+        return self._rawLog
+
+    def refreshLevel(self):
+        """ update the cached effective level from the python logger """
+        self._level = self._log.getEffectiveLevel()
 
     def isEnabled(self):
-        level = self._log.getEffectiveLevel()
-        if level < LOG_DISABLE_LEVEL:
+        if self._level < LOG_DISABLE_LEVEL:
             return True
         return False
     
+    def setLevel(self, level):
+        self._log.setLevel( level )
+        self.refreshLevel()
+
     def enable(self):
         print( 'log %-10s -- ENABLED' % self.name )
-        self._log.setLevel( LOG_ENABLE_LEVEL )
+        self.setLevel( LOG_ENABLE_LEVEL )
     
     def disable(self):
         print( 'log %-10s -- DISABLED' % self.name )
-        self._log.setLevel( LOG_DISABLE_LEVEL )
+        self.setLevel( LOG_DISABLE_LEVEL )
 
-    # Overloads for log modules
-    def info( self, msg):
-        self._log.info( msg )
+    def setRateLimit(self, maxPerSec=None, burst=None, sampleN=None, reportInterval=10.0):
+        """ limit debug and info messages to maxPerSec and/or 1 in sampleN, no arguments removes the limit.
+            Warnings and errors are never suppressed.
+        """
+        self.reportSuppressed( force=True )
+        if self._limiter is not None:
+            self._limiter.cancel()
+        if maxPerSec or sampleN:
+            self._limiter = RateLimiter( maxPerSec, burst, sampleN, reportInterval, self._timerReport )
+        else:
+            self._limiter = None
+
+    def getRateLimit(self):
+        return self._limiter
+
+    def _allow(self):
+        """ rate limit check, reports the suppressed messages when due """
+        ok = self._limiter.allow()
+        if ok and self._limiter.suppressed:
+            self.reportSuppressed()
+        return ok
+
+    def _timerReport(self):
+        self.reportSuppressed( force=True )
+
+    def reportSuppressed(self, force=False):
+        """ log the number of messages suppressed by the rate limit since the last report """
+        limiter = self._limiter
+        if limiter is None:
+            return
+        report = limiter.takeReport( force )
+        if report:
+            self._log.warning( 'rate limit suppressed %d messages in %.1f secs', report[0], report[1] )
+
+    # Overloads for log modules, args are formatted into msg only if the message is logged
+    def info( self, msg, *args, **kwargs):
+        if logging.INFO >= self._level:
+            if self._limiter is None or self._allow():
+                self._log.info( msg, *args, **kwargs )
         
-    def error( self, msg):
-        self._log.error( msg )
+    def error( self, msg, *args, **kwargs):
+        if logging.ERROR >= self._level:
+            self._log.error( msg, *args, **kwargs )
         
-    def debug( self, msg):
-        self._log.debug( msg )
+    def debug( self, msg, *args, **kwargs):
+        if logging.DEBUG >= self._level:
+            if self._limiter is None or self._allow():
+                self._log.debug( msg, *args, **kwargs )
+        elif self._recorder is not None:
+            self._recorder.add( self.name, logging.DEBUG, msg, args )
         
-    def warn( self, msg):
-        self._log.warn( msg )
+    def warn( self, msg, *args, **kwargs):
+        if logging.WARNING >= self._level:
+            self._log.warn( msg, *args, **kwargs )
         
-    def warning( self, msg):
-        self._log.warning( msg )
+    def warning( self, msg, *args, **kwargs):
+        if logging.WARNING >= self._level:
+            self._log.warning( msg, *args, **kwargs )
         
-    def critical( self, msg):
-        self._log.critical( msg )
+    def critical( self, msg, *args, **kwargs):
+        if logging.CRITICAL >= self._level:
+            self._log.critical( msg, *args, **kwargs )
         
     def isEnabledFor(self, lvl):
-        return self._log.isEnabledFor(lvl)
+        return lvl >= self._level
+
+    def isDebug(self):
+        """ guard for expensive debug code, eg if log.isDebug(): hexDump(...) """
+        return logging.DEBUG >= self._level
     
     def __cmp__(self,other):
         return self.name < other.name
 
+# Binary log format written by BinaryLogHandler. Every open starts a segment with a header,
+# names, threads and format strings are defined once per segment before the first record using them.
+# A thread is defined again when its name changes. Version 2 added the b, n and l argument types.
+# Version 3 added unicode format strings, message text records and 32 bit thread ids, 16 bit arg counts.
+# Text is stored as the bytes logged, unicode as utf-8.
+BIN_MAGIC     = 'TLLB'
+BIN_VERSION   = 3
+BIN_VERSIONS  = (1, 2, 3)   # versions BinaryLogReader reads
+_binHeader    = struct.Struct( '<4sB' )         # magic, version
+_binDefine    = struct.Struct( '<cII' )         # type, id, length of text that follows
+_binRecord    = struct.Struct( '<cdBHIIBH' )    # 'R', created, levelno, logger id, thread id, format id, flags, arg count
+_binRecordV2  = struct.Struct( '<cdBHHIBB' )    # record of versions 1 and 2
+_binInt       = struct.Struct( '<q' )
+_binFloat     = struct.Struct( '<d' )
+_binLength    = struct.Struct( '<I' )
+BIN_DEF_LOGGER = 'L'
+BIN_DEF_THREAD = 'T'
+BIN_DEF_FORMAT = 'F'
+BIN_DEF_UFORMAT = 'U'       # unicode format string
+BIN_RECORD     = 'R'
+BIN_SEGMENT    = 'H'
+BIN_FLAG_EXC   = 0x01       # traceback text follows the arguments
+BIN_FLAG_TEXT  = 0x02       # the message follows as an 's' or 'u' argument, there is no format string
+BIN_MAX_FORMATS = 10000     # format strings defined per segment, then messages are written as text
+BIN_MAX_ARGS   = 0xFFFF
+
+class BinaryLogHandler(logging.Handler):
+    """ Write log records in a compact binary format, see BinaryLogReader and tl_logdecode.py.
+
+        Each record holds the time, level, logger id, thread id, format string id and the
+        arguments, the message is never formatted. Pass lazy arguments (log.debug( 'x:%s', x ))
+        so format strings repeat. A message without arguments, with named arguments or logged
+        after BIN_MAX_FORMATS format strings are defined is written as text.
+        The file is flushed on close(), flush() and for records of level ERROR and above.
+    """
+    def __init__(self, filename, mode='ab'):
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath( filename )
+        self.mode = mode
+        self.stream = self._open()
+
+    def _open(self):
+        """ open the file and start a new segment """
+        stream = open( self.baseFilename, self.mode )
+        self._dctLoggers = {}
+        self._dctThreads = {}
+        self._dctFormats = {}
+        stream.write( BIN_SEGMENT + _binHeader.pack( BIN_MAGIC, BIN_VERSION ))
+        return stream
+
+    def _define(self, dct, kind, key, text):
+        id = len(dct)
+        dct[key] = id
+        data = text.encode('utf-8') if isinstance(text, unicode) else str(text)
+        self.stream.write( _binDefine.pack( kind, id, len(data) ) + data )
+        return id
+
+    def _encodeArg(self, arg):
+        if isinstance( arg, bool ):
+            return 'b' + chr( arg )
+        if arg is None:
+            return 'n'
+        if isinstance( arg, (int,long) ):
+            if -2**63 <= arg < 2**63:
+                return 'i' + _binInt.pack( arg )
+            return 'l' + self._encodeText( str(arg) )
+        if isinstance( arg, float ):
+            return 'f' + _binFloat.pack( arg )
+        if isinstance( arg, unicode ):
+            return 'u' + self._encodeText( arg.encode('utf-8') )
+        if isinstance( arg, str ):
+            return 's' + self._encodeText( arg )
+        return 's' + self._encodeText( str(arg) )
+
+    def _encodeText(self, data):
+        return _binLength.pack( len(data) ) + data
+
+    def emit(self, record):
+        try:
+            # bytes counted include the definitions written for the record
+            stats = TLLog._stats
+            if stats is not None:
+                pos = self.stream.tell()
+            args = record.args or ()
+            idFmt = 0
+            bText = not args or isinstance( args, dict ) or len(args) > BIN_MAX_ARGS
+            if not bText:
+                msg = record.msg
+                if isinstance( msg, unicode ):
+                    fmtKey = (BIN_DEF_UFORMAT, msg)
+                else:
+                    fmtKey = msg = msg if isinstance( msg, str ) else str(msg)
+                idFmt = self._dctFormats.get( fmtKey )
+                if idFmt is None:
+                    if len(self._dctFormats) < BIN_MAX_FORMATS:
+                        idFmt = self._define( self._dctFormats, BIN_DEF_UFORMAT if isinstance( msg, unicode ) else BIN_DEF_FORMAT, fmtKey, msg )
+                    else:
+                        bText = True
+            if bText:
+                # only format strings with arguments are defined, so the table does not grow with every message
+                args = ()
+                idFmt = 0
+            idLogger = self._dctLoggers.get( record.name )
+            if idLogger is None:
+                idLogger = self._define( self._dctLoggers, BIN_DEF_LOGGER, record.name, record.name )
+            # thread idents are reused and threads renamed, the name is part of the key
+            keyThread = (record.thread, record.threadName)
+            idThread = self._dctThreads.get( keyThread )
+            if idThread is None:
+                idThread = self._define( self._dctThreads, BIN_DEF_THREAD, keyThread, record.threadName )
+            excText = record.exc_text
+            if record.exc_info and not excText:
+                excText = TLLog.fmt.formatException( record.exc_info )
+            flags = (BIN_FLAG_EXC if excText else 0) | (BIN_FLAG_TEXT if bText else 0)
+            lst = [_binRecord.pack( BIN_RECORD, record.created, record.levelno, idLogger, idThread, idFmt, flags, len(args) )]
+            if bText:
+                lst.append( self._encodeArg( record.getMessage() ))
+            for arg in args:
+                lst.append( self._encodeArg( arg ))
+            if excText:
+                lst.append( self._encodeText( excText.encode('utf-8') if isinstance(excText, unicode) else excText ))
+            self.stream.write( ''.join(lst) )
+            if stats is not None:
+                stats.addBytes( record.name, record.levelno, self.stream.tell() - pos )
+            if record.levelno >= logging.ERROR:
+                self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.stream:
+            self.stream.flush()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self.stream:
+                self.stream.flush()
+                self.stream.close()
+                self.stream = None
+            logging.Handler.close(self)
+        finally:
+            self.release()
+
+class BinaryLogReader(object):
+    """ read a file written by BinaryLogHandler, records() returns logging.LogRecord objects """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def _read(self, fp, size):
+        data = fp.read( size )
+        if len(data) != size:
+            raise EOFError( 'BinaryLogReader - "%s" truncated' % self.filename )
+        return data
+
+    def _readText(self, fp):
+        length, = _binLength.unpack( self._read( fp, _binLength.size ))
+        return self._read( fp, length )
+
+    def _readArg(self, fp):
+        tag = self._read( fp, 1 )
+        if tag == 'i':
+            return _binInt.unpack( self._read( fp, _binInt.size ))[0]
+        if tag == 'b':
+            return self._read( fp, 1 ) != '\x00'
+        if tag == 'n':
+            return None
+        if tag == 'l':
+            return long( self._readText( fp ))
+        if tag == 'f':
+            return _binFloat.unpack( self._read( fp, _binFloat.size ))[0]
+        if tag == 'u':
+            return self._readText( fp ).decode('utf-8')
+        if tag == 's':
+            return self._readText( fp )
+        raise ValueError( 'BinaryLogReader - "%s" bad argument type %r' % (self.filename, tag))
+
+    def records(self):
+        """ generator of the records in the file, rotated files compressed with gzip are read directly """
+        if self.filename.endswith( '.gz' ):
+            fp = gzip.open( self.filename, 'rb' )
+        else:
+            fp = open( self.filename, 'rb' )
+        try:
+            dctTables = {}
+            while True:
+                kind = fp.read(1)
+                if not kind:
+                    break
+                if kind == BIN_SEGMENT:
+                    magic, version = _binHeader.unpack( self._read( fp, _binHeader.size ))
+                    if magic != BIN_MAGIC or version not in BIN_VERSIONS:
+                        raise ValueError( 'BinaryLogReader - "%s" not a version %s binary log' % (self.filename, BIN_VERSIONS))
+                    dctTables = { BIN_DEF_LOGGER : {}, BIN_DEF_THREAD : {}, BIN_DEF_FORMAT : {} }
+                    binRecord = _binRecord if version >= 3 else _binRecordV2
+                elif kind in (BIN_DEF_LOGGER, BIN_DEF_THREAD, BIN_DEF_FORMAT, BIN_DEF_UFORMAT):
+                    _, id, length = _binDefine.unpack( kind + self._read( fp, _binDefine.size - 1 ))
+                    # text is read back as the bytes logged, format and arguments keep their type
+                    text = self._read( fp, length )
+                    if kind == BIN_DEF_UFORMAT:
+                        kind = BIN_DEF_FORMAT
+                        text = text.decode('utf-8', 'replace')
+                    dctTables[kind][id] = text
+                elif kind == BIN_RECORD:
+                    _, created, levelno, idLogger, idThread, idFmt, flags, count = binRecord.unpack( kind + self._read( fp, binRecord.size - 1 ))
+                    if flags & BIN_FLAG_TEXT:
+                        msg = self._readArg( fp )
+                    else:
+                        msg = dctTables[BIN_DEF_FORMAT][idFmt]
+                    args = tuple( [self._readArg( fp ) for _ in xrange(count)] )
+                    excText = None
+                    if flags & BIN_FLAG_EXC:
+                        excText = self._readText( fp )
+                    yield logging.makeLogRecord( { 'name'       : dctTables[BIN_DEF_LOGGER][idLogger],
+                                                   'threadName' : dctTables[BIN_DEF_THREAD][idThread],
+                                                   'msg'        : msg,
+                                                   'args'       : args or None,
+                                                   'levelno'    : levelno,
+                                                   'levelname'  : logging.getLevelName( levelno ),
+                                                   'created'    : created,
+                                                   'msecs'      : (created - int(created)) * 1000,
+                                                   'exc_text'   : excText,
+                                                   } )
+                else:
+                    raise ValueError( 'BinaryLogReader - "%s" bad record type %r at %d' % (self.filename, kind, fp.tell()-1))
+        finally:
+            fp.close()
+
+def rotatedFiles(baseFilename):
+    """ return the rotated segments of a log file oldest first as (sequence, filename) """
+    dirName, baseName = os.path.split( baseFilename )
+    reSegment = re.compile( r'^%s\.\d{8}-\d{6}-(\d+)(\.gz)?$' % re.escape( baseName ))
+    lst = []
+    for name in os.listdir( dirName or '.' ):
+        m = reSegment.match( name )
+        if m:
+            lst.append( (int( m.group(1) ), os.path.join( dirName, name )) )
+    lst.sort()
+    return lst
+
+class _Compressor(threading.Thread):
+    """ gzip rotated log files and remove old ones on a background thread.
+        Old files of a log are removed when none of its rotated files are waiting to be compressed.
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        threading.Thread.__init__(self, name='TLLogCompress')
+        self.daemon = True
+        self._queue = Queue.Queue()
+        self._dctPending = {}   # baseFilename : rotated files queued
+
+    @staticmethod
+    def submit(filename, baseFilename, backupCount, compress):
+        """ queue a rotated file, the compressor thread is started on first use """
+        _Compressor._lock.acquire()
+        try:
+            if _Compressor._instance is None:
+                _Compressor._instance = _Compressor()
+                _Compressor._instance.start()
+            compressor = _Compressor._instance
+            compressor._dctPending[baseFilename] = compressor._dctPending.get( baseFilename, 0 ) + 1
+            compressor._queue.put( (filename, baseFilename, backupCount, compress) )
+        finally:
+            _Compressor._lock.release()
+
+    @staticmethod
+    def wait():
+        """ wait until all queued files are done """
+        compressor = _Compressor._instance
+        if compressor is not None:
+            compressor._queue.join()
+
+    def run(self):
+        while True:
+            filename, baseFilename, backupCount, compress = self._queue.get()
+            try:
+                if compress:
+                    self.compress( filename )
+            except Exception,err:
+                sys.stderr.write( 'TLLog compress fail - filename:"%s" - %s\n' % (filename, err))
+            try:
+                with _Compressor._lock:
+                    self._dctPending[baseFilename] -= 1
+                    bIdle = self._dctPending[baseFilename] == 0
+                if bIdle and backupCount > 0:
+                    self.prune( baseFilename, backupCount )
+            except Exception,err:
+                sys.stderr.write( 'TLLog prune fail - filename:"%s" - %s\n' % (baseFilename, err))
+            finally:
+                self._queue.task_done()
+
+    def compress(self, filename):
+        fpIn = open( filename, 'rb' )
+        try:
+            fpOut = gzip.open( filename + '.gz.tmp', 'wb' )
+            try:
+                shutil.copyfileobj( fpIn, fpOut, 1 << 16 )
+            finally:
+                fpOut.close()
+        finally:
+            fpIn.close()
+        os.rename( filename + '.gz.tmp', filename + '.gz' )
+        os.remove( filename )
+
+    def prune(self, baseFilename, backupCount):
+        """ keep the newest backupCount rotated files """
+        for seq,filename in rotatedFiles( baseFilename )[:-backupCount]:
+            os.remove( filename )
+
+class _RotatingMixin(object):
+    """ rotate a file handler at a size or time boundary.
+
+        The file is renamed to <filename>.<YYYYmmdd-HHMMSS>-<NNNNNN> and a new file opened, the
+        renamed file is compressed and old files removed by the _Compressor thread. NNNNNN
+        counts up from the newest rotated file found when the handler is created and orders
+        the rotated files. Must come before the handler class, which must have baseFilename,
+        mode, stream and _open().
+
+        When the file cannot be renamed (open in another program on Windows) logging continues
+        to the same file and the rollover is tried again after ROLLOVER_RETRY seconds.
+    """
+    ROLLOVER_RETRY = 60.0
+
+    def initRotate(self, maxBytes=0, interval=0, backupCount=0, compress=True):
+        self.maxBytes = maxBytes
+        self.interval = interval
+        self.backupCount = backupCount
+        self.compress = compress
+        self.rolloverAt = self.nextRollover( time.time() )
+        self.retryAt = None
+        # the file is opened again after a rollover, do not truncate it when the rename failed
+        self.mode = self.mode.replace( 'w', 'a' )
+        lst = rotatedFiles( self.baseFilename )
+        self.sequence = lst[-1][0] + 1 if lst else 0
+
+    def nextRollover(self, now):
+        """ time of the next interval boundary in local time, intervals of a day rotate at midnight """
+        if not self.interval:
+            return None
+        offset = time.altzone if time.daylight and time.localtime( now ).tm_isdst else time.timezone
+        return ((int(now) - offset) // self.interval + 1) * self.interval + offset
+
+    def shouldRollover(self, record):
+        if self.retryAt is not None and record.created < self.retryAt:
+            return False
+        if self.rolloverAt is not None and record.created >= self.rolloverAt:
+            return True
+        return bool( self.maxBytes ) and self.stream.tell() >= self.maxBytes
+
+    def doRollover(self, now):
+        self.stream.close()
+        self.stream = None
+        stamp = time.strftime( '%Y%m%d-%H%M%S', time.localtime( now ))
+        rotated = '%s.%s-%06d' % (self.baseFilename, stamp, self.sequence)
+        try:
+            os.rename( self.baseFilename, rotated )
+        except OSError,err:
+            # skip this rollover, keep logging to the file
+            self.stream = self._open()
+            self.retryAt = now + self.ROLLOVER_RETRY
+            sys.stderr.write( 'TLLog rollover fail - filename:"%s" - %s\n' % (self.baseFilename, err))
+            return
+        self.sequence += 1
+        self.retryAt = None
+        self.stream = self._open()
+        self.rolloverAt = self.nextRollover( now )
+        _Compressor.submit( rotated, self.baseFilename, self.backupCount, self.compress )
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover( record ):
+                self.doRollover( record.created )
+        except Exception:
+            self.handleError(record)
+            return
+        super(_RotatingMixin, self).emit( record )
+
+class LogFileHandler(logging.FileHandler):
+    """ text log file, counts the bytes written while stats are on, see TLLog.statsStart() """
+    def format(self, record):
+        s = logging.FileHandler.format(self, record)
+        stats = TLLog._stats
+        if stats is not None:
+            stats.addBytes( record.name, record.levelno, len(s) + 1 )
+        return s
+
+class RotatingLogHandler(_RotatingMixin, LogFileHandler):
+    """ text log file rotated at maxBytes or every interval seconds, see _RotatingMixin """
+    def __init__(self, filename, mode='a', maxBytes=0, interval=0, backupCount=0, compress=True):
+        LogFileHandler.__init__(self, filename, mode=mode)
+        self.initRotate( maxBytes, interval, backupCount, compress )
+
+class RotatingBinaryLogHandler(_RotatingMixin, BinaryLogHandler):
+    """ binary log file rotated at maxBytes or every interval seconds, see _RotatingMixin """
+    def __init__(self, filename, mode='ab', maxBytes=0, interval=0, backupCount=0, compress=True):
+        BinaryLogHandler.__init__(self, filename, mode=mode)
+        self.initRotate( maxBytes, interval, backupCount, compress )
+
+class _Ring(object):
+    """ preallocated ring of the last capacity entries, the counter is thread safe under the GIL """
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lst = [None] * capacity
+        self.counter = itertools.count()
+
+    def add(self, entry):
+        self.lst[ next(self.counter) % self.capacity ] = entry
+
+    def drain(self):
+        """ return the entries and empty the ring """
+        lst = [entry for entry in self.lst if entry is not None]
+        self.lst = [None] * self.capacity
+        return lst
+
+class FlightRecorder(logging.Handler):
+    """ keep the last capacity records of each logger in memory and write them to a file
+        when a record of dumpLevel or above is logged, on dump() or on a signal.
+
+        Records from enabled loggers come through emit(), disabled debug calls of the loggers
+        given to TLLog.flightRecorderStart() are added directly by LogModule.debug() as
+        (created, levelno, threadName, msg, args) without creating a LogRecord. Messages are
+        only formatted when dumped. Dumped records are removed so each record is written once.
+
+        Records of dumpLevel logged within INCIDENT_SECS of the last dump they triggered are one
+        incident (eg the traceback and the message of excTraceback()), they are appended to
+        the same file instead of starting a new one.
+    """
+    INCIDENT_SECS = 1.0
+
+    def __init__(self, capacity=1000, dirname='.', prefix='flight', dumpLevel=logging.ERROR):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self.capacity = capacity
+        self.dirname = dirname
+        self.prefix = prefix
+        self.dumpLevel = dumpLevel
+        self.setFormatter( TLLog.fmt )
+        self._dctRings = {}
+        self._lockDump = threading.Lock()
+        self._tIncident = None
+        self.lstDumps = []
+
+    def _ring(self, name):
+        ring = self._dctRings.get( name )
+        if ring is None:
+            ring = self._dctRings.setdefault( name, _Ring( self.capacity ))
+        return ring
+
+    def add(self, name, levelno, msg, args):
+        self._ring( name ).add( (time.time(), levelno, threading.currentThread().name, msg, args) )
+
+    def emit(self, record):
+        self._ring( record.name ).add( record )
+        if record.levelno >= self.dumpLevel:
+            self.dump( '%s from %s' % (record.levelname, record.name), bIncident=True )
+
+    def _makeRecord(self, name, entry):
+        if isinstance( entry, logging.LogRecord ):
+            return entry
+        created, levelno, threadName, msg, args = entry
+        return logging.makeLogRecord( { 'name'       : name,
+                                        'threadName' : threadName,
+                                        'msg'        : msg,
+                                        'args'       : args or None,
+                                        'levelno'    : levelno,
+                                        'levelname'  : logging.getLevelName( levelno ),
+                                        'created'    : created,
+                                        'msecs'      : (created - int(created)) * 1000,
+                                        } )
+
+    def dump(self, reason=None, bIncident=False):
+        """ write all recorded records in time order to a new file, return the filename or None if empty.
+            bIncident for a dump triggered by a record, appended to the last file if part of the same incident.
+        """
+        with self._lockDump:
+            lst = []
+            for name,ring in self._dctRings.items():
+                lst.extend( [self._makeRecord( name, entry ) for entry in ring.drain()] )
+            if not lst:
+                return None
+            lst.sort( key=lambda record: record.created )
+            now = time.time()
+            bAppend = bIncident and self._tIncident is not None and now - self._tIncident < self.INCIDENT_SECS
+            self._tIncident = now if bIncident else None
+            if bAppend:
+                filename = self.lstDumps[-1]
+            else:
+                base = os.path.join( self.dirname, '%s-%s-%03d' % (self.prefix, time.strftime( '%Y%m%d-%H%M%S', time.localtime(now) ), int(now*1000) % 1000))
+                filename = base + '.log'
+                count = 1
+                # dumps in the same millisecond
+                while os.path.exists( filename ):
+                    filename = '%s-%d.log' % (base, count)
+                    count += 1
+            fp = open( filename, 'a' )
+            try:
+                fp.write( '-- flight recorder dump: %s - %d records --\n' % (reason or 'requested', len(lst)) )
+                for record in lst:
+                    try:
+                        line = self.format( record )
+                    except Exception,err:
+                        line = 'format fail - %r %r - %s' % (record.msg, record.args, err)
+                    if isinstance( line, unicode ):
+                        line = line.encode('utf-8')
+                    fp.write( line + '\n' )
+            finally:
+                fp.close()
+            if not bAppend:
+                self.lstDumps.append( filename )
+            return filename
+
+    def installSignal(self, signum=None):
+        """ dump on a signal, default SIGBREAK (Ctrl-Break) on windows and SIGUSR1 elsewhere.
+            The dump runs on its own thread, the signal may arrive while the main thread is in dump().
+        """
+        import signal
+        if signum is None:
+            signum = getattr( signal, 'SIGBREAK', None ) or signal.SIGUSR1
+        def handler(sig, frame):
+            thrd = threading.Thread( target=self.dump, args=('signal %d' % sig,), name='TLLogFlightDump' )
+            thrd.daemon = True
+            thrd.start()
+        signal.signal( signum, handler )
+        return signum
+
+# per thread log context tag, see TLLog.setContext()
+_threadContext = threading.local()
+
+class ContextRouter(logging.Handler):
+    """ one handler for all loggers that writes each record to the file of its context.
+
+        The context is a tag set per thread with TLLog.setContext(), eg the DUT serial number.
+        Opening or closing a context file only changes a dict, loggers are not touched.
+        Records without a context, or with a context that has no open file, are ignored here.
+        A record is written with the lock of the context handler held and only if the handler
+        is still the one routed, so a handler closed meanwhile is never written (and reopened).
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, logging.DEBUG)
+        self._dctHandlers = {}
+
+    def createLock(self):
+        # each context handler has its own lock, dispatch does not need one
+        self.lock = None
+
+    def handle(self, record):
+        tag = getattr( record, 'tlContext', None )
+        if tag is None:
+            tag = getattr( _threadContext, 'tag', None )
+            if tag is None:
+                return 0
+        hdl = self._dctHandlers.get( tag )
+        if hdl is None:
+            return 0
+        hdl.acquire()
+        try:
+            if self._dctHandlers.get( tag ) is not hdl:
+                # closed or replaced by another thread
+                return 0
+            return hdl.handle( record )
+        finally:
+            hdl.release()
+
+    def emit(self, record):
+        self.handle( record )
+
+    def open(self, tag, hdl):
+        """ route records of context tag to hdl, returns the handler replaced or None """
+        old = self._dctHandlers.get( tag )
+        self._dctHandlers[tag] = hdl
+        return old
+
+    def close(self, tag=None):
+        """ stop routing context tag and return its handler, with no tag close the router.
+            Close the handler returned, records being written to it finish first.
+        """
+        if tag is None:
+            logging.Handler.close(self)
+            return None
+        return self._dctHandlers.pop( tag, None )
+
+    def getContexts(self):
+        return self._dctHandlers.keys()
+
+class LogContext(object):
+    """ with statement that sets the log context of this thread and restores the previous one """
+    def __init__(self, tag):
+        self.tag = tag
+        self._prev = None
+
+    def __enter__(self):
+        self._prev = TLLog.setContext( self.tag )
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        TLLog.setContext( self._prev )
+        return False
+
+class _LevelStats(object):
+    """ counts, bytes and emit latency of one logger and level, the last samples are kept for p99 """
+    SAMPLES = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.timed = 0
+        self.secsTotal = 0.0
+        self.secsMin = None
+        self.secsMax = 0.0
+        self._ring = _Ring( self.SAMPLES )
+
+    def addTime(self, secs):
+        self.timed += 1
+        self.secsTotal += secs
+        if self.secsMin is None or secs < self.secsMin:
+            self.secsMin = secs
+        if secs > self.secsMax:
+            self.secsMax = secs
+        self._ring.add( secs )
+
+    def p99(self):
+        lst = sorted( [secs for secs in self._ring.lst if secs is not None] )
+        if not lst:
+            return None
+        return lst[ min( len(lst) - 1, int( len(lst) * 0.99 )) ]
+
+    def getStats(self):
+        return { 'count' : self.count,
+                 'bytes' : self.bytes,
+                 'min'   : self.secsMin,
+                 'avg'   : self.secsTotal / self.timed if self.timed else None,
+                 'max'   : self.secsMax if self.timed else None,
+                 'p99'   : self.p99(),
+                 }
+
+class LogStats(object):
+    """ logging metrics per logger and level, see TLLog.statsStart().
+
+        count   -- messages logged (passed the level check and any rate limit)
+        bytes   -- bytes written to log files, text and binary, counted for each file the record goes to.
+                   The console and flight recorder dumps are not counted.
+        latency -- seconds in the handlers for each message. In sync mode the time of the log call,
+                   in async mode the time of the writer thread, the enqueue cost is not included.
+    """
+    def __init__(self):
+        self._dctStats = {}
+        self._lock = threading.Lock()
+        self.tStart = time.time()
+
+    def _get(self, name, levelno):
+        key = (name, levelno)
+        stats = self._dctStats.get( key )
+        if stats is None:
+            stats = self._dctStats.setdefault( key, _LevelStats() )
+        return stats
+
+    def addCount(self, name, levelno):
+        with self._lock:
+            self._get( name, levelno ).count += 1
+
+    def addBytes(self, name, levelno, nbytes):
+        with self._lock:
+            self._get( name, levelno ).bytes += nbytes
+
+    def addTime(self, name, levelno, secs):
+        with self._lock:
+            self._get( name, levelno ).addTime( secs )
+
+    def getStats(self):
+        """ return { name : { levelname : { count, bytes, min, avg, max, p99 }}}, times in seconds """
+        dct = {}
+        with self._lock:
+            for (name, levelno),stats in self._dctStats.items():
+                dct.setdefault( name, {} )[ logging.getLevelName( levelno ) ] = stats.getStats()
+        return dct
+
+    def summary(self, count=5):
+        """ one line summary, totals and the loggers writing the most bytes """
+        dct = self.getStats()
+        lst = []
+        totalCount = totalBytes = 0
+        for name,dctLevels in dct.items():
+            for levelname,stats in dctLevels.items():
+                totalCount += stats['count']
+                totalBytes += stats['bytes']
+                lst.append( (stats['bytes'], stats['count'], name, levelname, stats) )
+        lst.sort( reverse=True )
+        secs = time.time() - self.tStart
+        lstTop = []
+        for nbytes,n,name,levelname,stats in lst[:count]:
+            s = '%s/%s n:%d bytes:%d' % (name, levelname, n, nbytes)
+            if stats['avg'] is not None:
+                s += ' avg:%.1fus p99:%.1fus' % (stats['avg']*1e6, stats['p99']*1e6)
+            lstTop.append( s )
+        return 'log stats %.0f secs - msgs:%d bytes:%d top: %s' % (secs, totalCount, totalBytes, ', '.join(lstTop))
+
+class _TimedLogger(object):
+    """ python logger proxy that counts and times the log calls of a LogModule while stats are on """
+    def __init__(self, log, stats):
+        self._log = log
+        self._stats = stats
+
+    def __getattr__(self, attr):
+        return getattr( self._log, attr )
+
+    def _call(self, levelno, func, msg, args, kwargs):
+        self._stats.addCount( self._log.name, levelno )
+        if TLLog._asyncWriter:
+            # handler time is measured by the writer thread
+            func( msg, *args, **kwargs )
+            return
+        t0 = time.time()
+        func( msg, *args, **kwargs )
+        self._stats.addTime( self._log.name, levelno, time.time() - t0 )
+
+    def debug(self, msg, *args, **kwargs):
+        self._call( logging.DEBUG, self._log.debug, msg, args, kwargs )
+
+    def info(self, msg, *args, **kwargs):
+        self._call( logging.INFO, self._log.info, msg, args, kwargs )
+
+    def warning(self, msg, *args, **kwargs):
+        self._call( logging.WARNING, self._log.warning, msg, args, kwargs )
+
+    warn = warning
+
+    def error(self, msg, *args, **kwargs):
+        self._call( logging.ERROR, self._log.error, msg, args, kwargs )
+
+    def critical(self, msg, *args, **kwargs):
+        self._call( logging.CRITICAL, self._log.critical, msg, args, kwargs )
+
+class _StatsReporter(threading.Thread):
+    """ log the stats summary line every interval seconds """
+    def __init__(self, stats, interval, log):
+        threading.Thread.__init__(self, name='TLLogStats')
+        self.daemon = True
+        self.stats = stats
+        self.interval = interval
+        self.log = log
+        self._evtStop = threading.Event()
+
+    def run(self):
+        while not self._evtStop.wait( self.interval ):
+            self.log.info( '%s', self.stats.summary() )
+
+    def stop(self):
+        self._evtStop.set()
+        self.join()
+
+# log argument types that are safe to format later on another thread
+_immutableTypes = (basestring, int, long, float, bool, type(None))
+
+class _QueueHandler(logging.Handler):
+    """ handler added to every logger in async mode, queues records for the _AsyncWriter """
+    def __init__(self, writer):
+        logging.Handler.__init__(self)
+        self.writer = writer
+
+    def handle(self, record):
+        # no handler lock, the queue is thread safe
+        if self.filter(record):
+            self.emit(record)
+
+    def emit(self, record):
+        try:
+            self.writer.put( self.prepare(record) )
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        """ merge the message and arguments so the record can be formatted later on another thread.
+            Arguments that cannot change are kept for handlers that store them (BinaryLogHandler).
+        """
+        # routing by context happens on the writer thread, keep the context of the logging thread
+        record.tlContext = getattr( _threadContext, 'tag', None )
+        args = record.args
+        if args and not (isinstance( args, tuple ) and all( [isinstance( arg, _immutableTypes ) for arg in args] )):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = TLLog.fmt.formatException( record.exc_info )
+            record.exc_info = None
+        return record
+
+class _AsyncWriter(threading.Thread):
+    """ owns the log handlers in async mode and writes the records queued by all loggers.
+        Handler changes are queued as commands so they are applied in order with the records.
+    """
+    def __init__(self, lstHandlers, maxSize, overflow):
+        threading.Thread.__init__(self, name='TLLogWriter')
+        self.daemon = True
+        self._queue = Queue.Queue( maxSize )
+        self._lstHandlers = list(lstHandlers)
+        self.overflow = overflow
+        self.dropped = 0
+        self.stopped = False
+        self._reported = 0
+        self._lastReport = 0.0
+        self._lockDropped = threading.Lock()
+
+    def put(self, record):
+        if self.stopped:
+            # logger switched back to sync after this record was handed to the queue handler
+            self._emit( record )
+            return
+        if self.overflow == ASYNC_BLOCK:
+            self._queue.put( record )
+        else:
+            try:
+                self._queue.put_nowait( record )
+            except Queue.Full:
+                with self._lockDropped:
+                    self.dropped += 1
+        if self.stopped:
+            # the writer may have drained the queue before the put
+            self._drain()
+
+    def command(self, func, *args):
+        """ run func(*args) on the writer thread after all records already queued """
+        self._queue.put( (func, args) )
+
+    def addHandler(self, hdl):
+        self.command( self._lstHandlers.append, hdl )
+
+    def removeHandler(self, hdl):
+        self.command( self._lstHandlers.remove, hdl )
+
+    def closeHandler(self, hdl):
+        self.command( hdl.close )
+
+    def flush(self, timeout=None):
+        """ wait until all records queued so far are written """
+        evt = threading.Event()
+        self.command( self._flush, evt )
+        evt.wait( timeout )
+
+    def _flush(self, evt):
+        if self.dropped != self._reported:
+            self._reportDropped()
+        for hdl in self._lstHandlers:
+            hdl.flush()
+        evt.set()
+
+    def stop(self):
+        """ write all queued records and exit the thread """
+        self._queue.put( None )
+        self.join()
+
+    def getHandlers(self):
+        return list(self._lstHandlers)
+
+    def _emit(self, record):
+        stats = TLLog._stats
+        if stats is not None:
+            t0 = time.time()
+        for hdl in self._lstHandlers:
+            if record.levelno >= hdl.level:
+                hdl.handle( record )
+        if stats is not None:
+            stats.addTime( record.name, record.levelno, time.time() - t0 )
+
+    def run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                if isinstance( item, logging.LogRecord ):
+                    self._emit( item )
+                else:
+                    # drops are reported to the handlers active when they happened
+                    if self.dropped != self._reported:
+                        self._reportDropped()
+                    func,args = item
+                    func( *args )
+                # report dropped records at most once a second
+                if self.dropped != self._reported:
+                    now = time.time()
+                    if now - self._lastReport >= 1.0:
+                        self._reportDropped()
+                        self._lastReport = now
+            except Exception,err:
+                print 'TLLogWriter fail - %s' % err
+        self.stopped = True
+        self._drain()
+        if self.dropped != self._reported:
+            self._reportDropped()
+        for hdl in self._lstHandlers:
+            hdl.flush()
+
+    def _drain(self):
+        """ write the records queued after stop() """
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            if isinstance( item, logging.LogRecord ):
+                self._emit( item )
+
+    def _reportDropped(self):
+        count = self.dropped - self._reported
+        self._reported += count
+        self._emit( logging.LogRecord( 'TLLog', logging.WARNING, __file__, 0,
+                                       '%d log records dropped - async queue full' % count, None, None ))
+
 class TLLog(object):
     # create logging formatters 
     FORMAT  = '%(asctime)s %(name)-8s [%(threadName)-4s] %(levelname)-8s %(message)s'
@@ -66,6 +1133,13 @@ class TLLog(object):
     _lstLogHandlers = [hdlStream]
     #_lstLogHandlers = []
 
+    # handlers currently attached to all loggers, or owned by the async writer
+    _lstActiveHandlers = [hdlStream]
+
+    # async writer thread, None when logging synchronously
+    _asyncWriter = None
+    _hdlQueue = None
+
     # dict of all loggers added with getLogger
     _dctLoggers = {}
 
@@ -83,26 +1157,142 @@ class TLLog(object):
     # dictionary of log files
     _dctLogFiles = {}
     
+    # flight recorder and the names of loggers with disabled debug recorded, see flightRecorderStart()
+    _flightRecorder = None
+    _lstFlightNames = None
+
+    # routes records to per context log files, created by contextOpen()
+    _router = None
+
+    # logging metrics and the summary reporter, see statsStart()
+    _stats = None
+    _statsReporter = None
+
+    # protects registration in getLogger()
+    _lockLoggers = threading.Lock()
+
     @staticmethod
     def getLogger(name):
-        """ register the module and add to dctLogModules """
-        lm = LogModule(name)
-        log = lm.getLog()
-        if not TLLog._dctLoggers.has_key( name ):
+        """ register the module and add to dctLogModules, return the registered LogModule """
+        lm = TLLog._dctLoggers.get( name )
+        if lm is not None:
+            return lm
+        with TLLog._lockLoggers:
+            lm = TLLog._dctLoggers.get( name )
+            if lm is not None:
+                return lm
             #print 'getLogger() -- adding "%s"' % name
+            lm = LogModule(name)
+            log = lm.getLog()
             log.propagate = False
             # add all of the log handlers
-            for hdl in TLLog._lstLogHandlers:
-                log.addHandler(hdl)
+            if TLLog._asyncWriter:
+                log.addHandler(TLLog._hdlQueue)
+            else:
+                for hdl in TLLog._lstActiveHandlers:
+                    log.addHandler(hdl)
             # set the log level
             level = TLLog._defLogLevel
             if name in TLLog._dctEnabledLoggers and TLLog._dctEnabledLoggers[name]:
                 level = LOG_ENABLE_LEVEL
-            log.setLevel( level )
+            lm.setLevel( level )
+            if TLLog._flightRecorder and (TLLog._lstFlightNames is None or name in TLLog._lstFlightNames):
+                lm._recorder = TLLog._flightRecorder
+            if TLLog._stats:
+                lm._log = _TimedLogger( lm._log, TLLog._stats )
             # save the logger locally 
             TLLog._dctLoggers[ name ] = lm
         return lm 
         
+    @staticmethod
+    def _addHandler(hdl):
+        """ attach a handler to all loggers, or to the writer in async mode """
+        if hdl in TLLog._lstActiveHandlers:
+            return
+        TLLog._lstActiveHandlers.append( hdl )
+        if TLLog._asyncWriter:
+            TLLog._asyncWriter.addHandler( hdl )
+        else:
+            for lm in TLLog._dctLoggers.values():
+                lm.getLog().addHandler(hdl)
+
+    @staticmethod
+    def _removeHandler(hdl):
+        """ detach a handler from all loggers, or from the writer in async mode """
+        if hdl not in TLLog._lstActiveHandlers:
+            return
+        TLLog._lstActiveHandlers.remove( hdl )
+        if TLLog._asyncWriter:
+            TLLog._asyncWriter.removeHandler( hdl )
+        else:
+            for lm in TLLog._dctLoggers.values():
+                lm.getLog().removeHandler(hdl)
+
+    @staticmethod
+    def _closeHandler(hdl):
+        """ close a handler after all records already logged are written """
+        if TLLog._asyncWriter:
+            TLLog._asyncWriter.closeHandler( hdl )
+        else:
+            hdl.close()
+
+    @staticmethod
+    def asyncStart(maxSize=10000, overflow=ASYNC_DROP):
+        """ start async logging. Loggers queue records and one writer thread owns all handlers.
+            maxSize  -- maximum number of queued records
+            overflow -- ASYNC_DROP to drop records when the queue is full (a count is logged), 
+                        ASYNC_BLOCK to wait for the writer 
+        """
+        if TLLog._asyncWriter:
+            return
+        if overflow not in (ASYNC_BLOCK, ASYNC_DROP):
+            raise ValueError( 'asyncStart() fail - overflow "%s" not valid' % overflow )
+        writer = _AsyncWriter( TLLog._lstActiveHandlers, maxSize, overflow )
+        writer.start()
+        with TLLog._lockLoggers:
+            TLLog._hdlQueue = _QueueHandler( writer )
+            TLLog._swapHandlers( TLLog._lstActiveHandlers, [TLLog._hdlQueue] )
+            TLLog._asyncWriter = writer
+
+    @staticmethod
+    def asyncStop():
+        """ write all queued records and return to logging on the calling thread """
+        writer = TLLog._asyncWriter
+        if writer is None:
+            return
+        with TLLog._lockLoggers:
+            TLLog._swapHandlers( [TLLog._hdlQueue], TLLog._lstActiveHandlers )
+            TLLog._asyncWriter = None
+        writer.stop()
+
+    @staticmethod
+    def _swapHandlers(lstRemove, lstAdd):
+        """ replace handlers of all loggers, the handler list of each logger is replaced in one
+            assignment so records logged by other threads meanwhile are neither lost nor written twice
+        """
+        for lm in TLLog._dctLoggers.values():
+            log = lm.getLog()
+            log.handlers = [hdl for hdl in log.handlers if hdl not in lstRemove] + list(lstAdd)
+
+    @staticmethod
+    def isAsync():
+        return TLLog._asyncWriter is not None
+
+    @staticmethod
+    def flush(timeout=None):
+        """ wait until all records logged so far are written """
+        if TLLog._asyncWriter:
+            TLLog._asyncWriter.flush( timeout )
+        else:
+            for hdl in TLLog._lstActiveHandlers:
+                hdl.flush()
+
+    @staticmethod
+    def refreshLevels():
+        """ update the cached level of all loggers, needed only after changing python loggers directly """
+        for lm in TLLog._dctLoggers.values():
+            lm.refreshLevel()
+
     @staticmethod
     def getLoggers():
         """ Return all Loggers created """
@@ -117,19 +1307,36 @@ class TLLog(object):
         return dct
         
     @staticmethod
-    def config(filename, lstAutoEnabled=None,defLogLevel=None):
+    def _createFileHandler(filename, mode, binary, dctRotate):
+        """ create a handler for a log file, binary for a BinaryLogHandler.
+            dctRotate has the rotating handler arguments maxBytes, interval, backupCount and compress.
+        """
+        if binary and dctRotate:
+            hdl = RotatingBinaryLogHandler( filename, mode=mode + 'b', **dctRotate )
+        elif binary:
+            hdl = BinaryLogHandler( filename, mode=mode + 'b' )
+        elif dctRotate:
+            hdl = RotatingLogHandler( filename, mode=mode, **dctRotate )
+        else:
+            hdl = LogFileHandler( filename, mode=mode )
+        hdl.setLevel(logging.DEBUG)
+        hdl.setFormatter(TLLog.fmt)
+        return hdl
+
+    @staticmethod
+    def config(filename, lstAutoEnabled=None,defLogLevel=None, binary=False, **dctRotate):
+        """ configure the main log file, binary=True writes the BinaryLogHandler format, see tl_logdecode.py.
+            Pass maxBytes, interval (seconds), backupCount or compress to rotate the file, see RotatingLogHandler.
+        """
         if lstAutoEnabled is not None:
             TLLog._lstAutoEnabled = lstAutoEnabled
         if defLogLevel is not None:
             TLLog._defLogLevel = defLogLevel
         # create file handler which logs even debug messages
-        TLLog._hdlMainFile = logging.FileHandler( filename )
-        TLLog._hdlMainFile.setLevel(logging.DEBUG)
-        TLLog._hdlMainFile.setFormatter(TLLog.fmt)
+        TLLog._hdlMainFile = TLLog._createFileHandler( filename, 'a', binary, dctRotate )
         TLLog._lstLogHandlers.append( TLLog._hdlMainFile )
         # add the new handler to all existing loggers
-        for lm in TLLog._dctLoggers.values():
-            lm._log.addHandler(TLLog._hdlMainFile)
+        TLLog._addHandler( TLLog._hdlMainFile )
         # set new auto enabled
         if lstAutoEnabled is not None:
             for name in TLLog._lstAutoEnabled:
@@ -139,25 +1346,23 @@ class TLLog(object):
                     TLLog._dctLoggers[name].enable()
             
     @staticmethod
-    def logFileOpen(filename,log=None, stopMainLog=True):
-        """ open a log file  """
+    def logFileOpen(filename,log=None, stopMainLog=True, binary=False, **dctRotate):
+        """ open a log file, binary=True writes the BinaryLogHandler format.
+            Pass maxBytes, interval (seconds), backupCount or compress to rotate the file.
+        """
         try:
             # create file handler which logs even debug messages
-            hdlFile = logging.FileHandler( filename, mode='w' )
-            hdlFile.setLevel(logging.DEBUG)
-            hdlFile.setFormatter(TLLog.fmt)
+            hdlFile = TLLog._createFileHandler( filename, 'w', binary, dctRotate )
             TLLog._lstLogHandlers.append( hdlFile )
             # add the new handler to all existing loggers
-            for lm in TLLog._dctLoggers.values():
-                lm._log.addHandler(hdlFile)
+            TLLog._addHandler( hdlFile )
             # add to dict of log files
             TLLog._dctLogFiles[filename] = hdlFile
             if log:
                 log.info('Log file "%s" Starting' % filename)
             # stop main log
             if stopMainLog and TLLog._hdlMainFile:
-                for lm in TLLog._dctLoggers.values():
-                    lm._log.removeHandler(TLLog._hdlMainFile)
+                TLLog._removeHandler( TLLog._hdlMainFile )
             
         except Exception,err:
             print 'logFileOpen() fail - filename:\"%s\" - %s' % (filename, err)
@@ -168,17 +1373,15 @@ class TLLog(object):
         try:
             # add main log back
             if TLLog._hdlMainFile:
-                for lm in TLLog._dctLoggers.values():
-                    lm._log.addHandler(TLLog._hdlMainFile)
+                TLLog._addHandler( TLLog._hdlMainFile )
             # get handle to log file
             hdlFile = TLLog._dctLogFiles[filename]
-            # close log file
-            hdlFile.close()
             # remove from list of log handlers
             TLLog._lstLogHandlers.remove( hdlFile )
             # remove handle from existing loggers
-            for lm in TLLog._dctLoggers.values():
-                lm._log.removeHandler(hdlFile)
+            TLLog._removeHandler( hdlFile )
+            # close log file
+            TLLog._closeHandler( hdlFile )
             # remove from dict of log files
             del TLLog._dctLogFiles[filename]
             if log:
@@ -187,6 +1390,117 @@ class TLLog(object):
         except Exception,err:
             print 'logFileClose() fail - filename:\"%s\" - %s' % (filename, err)
 
+    @staticmethod
+    def statsStart(interval=None):
+        """ start collecting logging metrics, see LogStats. With interval a summary line is logged
+            every interval seconds. Stats add a few microseconds to each message logged.
+        """
+        TLLog.statsStop()
+        stats = LogStats()
+        with TLLog._lockLoggers:
+            TLLog._stats = stats
+            for lm in TLLog._dctLoggers.values():
+                lm._log = _TimedLogger( lm._log, stats )
+        if interval:
+            TLLog._statsReporter = _StatsReporter( stats, interval, TLLog.getLogger('TLLog') )
+            TLLog._statsReporter.start()
+        return stats
+
+    @staticmethod
+    def statsStop():
+        """ stop collecting logging metrics, returns the final LogStats or None """
+        stats = TLLog._stats
+        if stats is None:
+            return None
+        if TLLog._statsReporter:
+            TLLog._statsReporter.stop()
+            TLLog._statsReporter = None
+        with TLLog._lockLoggers:
+            TLLog._stats = None
+            for lm in TLLog._dctLoggers.values():
+                lm._log = lm.getLog()
+        return stats
+
+    @staticmethod
+    def getStats():
+        """ return the logging metrics { name : { levelname : { count, bytes, min, avg, max, p99 }}} or {} when stats are off """
+        stats = TLLog._stats
+        if stats is None:
+            return {}
+        return stats.getStats()
+
+    @staticmethod
+    def setRateLimit(name, maxPerSec=None, burst=None, sampleN=None, reportInterval=10.0):
+        """ rate limit and/or sample the debug and info messages of logger name, see LogModule.setRateLimit() """
+        TLLog.getLogger( name ).setRateLimit( maxPerSec, burst, sampleN, reportInterval )
+
+    @staticmethod
+    def reportSuppressed():
+        """ log the suppressed message counts of all rate limited loggers now """
+        for lm in TLLog._dctLoggers.values():
+            lm.reportSuppressed( force=True )
+
+    @staticmethod
+    def setContext(tag):
+        """ set the log context of this thread, None clears it. Returns the previous context """
+        prev = getattr( _threadContext, 'tag', None )
+        _threadContext.tag = tag
+        return prev
+
+    @staticmethod
+    def getContext():
+        """ return the log context of this thread or None """
+        return getattr( _threadContext, 'tag', None )
+
+    @staticmethod
+    def contextOpen(tag, filename, log=None, binary=False, **dctRotate):
+        """ open a log file for context tag, records logged by threads in this context are written to it.
+            Other contexts and the main log file are not changed, see logFileOpen() to replace the main log.
+            Options are as for logFileOpen(). In async mode the file is used for records logged after
+            this call, records already queued go to the file the context had.
+        """
+        try:
+            with TLLog._lockLoggers:
+                if TLLog._router is None:
+                    TLLog._router = ContextRouter()
+                    TLLog._lstLogHandlers.append( TLLog._router )
+                    TLLog._addHandler( TLLog._router )
+            hdlFile = TLLog._createFileHandler( filename, 'w', binary, dctRotate )
+            if TLLog._asyncWriter:
+                # records already queued for the context are written to the file it had
+                TLLog._asyncWriter.command( TLLog._contextOpen, tag, hdlFile )
+            else:
+                TLLog._contextOpen( tag, hdlFile )
+            if log:
+                log.info( 'Context "%s" log file "%s" Starting', tag, filename )
+        except Exception,err:
+            print 'contextOpen() fail - tag:%s filename:\"%s\" - %s' % (tag, filename, err)
+
+    @staticmethod
+    def contextClose(tag, log=None):
+        """ close the log file of context tag """
+        if TLLog._router is None:
+            return
+        if log:
+            log.info( 'Context "%s" log file Closing', tag )
+        if TLLog._asyncWriter:
+            # records already queued for the context are written before it is closed
+            TLLog._asyncWriter.command( TLLog._contextClose, tag )
+        else:
+            TLLog._contextClose( tag )
+
+    @staticmethod
+    def _contextOpen(tag, hdlFile):
+        old = TLLog._router.open( tag, hdlFile )
+        if old is not None:
+            old.close()
+
+    @staticmethod
+    def _contextClose(tag):
+        hdlFile = TLLog._router.close( tag )
+        if hdlFile is not None:
+            hdlFile.close()
+
     @staticmethod
     def isEnabled( name ):
         try:
@@ -216,18 +1530,85 @@ class TLLog(object):
         except:
             pass
 
+    @staticmethod
+    def flightRecorderStart(lstNames=None, capacity=1000, dirname='.', dumpLevel=logging.ERROR, signum=None, installSignal=True):
+        """ start the flight recorder, returns the FlightRecorder.
+            Disabled debug calls of loggers in lstNames (all loggers if None) are recorded, the last
+            capacity records of each logger are written to a file on dumpLevel records, on
+            flightDump() and when signal signum is received (see FlightRecorder.installSignal).
+        """
+        TLLog.flightRecorderStop()
+        recorder = FlightRecorder( capacity, dirname, dumpLevel=dumpLevel )
+        TLLog._lstFlightNames = lstNames
+        TLLog._flightRecorder = recorder
+        for name,lm in TLLog._dctLoggers.items():
+            if lstNames is None or name in lstNames:
+                lm._recorder = recorder
+        TLLog._lstLogHandlers.append( recorder )
+        TLLog._addHandler( recorder )
+        if installSignal:
+            try:
+                recorder.installSignal( signum )
+            except ValueError, err:
+                # signals can only be installed from the main thread
+                print 'flightRecorderStart() signal not installed - %s' % err
+        return recorder
+
+    @staticmethod
+    def flightRecorderStop():
+        """ stop the flight recorder, records not dumped are discarded """
+        recorder = TLLog._flightRecorder
+        if recorder is None:
+            return
+        for lm in TLLog._dctLoggers.values():
+            lm._recorder = None
+        TLLog._flightRecorder = None
+        TLLog._lstFlightNames = None
+        TLLog._lstLogHandlers.remove( recorder )
+        TLLog._removeHandler( recorder )
+        TLLog._closeHandler( recorder )
+
+    @staticmethod
+    def flightDump(reason=None):
+        """ dump the flight recorder if running, returns the filename or None """
+        recorder = TLLog._flightRecorder
+        if recorder is None:
+            return None
+        return recorder.dump( reason )
+
     @staticmethod
     def shutdown():
-        """ shutdown the logging system """
+        """ shutdown the logging system, queued async records are written and rotated files compressed first """
+        TLLog.reportSuppressed()
+        if TLLog._stats and TLLog._statsReporter:
+            TLLog.getLogger('TLLog').info( '%s', TLLog._stats.summary() )
+        TLLog.statsStop()
+        TLLog.asyncStop()
         logging.shutdown()
+        _Compressor.wait()
 
     @staticmethod
     def setConsoleHandlerLevel(level=logging.INFO):
         # set the log level for console handler 
         TLLog.hdlStream.setLevel( level )
 
+def _parseLogOption(option):
+    """ split a log option "name", "name:maxPerSec" or "name/sampleN" and set the rate limit """
+    if ':' in option:
+        name, value = option.split(':', 1)
+        TLLog.setRateLimit( name, maxPerSec=float(value) )
+    elif '/' in option:
+        name, value = option.split('/', 1)
+        TLLog.setRateLimit( name, sampleN=int(value) )
+    else:
+        name = option
+    return name
+
 def logOptions(lstLogEnable, showLogs=False, log=None):
-    """ process all log options from the command line """
+    """ process all log options from the command line.
+        lstLogEnable is '*' or comma separated names, "name:N" limits the logger to N messages
+        per second and "name/N" logs 1 in N messages, eg "GPSD:50,xml_util/10"
+    """
     # if list logs then list and exit 
     dctLogMods = TLLog._dctLoggers
     if showLogs:
@@ -246,13 +1627,17 @@ def logOptions(lstLogEnable, showLogs=False, log=None):
         lstLogEnables = dctLogMods.keys()
     else:
         # log to enable are in list comma delimited
-        lstLogEnables = lstLogEnable.split(',')
+        lstLogEnables = [_parseLogOption( option ) for option in lstLogEnable.split(',')]
 
     for key,lm in dctLogMods.items():
+        TLLog._dctEnabledLoggers[ key ] = key in lstLogEnables
         if key in lstLogEnables:
             lm.enable()
         else:
             lm.disable()
+    # loggers registered later use the same options
+    for key in lstLogEnables:
+        TLLog._dctEnabledLoggers[ key ] = True
 
     # print the enabled logs    
     dctLogMods = TLLog._dctLoggers
@@ -260,3 +1645,272 @@ def logOptions(lstLogEnable, showLogs=False, log=None):
     if log:
         log.info( 'Enable logs - %s' % lst)
 
+if __name__ == '__main__':
+    # self test, raises on the first failure
+    import tempfile, StringIO
+    def check(bOK, sMsg):
+        if not bOK:
+            raise AssertionError( 'TLLog self test fail - %s' % sMsg )
+
+    def readLines(filename):
+        fp = open( filename, 'r' )
+        try:
+            return fp.readlines()
+        finally:
+            fp.close()
+
+    TLLog.setConsoleHandlerLevel( logging.CRITICAL )
+    dirTest = tempfile.mkdtemp()
+    mainLog = os.path.join( dirTest, 'main.log' )
+    TLLog.config( mainLog, defLogLevel=logging.DEBUG )
+
+    # async logging - no record is lost while logging is switched back to sync
+    logA = TLLog.getLogger( 'testA' )
+    TLLog.asyncStart( overflow=ASYNC_BLOCK )
+    evtGo = threading.Event()
+    def logLoop(n):
+        evtGo.wait()
+        for i in xrange(2000):
+            logA.info( 'async %d-%d', n, i )
+    lstThreads = [threading.Thread( target=logLoop, args=(n,) ) for n in range(4)]
+    for thrd in lstThreads:
+        thrd.start()
+    evtGo.set()
+    time.sleep( 0.002 )
+    TLLog.asyncStop()
+    for thrd in lstThreads:
+        thrd.join()
+    TLLog.flush()
+    lst = [line for line in readLines( mainLog ) if ' async ' in line]
+    check( len(lst) == 8000 and len(set(lst)) == 8000, 'asyncStop lost or duplicated records - %d written' % len(lst) )
+
+    # binary log - argument types survive the round trip, renamed threads keep their name
+    binLog = os.path.join( dirTest, 'test.blog' )
+    hdlBin = BinaryLogHandler( binLog, mode='wb' )
+    logBin = logging.getLogger( 'testBin' )
+    logBin.propagate = False
+    logBin.addHandler( hdlBin )
+    lstArgs = (True, False, None, 2**70, -2**70, -5, 1.5, u'\xb5s', 'text')
+    logBin.warning( '%s '*len(lstArgs), *lstArgs )
+    logBin.warning( 'd:%d %d', True, 2**70 )
+    thrd = threading.currentThread()
+    sName = thrd.name
+    thrd.name = 'renamed'
+    logBin.warning( 'after rename' )
+    thrd.name = sName
+    # str bytes that are not utf-8, unicode formats, many args, arg-less messages are not defined
+    logBin.warning( 'raw \xff data' )
+    logBin.warning( 'char:%c', '\xc3' )
+    logBin.warning( u'unicode:%s', u'\xb5' )
+    logBin.warning( '%d'*300, *range(300) )
+    nFormats = len(hdlBin._dctFormats)
+    for i in xrange(100):
+        logBin.warning( 'message %d' % i )
+    check( len(hdlBin._dctFormats) == nFormats, 'messages without arguments defined as formats' )
+    hdlBin._dctThreads = dict( [((i, 'fake'), i) for i in xrange(70000)] )
+    logBin.warning( 'thread %d', 70000 )
+    hdlBin.close()
+    lst = list( BinaryLogReader( binLog ).records() )
+    check( [record.getMessage() for record in lst[3:7]] == ['raw \xff data', 'char:\xc3', u'unicode:\xb5', ''.join( map( str, range(300) ))],
+           'binary text %r' % [record.getMessage() for record in lst[3:7]] )
+    check( type(lst[3].getMessage()) is str and lst[7].getMessage() == 'message 0' and lst[-1].threadName == sName, 'binary text records' )
+    check( lst[0].args == lstArgs and [type(arg) for arg in lst[0].args] == [type(arg) for arg in lstArgs], 'binary args %r' % (lst[0].args,) )
+    check( lst[1].getMessage() == 'd:1 1180591620717411303424', 'binary %%d of bool and long - %s' % lst[1].getMessage() )
+    check( lst[2].threadName == 'renamed' and lst[0].threadName == sName, 'binary thread names' )
+
+    # rotation - the newest backupCount segments are kept, other files are not touched
+    rotLog = os.path.join( dirTest, 'rot.log' )
+    open( rotLog + '.idx', 'w' ).close()
+    hdlRot = RotatingLogHandler( rotLog, maxBytes=3000, backupCount=3 )
+    hdlRot.setFormatter( logging.Formatter( '%(message)s' ))
+    logRot = logging.getLogger( 'testRot' )
+    logRot.propagate = False
+    logRot.addHandler( hdlRot )
+    for i in xrange(3000):
+        logRot.warning( 'record %d', i )
+    hdlRot.close()
+    _Compressor.wait()
+    lstSegments = [filename for seq,filename in rotatedFiles( rotLog )]
+    check( len(lstSegments) == 3 and all( [filename.endswith('.gz') for filename in lstSegments] ), 'rotated files %s' % lstSegments )
+    check( os.path.exists( rotLog + '.idx' ), 'rotation removed another file' )
+    lst = []
+    for filename in lstSegments:
+        fp = gzip.open( filename, 'rb' )
+        lst.extend( fp.readlines() )
+        fp.close()
+    lst.extend( readLines( rotLog ))
+    lstNumbers = [int( line.split()[1] ) for line in lst]
+    check( lstNumbers == range( lstNumbers[0], 3000 ), 'rotated records not the newest in order' )
+    hdlRot = RotatingLogHandler( rotLog, maxBytes=3000, backupCount=3 )
+    check( hdlRot.sequence == rotatedFiles( rotLog )[-1][0] + 1, 'rotation sequence not continued' )
+    hdlRot.close()
+    # a rename that fails skips the rollover, the file is not truncated and logging continues
+    failLog = os.path.join( dirTest, 'fail.log' )
+    hdlRot = RotatingLogHandler( failLog, mode='w', maxBytes=100, compress=False )
+    hdlRot.setFormatter( logging.Formatter( '%(message)s' ))
+    hdlRot.ROLLOVER_RETRY = 0.05
+    logRot.handlers = [hdlRot]
+    def renameFail(src, dst):
+        raise OSError( 13, 'Permission denied' )
+    rename, os.rename = os.rename, renameFail
+    stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+    try:
+        for i in xrange(20):
+            logRot.warning( 'kept %d', i )
+    finally:
+        os.rename = rename
+        sys.stderr, stderrFail = stderr, sys.stderr.getvalue()
+    check( [line.split()[1] for line in readLines( failLog )] == map( str, range(20) ), 'records lost when the rename failed' )
+    check( stderrFail.count( 'rollover fail' ) == 1, 'rollover retried before ROLLOVER_RETRY - %r' % stderrFail )
+    time.sleep( 0.1 )
+    logRot.warning( 'after retry' )
+    hdlRot.close()
+    check( len( rotatedFiles( failLog )) == 1 and readLines( failLog ) == ['after retry\n'], 'rollover not retried' )
+
+    # flight recorder - disabled debug calls are kept, a signal during a dump does not deadlock
+    import signal
+    logFR = TLLog.getLogger( 'testFR' )
+    logFR.setLevel( logging.INFO )
+    recorder = TLLog.flightRecorderStart( ['testFR'], capacity=10, dirname=dirTest )
+    for i in xrange(20):
+        logFR.debug( 'debug %d', i )
+    if hasattr( signal, 'SIGUSR1' ):
+        with recorder._lockDump:
+            os.kill( os.getpid(), signal.SIGUSR1 )
+            time.sleep( 0.1 )
+        tEnd = time.time() + 5.0
+        while not recorder.lstDumps and time.time() < tEnd:
+            time.sleep( 0.01 )
+    else:
+        TLLog.flightDump( 'test' )
+    check( len(recorder.lstDumps) == 1, 'flight recorder not dumped' )
+    lst = readLines( recorder.lstDumps[0] )
+    check( len(lst) == 11 and lst[-1].rstrip().endswith( 'debug 19' ), 'flight recorder dump %s' % lst )
+    logFR.error( 'error triggers a dump' )
+    check( len(recorder.lstDumps) == 2, 'flight recorder not dumped on error' )
+    # excTraceback() logs two errors, one incident is one dump file
+    recorder._tIncident -= recorder.INCIDENT_SECS
+    logFR.debug( 'before the exception' )
+    # as logged by excTraceback()
+    logFR.error( 'trackback: Traceback ... ValueError: incident' )
+    logFR.error( 'test : ValueError : incident' )
+    lst = readLines( recorder.lstDumps[-1] )
+    check( len(recorder.lstDumps) == 3 and 'before the exception' in lst[1] and lst[-1].rstrip().endswith( 'test : ValueError : incident' ),
+           'exception dumps %s %s' % (recorder.lstDumps, lst) )
+    recorder._tIncident -= recorder.INCIDENT_SECS
+    logFR.error( 'next incident' )
+    check( len(recorder.lstDumps) == 4, 'next incident not in a new file' )
+    TLLog.flightRecorderStop()
+
+    # log contexts - a tag reused for the next run in async mode, a close while another thread logs
+    logCtx = TLLog.getLogger( 'testCtx' )
+    run1 = os.path.join( dirTest, 'run1.log' )
+    run2 = os.path.join( dirTest, 'run2.log' )
+    TLLog.asyncStart()
+    with LogContext( 'slot1' ):
+        TLLog.contextOpen( 'slot1', run1 )
+        logCtx.info( 'run1' )
+        TLLog.contextClose( 'slot1' )
+        TLLog.contextOpen( 'slot1', run2 )
+        logCtx.info( 'run2' )
+        TLLog.flush()
+        check( TLLog._router.getContexts() == ['slot1'], 'contexts open %s' % TLLog._router.getContexts() )
+        TLLog.contextClose( 'slot1' )
+    TLLog.asyncStop()
+    check( [line.split()[-1] for line in readLines( run1 )] == ['run1'] and
+           [line.split()[-1] for line in readLines( run2 )] == ['run2'], 'context tag reused in async mode' )
+    check( TLLog._router.getContexts() == [], 'contexts not closed %s' % TLLog._router.getContexts() )
+    def logContext():
+        with LogContext( 'slot2' ):
+            for i in xrange(20000):
+                logCtx.info( 'ctx %d', i )
+    TLLog.contextOpen( 'slot2', run1 )
+    thrd = threading.Thread( target=logContext )
+    thrd.start()
+    time.sleep( 0.02 )
+    TLLog.contextClose( 'slot2' )
+    thrd.join()
+    lstNumbers = [int( line.split()[-1] ) for line in readLines( run1 )]
+    check( lstNumbers == range( len(lstNumbers) ), 'context file written after close' )
+
+    # rate limit - a logger that floods and goes quiet reports what was suppressed
+    logRL = TLLog.getLogger( 'testRL' )
+    TLLog.setRateLimit( 'testRL', maxPerSec=1, burst=5, reportInterval=0.2 )
+    for i in xrange(100):
+        logRL.info( 'flood %d', i )
+    time.sleep( 0.5 )
+    TLLog.flush()
+    lst = [line for line in readLines( mainLog ) if 'testRL' in line]
+    check( len(lst) == 6 and 'suppressed 95 messages' in lst[-1], 'rate limit report %s' % lst[-1:] )
+    TLLog.setRateLimit( 'testRL' )
+
+    # stats - bytes are counted for each file written, text and binary, not for the console
+    logStats = TLLog.getLogger( 'testStats' )
+    binStats = os.path.join( dirTest, 'stats.blog' )
+    TLLog.logFileOpen( binStats, stopMainLog=False, binary=True )
+    sizeMain = os.path.getsize( mainLog )
+    TLLog.setConsoleHandlerLevel( logging.INFO )
+    TLLog.hdlStream.stream = fpNull = open( os.devnull, 'w' )
+    stats = TLLog.statsStart()
+    for i in xrange(10):
+        logStats.info( 'stats %d %s', i, 'x'*i )
+    TLLog.statsStop()
+    TLLog.hdlStream.stream = sys.stderr
+    TLLog.setConsoleHandlerLevel( logging.CRITICAL )
+    fpNull.close()
+    TLLog.logFileClose( binStats )
+    dct = stats.getStats()['testStats']['INFO']
+    nBytes = os.path.getsize( mainLog ) - sizeMain + os.path.getsize( binStats ) - 1 - _binHeader.size
+    check( dct['count'] == 10 and dct['bytes'] == nBytes, 'stats bytes %d, %d written' % (dct['bytes'], nBytes) )
+
+    # stats on before async and logFileOpen() - handlers are changed on the python logger, not the stats proxy
+    dutLog = os.path.join( dirTest, 'dut.log' )
+    TLLog.statsStart()
+    TLLog.asyncStart()
+    TLLog.logFileOpen( dutLog )
+    logStats.info( 'dut record' )
+    TLLog.flush()
+    TLLog.asyncStop()
+    TLLog.logFileClose( dutLog )
+    TLLog.statsStop()
+    check( [line for line in readLines( dutLog ) if 'dut record' in line], 'record not written to the log file opened with stats on' )
+    check( not [line for line in readLines( mainLog ) if 'dut record' in line], 'record written to the stopped main log' )
+    check( logStats.getLog().handlers == TLLog._lstActiveHandlers, 'handlers after stats and async %s' % logStats.getLog().handlers )
+
+    # lazy arguments - only formatted when the message is written, levels are cached per LogModule
+    class CountStr(object):
+        count = 0
+        def __str__(self):
+            CountStr.count += 1
+            return 'counted'
+    logLazy = TLLog.getLogger( 'testLazy' )
+    logLazy.setLevel( logging.INFO )
+    argLazy = CountStr()
+    logLazy.debug( 'lazy %s', argLazy )
+    check( CountStr.count == 0 and not logLazy.isDebug(), 'disabled debug formatted its arguments' )
+    logLazy.setLevel( logging.DEBUG )
+    logLazy.debug( 'lazy %s', argLazy )
+    check( CountStr.count == 1 and logLazy.isDebug(), 'enabled debug formatted %d times' % CountStr.count )
+    logLazy.getLog().setLevel( logging.WARNING )
+    TLLog.refreshLevels()
+    logLazy.info( 'lazy %s', argLazy )
+    check( CountStr.count == 1 and not logLazy.isEnabledFor( logging.INFO ), 'refreshLevels() not applied' )
+    check( [line for line in readLines( mainLog ) if 'lazy counted' in line], 'lazy message not written' )
+
+    # getLogger - one registered LogModule per name, also when registered from many threads
+    lstModules = []
+    def register():
+        lstModules.append( TLLog.getLogger( 'testRegister' ))
+    lstThreads = [threading.Thread( target=register ) for n in range(8)]
+    for thrd in lstThreads:
+        thrd.start()
+    for thrd in lstThreads:
+        thrd.join()
+    check( len(set( [id(lm) for lm in lstModules] )) == 1 and TLLog.getLoggers()['testRegister'] is lstModules[0], 'getLogger() modules differ' )
+    check( len(lstModules[0].getLog().handlers) == len(TLLog._lstActiveHandlers), 'handlers added more than once' )
+    TLLog.enable( 'testLater' )
+    check( TLLog.getLogger( 'testLater' ).isEnabled(), 'logger enabled before registration not enabled' )
+
+    TLLog.shutdown()
+    shutil.rmtree( dirTest )
+    print 'TLLog self test passed'
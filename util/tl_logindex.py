@@ -0,0 +1,359 @@
+""" tl_logindex.py - sidecar index of TLLog text files for fast time, logger and level lookups
+
+    The index file <log>.idx holds chunks of the log, each chunk is a byte range covering at most
+    bucketSecs seconds and maxChunk bytes with a bit mask of the logger and level pairs in it.
+    A query reads the index, maps the log with mmap and only scans the chunks that can match.
+    Lines are parsed with TLLog.FORMAT, lines that do not match (eg tracebacks) belong to the
+    record before them. Building again after the log grew only indexes the new part.
+
+    Example:
+        python tl_logindex.py DBMain.log --start "2026-10-19 10:00" --end "2026-10-19 10:05" -n SQL -l WARNING
+        python tl_logindex.py --selftest
+"""
+import os, re, sys, time, mmap, marshal, logging, tempfile, shutil
+
+from tl_logger import TLLog
+
+__version__ = '1.0'
+
+log = TLLog.getLogger( 'logindex' )
+
+# regex for each field of TLLog.FORMAT, padded fields are followed by spaces
+_dctFieldRegex = {
+    'asctime'    : r'(?P<asctime>\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3})',
+    'name'       : r'(?P<name>\S+)',
+    'threadName' : r'(?P<threadName>.*?)',
+    'levelname'  : r'(?P<levelname>[A-Z]+)',
+    'message'    : r'(?P<message>.*)',
+    }
+
+def formatRegex(fmt=None, datefmt=None):
+    """ return a compiled regex that matches the first line of a record written with fmt """
+    if fmt is None:
+        fmt = TLLog.FORMAT
+    if datefmt is None:
+        datefmt = TLLog.DATEFMT
+    lst = ['^']
+    pos = 0
+    for match in re.finditer( r'%\((\w+)\)(-?\d*)s', fmt ):
+        for ch in fmt[pos:match.start()]:
+            lst.append( r' +' if ch == ' ' else re.escape(ch) )
+        field = match.group(1)
+        if field == 'asctime' and datefmt is not None:
+            lst.append( r'(?P<asctime>.+?)' )
+        else:
+            lst.append( _dctFieldRegex.get( field, r'.*?' ) )
+        if match.group(2):
+            lst.append( r' *' )
+        pos = match.end()
+    for ch in fmt[pos:]:
+        lst.append( r' +' if ch == ' ' else re.escape(ch) )
+    return re.compile( ''.join(lst) )
+
+class _TimeParser(object):
+    """ convert asctime to seconds, the date and time part is cached as it repeats for many lines """
+    def __init__(self, datefmt=None):
+        self.datefmt = datefmt if datefmt is not None else TLLog.DATEFMT
+        self._sLast = None
+        self._tLast = None
+
+    def parse(self, asctime):
+        if self.datefmt is None:
+            sDate, ms = asctime[:19], int(asctime[20:23]) / 1000.0
+            datefmt = '%Y-%m-%d %H:%M:%S'
+        else:
+            sDate, ms, datefmt = asctime, 0.0, self.datefmt
+        if sDate != self._sLast:
+            self._tLast = time.mktime( time.strptime( sDate, datefmt ))
+            self._sLast = sDate
+        return self._tLast + ms
+
+def parseTime(s):
+    """ parse a query time, 'YYYY-mm-dd HH:MM[:SS]' or seconds since the epoch """
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime( time.strptime( s, fmt ))
+        except ValueError:
+            pass
+    return float(s)
+
+class LogIndex(object):
+    """ build, save and query the index of a TLLog text file """
+    HEAD_SIZE = 256
+
+    def __init__(self, filename, indexFile=None, bucketSecs=60, maxChunk=1 << 20):
+        self.filename = filename
+        self.indexFile = indexFile or filename + '.idx'
+        self.bucketSecs = bucketSecs
+        self.maxChunk = maxChunk
+        self.reRecord = formatRegex()
+        self.clear()
+
+    def clear(self):
+        self.size = 0
+        self.head = ''
+        self.lstKeys = []       # 'name LEVEL' for each key id
+        self.dctKeyIds = {}
+        self.lstChunks = []     # (tFirst, tLast, offStart, offEnd, keyMask)
+
+    def _keyId(self, name, levelname):
+        key = '%s %s' % (name, levelname)
+        id = self.dctKeyIds.get( key )
+        if id is None:
+            id = self.dctKeyIds[key] = len(self.lstKeys)
+            self.lstKeys.append( key )
+        return id
+
+    def load(self):
+        """ read the index file, return False if missing or not usable """
+        try:
+            fp = open( self.indexFile, 'rb' )
+        except IOError:
+            return False
+        try:
+            try:
+                version, dct = marshal.load( fp )
+            finally:
+                fp.close()
+        except Exception,err:
+            log.warn( 'LogIndex - "%s" ignored - %s', self.indexFile, err )
+            return False
+        if version != __version__ or dct['bucketSecs'] != self.bucketSecs:
+            return False
+        self.size = dct['size']
+        self.head = dct['head']
+        self.lstKeys = dct['lstKeys']
+        self.dctKeyIds = dict( [(key, id) for id,key in enumerate(self.lstKeys)] )
+        self.lstChunks = dct['lstChunks']
+        return True
+
+    def save(self):
+        dct = { 'size'       : self.size,
+                'head'       : self.head,
+                'bucketSecs' : self.bucketSecs,
+                'lstKeys'    : self.lstKeys,
+                'lstChunks'  : self.lstChunks,
+                }
+        fp = open( self.indexFile, 'wb' )
+        try:
+            marshal.dump( (__version__, dct), fp )
+        finally:
+            fp.close()
+
+    def update(self):
+        """ load the index and index any part of the log added since, rebuild if the log was replaced.
+            Returns the number of bytes indexed.
+        """
+        fp = open( self.filename, 'rb' )
+        try:
+            head = fp.read( self.HEAD_SIZE )
+            size = os.fstat( fp.fileno() ).st_size
+            if not self.load() or size < self.size or not head.startswith( self.head ):
+                self.clear()
+            if size == self.size:
+                return 0
+            # the last chunk may be incomplete, index it again
+            offset = 0
+            if self.lstChunks:
+                offset = self.lstChunks.pop()[2]
+            fp.seek( offset )
+            self._index( fp, offset )
+            self.head = head[:self.size]
+            self.save()
+            return self.size - offset
+        finally:
+            fp.close()
+
+    def _index(self, fp, offset):
+        """ add chunks for the log from offset, only complete lines are indexed """
+        match = self.reRecord.match
+        parser = _TimeParser()
+        bucketSecs = self.bucketSecs
+        chunk = None
+        bucket = None
+        for line in fp:
+            if not line.endswith( '\n' ):
+                break
+            m = match( line )
+            if m:
+                t = parser.parse( m.group('asctime') )
+                keyBit = 1 << self._keyId( m.group('name'), m.group('levelname') )
+                b = int( t // bucketSecs )
+                if chunk is None or b != bucket or offset - chunk[2] >= self.maxChunk:
+                    if chunk is not None:
+                        chunk[3] = offset
+                        self.lstChunks.append( tuple(chunk) )
+                    chunk = [t, t, offset, offset, 0]
+                    bucket = b
+                chunk[1] = t
+                chunk[4] |= keyBit
+            # lines before the first record are not in any chunk
+            offset += len(line)
+        if chunk is not None:
+            chunk[3] = offset
+            self.lstChunks.append( tuple(chunk) )
+        self.size = offset
+
+    def _keyMask(self, lstNames, level):
+        mask = 0
+        for id,key in enumerate(self.lstKeys):
+            name, levelname = key.rsplit(' ', 1)
+            if lstNames and name not in lstNames:
+                continue
+            levelno = logging.getLevelName( levelname )
+            if isinstance( levelno, int ) and levelno < level:
+                continue
+            mask |= 1 << id
+        return mask
+
+    def query(self, tStart=None, tEnd=None, lstNames=None, level=logging.NOTSET):
+        """ generator of the lines of records matching, continuation lines follow their record """
+        mask = self._keyMask( lstNames, level )
+        lstChunks = [chunk for chunk in self.lstChunks
+                     if chunk[4] & mask and
+                        (tStart is None or chunk[1] >= tStart) and
+                        (tEnd is None or chunk[0] <= tEnd)]
+        if not lstChunks:
+            return
+        match = self.reRecord.match
+        parser = _TimeParser()
+        fp = open( self.filename, 'rb' )
+        try:
+            mm = mmap.mmap( fp.fileno(), 0, access=mmap.ACCESS_READ )
+            try:
+                for tFirst, tLast, offStart, offEnd, keyMask in lstChunks:
+                    # check the time of each record only for chunks partly in the range
+                    bCheckTime = (tStart is not None and tFirst < tStart) or (tEnd is not None and tLast > tEnd)
+                    bSelected = False
+                    pos = offStart
+                    while pos < offEnd:
+                        nl = mm.find( '\n', pos, offEnd )
+                        end = offEnd if nl < 0 else nl + 1
+                        line = mm[pos:end]
+                        pos = end
+                        m = match( line )
+                        if m:
+                            bSelected = (not lstNames or m.group('name') in lstNames)
+                            if bSelected and level:
+                                levelno = logging.getLevelName( m.group('levelname') )
+                                bSelected = not isinstance( levelno, int ) or levelno >= level
+                            if bSelected and bCheckTime:
+                                t = parser.parse( m.group('asctime') )
+                                bSelected = (tStart is None or t >= tStart) and (tEnd is None or t <= tEnd)
+                        if bSelected:
+                            yield line
+            finally:
+                mm.close()
+        finally:
+            fp.close()
+
+def selfTest():
+    """ index a generated log and check queries against a scan of all lines, raises on failure """
+    def check(bOK, sMsg):
+        if not bOK:
+            raise AssertionError( 'tl_logindex self test fail - %s' % sMsg )
+
+    def writeLog(filename, mode, tStart, count):
+        """ records every 0.5 secs from tStart, every 7th record has a traceback line """
+        lstNames = ['SQL', 'GPSD', 'expr']
+        lstLevels = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+        lst = []
+        fp = open( filename, mode )
+        try:
+            for n in xrange(count):
+                t = tStart + n * 0.5
+                asctime = time.strftime( '%Y-%m-%d %H:%M:%S', time.localtime( t )) + ',%03d' % int( (t % 1) * 1000 )
+                name = lstNames[n % 3]
+                levelname = lstLevels[n % 4]
+                lines = [TLLog.FORMAT % { 'asctime' : asctime, 'name' : name, 'threadName' : 'Main',
+                                          'levelname' : levelname, 'message' : 'record %d' % n } + '\n']
+                if n % 7 == 0:
+                    lines.append( '  File "x.py", line %d, in test\n' % n )
+                fp.write( ''.join(lines) )
+                lst.append( (t, name, logging.getLevelName( levelname ), lines) )
+        finally:
+            fp.close()
+        return lst
+
+    def scan(lstRecords, tStart, tEnd, lstNames, level):
+        lst = []
+        for t, name, levelno, lines in lstRecords:
+            if (tStart is None or t >= tStart) and (tEnd is None or t <= tEnd) and \
+               (not lstNames or name in lstNames) and levelno >= level:
+                lst.extend( lines )
+        return lst
+
+    dirTest = tempfile.mkdtemp()
+    try:
+        filename = os.path.join( dirTest, 'test.log' )
+        tStart = int( time.time() ) - 3600
+        lstRecords = writeLog( filename, 'w', tStart, 2000 )
+        index = LogIndex( filename, bucketSecs=60, maxChunk=4096 )
+        check( index.update() == os.path.getsize( filename ), 'whole log not indexed' )
+        lstQueries = [ (None, None, None, logging.NOTSET),
+                       (tStart + 100, tStart + 250.5, None, logging.NOTSET),
+                       (tStart + 300, None, ['SQL'], logging.WARNING),
+                       (None, tStart + 400, ['GPSD', 'expr'], logging.INFO),
+                       (tStart + 5000, None, None, logging.NOTSET) ]
+        for query in lstQueries:
+            check( list( index.query( *query )) == scan( lstRecords, *query ), 'query %s' % (query,) )
+        # the log grew, only the new part is indexed and the index file is used
+        size = os.path.getsize( filename )
+        lstRecords += writeLog( filename, 'a', tStart + 1000, 500 )
+        index = LogIndex( filename, bucketSecs=60, maxChunk=4096 )
+        check( index.update() < os.path.getsize( filename ) - size + 4096, 'log indexed again from the start' )
+        for query in lstQueries:
+            check( list( index.query( *query )) == scan( lstRecords, *query ), 'query after append %s' % (query,) )
+        # the log was replaced, the index is built again
+        lstRecords = writeLog( filename, 'w', tStart + 7, 300 )
+        index = LogIndex( filename, bucketSecs=60, maxChunk=4096 )
+        check( index.update() == os.path.getsize( filename ), 'replaced log not indexed again' )
+        for query in lstQueries:
+            check( list( index.query( *query )) == scan( lstRecords, *query ), 'query after replace %s' % (query,) )
+    finally:
+        shutil.rmtree( dirTest )
+    print 'tl_logindex self test passed'
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser( usage='%prog [options] logfile' )
+    parser.add_option( "-s",  "--start", dest="start", default=None,
+                       help='Start time "YYYY-mm-dd HH:MM[:SS]". Default is the start of the log' )
+    parser.add_option( "-e",  "--end", dest="end", default=None,
+                       help='End time "YYYY-mm-dd HH:MM[:SS]". Default is the end of the log' )
+    parser.add_option( "-n",  "--name", dest="lstNames", default=None,
+                       help="Comma separated list of logger names. Default is all" )
+    parser.add_option( "-l",  "--level", dest="level", default='NOTSET',
+                       help="Minimum level, DEBUG, INFO, WARNING, ERROR or CRITICAL. Default is all" )
+    parser.add_option( "-b",  "--bucket", dest="bucketSecs", type="int", default=60,
+                       help="Index bucket in seconds. Default is 60" )
+    parser.add_option( "",  "--build", action="store_true", dest="build", default=False,
+                       help="Only build or update the index" )
+    parser.add_option( "",  "--stats", action="store_true", dest="stats", default=False,
+                       help="Print the index size and the logger/level pairs found" )
+    parser.add_option( "",  "--selftest", action="store_true", dest="selftest", default=False,
+                       help="Run the self test and exit" )
+    (options, args) = parser.parse_args()
+    if options.selftest:
+        selfTest()
+        sys.exit(0)
+    if len(args) != 1:
+        parser.error( 'one log file expected' )
+    level = logging.getLevelName( options.level.upper() )
+    if not isinstance( level, int ):
+        parser.error( 'level "%s" not valid' % options.level )
+
+    index = LogIndex( args[0], bucketSecs=options.bucketSecs )
+    t0 = time.time()
+    nbytes = index.update()
+    if options.build or options.stats:
+        print 'indexed %d bytes in %.2f secs - %d chunks, log size %d' % (nbytes, time.time()-t0, len(index.lstChunks), index.size)
+    if options.stats:
+        for key in sorted(index.lstKeys):
+            print '  %s' % key
+    if not options.build:
+        tStart = parseTime( options.start ) if options.start else None
+        tEnd = parseTime( options.end ) if options.end else None
+        lstNames = options.lstNames.split(',') if options.lstNames else None
+        for line in index.query( tStart, tEnd, lstNames, level ):
+            sys.stdout.write( line )
@@ -36,24 +36,24 @@ class XMLReceiveQueue(object):
 
     def processData(self, binData):
         """ process the received data """
-        log.debug( 'processData - binData size=%d' % len(binData) )
+        log.debug( 'processData - binData size=%d', len(binData) )
         for ch in binData:
             self.stateFunc( ch )
 
     def _waitForFirstStartTag(self, ch):
-        log.debug('_waitForFirstStartTag() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForFirstStartTag() - ch=%c 0x%02.x', ch, ord(ch))
         if ch == '<':
             self.stateFunc = self._waitForStartTagName
             self.xmlData = ch
 
     def _waitForStartTag(self, ch):
-        log.debug('_waitForStartTag() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForStartTag() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if ch == '<':
             self.stateFunc = self._waitForStartTagName
 
     def _waitForStartTagName(self, ch):
-        log.debug('_waitForStartTagName() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForStartTagName() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if isalpha(ch):
             self.stateFunc = self._waitForStartTagNameFinish
@@ -62,32 +62,32 @@ class XMLReceiveQueue(object):
             self.stateFunc = self._waitForEndTagName
 
     def _waitForStartTagNameFinish(self, ch):
-        log.debug('_waitForStartTagNameFinish() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForStartTagNameFinish() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if isspace(ch):
             self.stateFunc = self._waitForStartTagClose
         elif ch == '>':
-            log.debug( 'startTag:%s' % self.startTag )
+            log.debug( 'startTag:%s', self.startTag )
             self.stkTags.append( self.startTag )
             self.stateFunc = self._waitForStartTag
         else:
             self.startTag += ch
 
     def _waitForStartTagClose(self, ch):
-        log.debug('_waitForStartTagClose() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForStartTagClose() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if ch == '>':
             if self.xmlData[-2] == '/':
-                log.debug( 'startTag / close:%s' % self.startTag )
+                log.debug( 'startTag / close:%s', self.startTag )
                 if self.startTag in self.lstCompTags:
                     self._completeXML()
             else:
-                log.debug( 'startTag:%s' % self.startTag )
+                log.debug( 'startTag:%s', self.startTag )
                 self.stkTags.append( self.startTag )
             self.stateFunc = self._waitForStartTag
 
     def _waitForEndTagClose(self, ch):
-        log.debug('_waitForEndTagClose() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForEndTagClose() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if ch == '/':
             self.stateFunc = self._waitForEndTagName
@@ -95,17 +95,17 @@ class XMLReceiveQueue(object):
             self.stateFunc = self._waitForEndTag
 
     def _waitForEndTagName(self, ch):
-        log.debug('_waitForEndTagName() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForEndTagName() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if isalpha(ch):
             self.stateFunc = self._waitForEndTagNameFinish
             self.endTag = ch
 
     def _waitForEndTagNameFinish(self, ch):
-        log.debug('_waitForEndTagNameFinish() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForEndTagNameFinish() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if isspace(ch) or ch == '>':
-            log.debug( 'endTag:%s pop:%s' % (self.endTag, self.stkTags.pop()) )
+            log.debug( 'endTag:%s pop:%s', self.endTag, self.stkTags.pop() )
             if ch == '>':
                 self.stateFunc = self._waitForStartTag
                 if self.endTag in self.lstCompTags:
@@ -116,7 +116,7 @@ class XMLReceiveQueue(object):
             self.endTag += ch
 
     def _waitForEndTagNameClose(self, ch):
-        log.debug('_waitForEndTagNameClose() - ch=%c 0x%02.x' % (ch, ord(ch)))
+        log.debug('_waitForEndTagNameClose() - ch=%c 0x%02.x', ch, ord(ch))
         self.xmlData += ch
         if ch == '>':
             self.stateFunc = self._waitForStartTag
@@ -124,7 +124,7 @@ class XMLReceiveQueue(object):
                 self._completeXML()
 
     def _completeXML( self ):
-        log.debug( '_completeXML() XML={%s}' % self.xmlData )
+        log.debug( '_completeXML() XML={%s}', self.xmlData )
         self.parseXMLMessage( self.xmlData )
         self.xmlData = ''
         self.stateFunc = self._waitForFirstStartTag